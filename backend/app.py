@@ -1,13 +1,33 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, url_for
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
-from datetime import datetime, timedelta
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta, date as date_type, time as time_type
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from functools import wraps
+from itertools import islice
+import base64
+import bisect
+import click
+import hashlib
+import heapq
 import jwt
 import json
 import os
 import logging
+import math
+import queue
+import re
+import secrets
+import threading
+import time
+
+import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,8 +54,136 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url or f'sqlite:///{os.path.joi
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
 
+# Server-sent events: every open stream pins a worker thread, so keep the cap below --threads
+app.config['SSE_MAX_STREAMS'] = int(os.environ.get('SSE_MAX_STREAMS', 4))
+app.config['SSE_HEARTBEAT_SECONDS'] = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+app.config['SSE_REPLAY_BUFFER'] = int(os.environ.get('SSE_REPLAY_BUFFER', 500))
+
 db = SQLAlchemy(app)
 
+app.config['FREEBUSY_CACHE_SIZE'] = int(os.environ.get('FREEBUSY_CACHE_SIZE', 1024))
+app.config['FREEBUSY_CACHE_TTL'] = float(os.environ.get('FREEBUSY_CACHE_TTL', 30))
+app.config['VENUE_HOLD_SECONDS'] = int(os.environ.get('VENUE_HOLD_SECONDS', 120))
+app.config['VENUE_HOLD_REAP_SECONDS'] = int(os.environ.get('VENUE_HOLD_REAP_SECONDS', 30))
+app.config['VENUE_HOLD_CACHE_SIZE'] = int(os.environ.get('VENUE_HOLD_CACHE_SIZE', 4096))
+app.config['CLASS_TEMPLATE_WEEKS'] = int(os.environ.get('CLASS_TEMPLATE_WEEKS', 4))
+app.config['CLASS_TEMPLATE_INTERVAL_HOURS'] = float(os.environ.get('CLASS_TEMPLATE_INTERVAL_HOURS', 6))  # 0 disables
+app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+app.config['IDEMPOTENCY_CACHE_SIZE'] = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 2048))
+app.config['IDEMPOTENCY_WAIT_SECONDS'] = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 30))
+app.config['CLASS_OCCUPANCY_TTL'] = float(os.environ.get('CLASS_OCCUPANCY_TTL', 30))
+app.config['CLASS_OCCUPANCY_RECONCILE_SECONDS'] = float(os.environ.get('CLASS_OCCUPANCY_RECONCILE_SECONDS', 60))
+app.config['CLASS_LISTING_CACHE_SIZE'] = int(os.environ.get('CLASS_LISTING_CACHE_SIZE', 256))
+app.config['CLASS_LISTING_CACHE_TTL'] = float(os.environ.get('CLASS_LISTING_CACHE_TTL', 120))
+app.config['TRAINER_CATALOG_CACHE_TTL'] = float(os.environ.get('TRAINER_CATALOG_CACHE_TTL', 300))
+app.config['TRAINER_DEFAULT_HOURS'] = os.environ.get('TRAINER_DEFAULT_HOURS', '06:00-21:00')
+app.config['REVIEW_PRIOR_WEIGHT'] = float(os.environ.get('REVIEW_PRIOR_WEIGHT', 10))  # reviews' worth of weight on the catalog mean
+app.config['REVIEW_TOP_SLICE'] = int(os.environ.get('REVIEW_TOP_SLICE', 5))
+app.config['REVIEW_CACHE_SIZE'] = int(os.environ.get('REVIEW_CACHE_SIZE', 1024))
+app.config['REVIEW_CACHE_TTL'] = float(os.environ.get('REVIEW_CACHE_TTL', 300))
+app.config['DIET_PLAN_CACHE_SIZE'] = int(os.environ.get('DIET_PLAN_CACHE_SIZE', 4096))
+app.config['DIET_WEIGHT_STEP'] = float(os.environ.get('DIET_WEIGHT_STEP', 0.5))  # kg; custom plans are cached per step
+app.config['FOOD_CATALOG_PATH'] = os.environ.get('FOOD_CATALOG_PATH', os.path.join(basedir, 'food_catalog.json'))
+app.config['TRAINER_RANK_DISTANCE_KM'] = float(os.environ.get('TRAINER_RANK_DISTANCE_KM', 10))
+
+# In-process caches
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    Entries are per worker process, so callers must invalidate on their own writes
+    and rely on the TTL to bound staleness from other workers.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item else None
+
+    def invalidate(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+class OccupancyMap:
+    """Thread-safe class_id -> [spots_booked, max_spots] map with per-entry freshness.
+
+    Booking paths adjust it write-through; entries older than ttl are treated as missing
+    so writes made by other workers show up after at most ttl seconds.
+    """
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, class_ids):
+        """{class_id: (spots_booked, max_spots)} for the fresh entries among class_ids"""
+        now = time.monotonic()
+        with self._lock:
+            return {cid: (entry[0], entry[1]) for cid in class_ids
+                    if (entry := self._data.get(cid)) is not None and entry[2] > now}
+
+    def set_many(self, rows):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for class_id, spots_booked, max_spots in rows:
+                self._data[class_id] = [spots_booked, max_spots, expires]
+
+    def adjust(self, class_id, delta):
+        with self._lock:
+            entry = self._data.get(class_id)
+            if entry is not None:
+                entry[0] = max(0, entry[0] + delta)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def discard(self, class_ids):
+        with self._lock:
+            for class_id in class_ids:
+                self._data.pop(class_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'ttl': self.ttl}
+
 # Models
 class Gym(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -82,6 +230,20 @@ class GymClass(db.Model):
     gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
 
+class GymReview(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    gym_id = db.Column(db.Integer, db.ForeignKey('gym.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('gym_id', 'user_id', name='uq_gym_review_user'),
+        # Top reviews slice: best rated, newest first
+        db.Index('ix_gym_review_top', 'gym_id', 'rating', 'created_at'),
+    )
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -102,6 +264,7 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
+    calendar_token = db.Column(db.String(64), unique=True, index=True)  # secret for the .ics feed URL
 
 class ScheduledWorkout(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -115,12 +278,76 @@ class ScheduledWorkout(db.Model):
     location = db.Column(db.String(200))
     notes = db.Column(db.Text)
     status = db.Column(db.String(20), default='scheduled')  # 'scheduled', 'completed', 'cancelled'
+    recurrence_rule = db.Column(db.Text)  # JSON object: {"days": [0, 2, 4], "interval": 1, "until"|"count", "exceptions": [...]}
+    series_end_date = db.Column(db.Date)  # last possible occurrence of a series; NULL for open-ended series
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     user = db.relationship('User', foreign_keys=[user_id], backref='scheduled_workouts')
     partner = db.relationship('User', foreign_keys=[partner_id], backref='partner_workouts')
+    occurrence_overrides = db.relationship('WorkoutOccurrenceOverride', backref='series', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Calendar range scans: WHERE user_id = ? AND date BETWEEN ? AND ? ORDER BY date, time
+        db.Index('ix_scheduled_workout_user_date_time', 'user_id', 'date', 'time'),
+        db.Index('ix_scheduled_workout_partner', 'partner_id'),
+    )
+
+class WorkoutOccurrenceOverride(db.Model):
+    """Per-occurrence status/notes for a recurring workout; only stored when they differ from the series"""
+    id = db.Column(db.Integer, primary_key=True)
+    workout_id = db.Column(db.Integer, db.ForeignKey('scheduled_workout.id'), nullable=False)
+    occurrence_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('workout_id', 'occurrence_date', name='uq_workout_occurrence'),
+    )
+
+class WorkoutDailyRollup(db.Model):
+    """Per-user, per-day, per-type workout counters maintained on every workout write"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    workout_type = db.Column(db.String(50), nullable=False)
+    scheduled_count = db.Column(db.Integer, default=0, nullable=False)
+    scheduled_minutes = db.Column(db.Integer, default=0, nullable=False)
+    completed_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_minutes = db.Column(db.Integer, default=0, nullable=False)
+    cancelled_count = db.Column(db.Integer, default=0, nullable=False)
+    cancelled_minutes = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'workout_type', name='uq_workout_daily_rollup'),
+    )
+
+class WorkoutWeeklyRollup(db.Model):
+    """Same counters as WorkoutDailyRollup, bucketed by ISO week (week_start is the Monday)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    week_start = db.Column(db.Date, nullable=False)
+    workout_type = db.Column(db.String(50), nullable=False)
+    scheduled_count = db.Column(db.Integer, default=0, nullable=False)
+    scheduled_minutes = db.Column(db.Integer, default=0, nullable=False)
+    completed_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_minutes = db.Column(db.Integer, default=0, nullable=False)
+    cancelled_count = db.Column(db.Integer, default=0, nullable=False)
+    cancelled_minutes = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'week_start', 'workout_type', name='uq_workout_weekly_rollup'),
+    )
+
+class WorkoutStreak(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    current_streak = db.Column(db.Integer, default=0, nullable=False)  # consecutive days ending at last_completed_date
+    longest_streak = db.Column(db.Integer, default=0, nullable=False)
+    last_completed_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Exercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -174,6 +401,27 @@ class PartnerPreference(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Sports Activity Models
+class ClassTemplate(db.Model):
+    """Weekly recurring class; StudioClass rows are materialized from it ahead of time"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    sport_type = db.Column(db.String(50), nullable=False)
+    instructor_name = db.Column(db.String(100))
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    time = db.Column(db.Time, nullable=False)
+    duration = db.Column(db.Integer, nullable=False)  # in minutes
+    level = db.Column(db.String(50))
+    intensity = db.Column(db.String(50))
+    max_spots = db.Column(db.Integer, default=12)
+    location = db.Column(db.String(200))
+    description = db.Column(db.Text)
+    price = db.Column(db.Float, default=0.0)
+    starts_on = db.Column(db.Date)  # no classes before this date
+    ends_on = db.Column(db.Date)  # nor after this one
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class StudioClass(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -193,6 +441,17 @@ class StudioClass(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    template_id = db.Column(db.Integer, db.ForeignKey('class_template.id'))  # set when materialized from a template
+
+    # Listings only ever show active, upcoming classes ordered by (date, time)
+    __table_args__ = (
+        db.Index('uq_studio_class_template_date', 'template_id', 'date', unique=True),
+        db.Index('ix_studio_class_active_date_time', 'date', 'time',
+                 sqlite_where=text('is_active = 1'), postgresql_where=text('is_active')),
+        db.Index('ix_studio_class_active_sport_date_time', 'sport_type', 'date', 'time',
+                 sqlite_where=text('is_active = 1'), postgresql_where=text('is_active')),
+    )
+
 class SportsVenue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -210,6 +469,13 @@ class SportsVenue(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_sports_venue_available_date_start', 'date', 'start_time',
+                 sqlite_where=text('is_available = 1'), postgresql_where=text('is_available')),
+        db.Index('ix_sports_venue_available_sport_date_start', 'sport_type', 'date', 'start_time',
+                 sqlite_where=text('is_available = 1'), postgresql_where=text('is_available')),
+    )
+
 class ClassBooking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -223,6 +489,29 @@ class ClassBooking(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='class_bookings')
     studio_class = db.relationship('StudioClass', foreign_keys=[class_id])
 
+    __table_args__ = (
+        db.Index('ix_class_booking_user', 'user_id'),
+        # At most one confirmed booking per user and class; cancelled rows are kept as history
+        db.Index('uq_class_booking_confirmed', 'user_id', 'class_id', unique=True,
+                 sqlite_where=text("status = 'confirmed'"), postgresql_where=text("status = 'confirmed'")),
+    )
+
+class ClassWaitlistEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # queue order within a class
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('studio_class.id'), nullable=False)
+    status = db.Column(db.String(20), default='waiting')  # 'waiting', 'promoted', 'left'
+    booking_id = db.Column(db.Integer, db.ForeignKey('class_booking.id'))  # set on promotion
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_class_waitlist_class_status', 'class_id', 'status', 'id'),
+        # One queued entry per user and class, however often the client retries
+        db.Index('uq_class_waitlist_waiting', 'user_id', 'class_id', unique=True,
+                 sqlite_where=text("status = 'waiting'"), postgresql_where=text("status = 'waiting'")),
+    )
+
 class VenueBooking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -236,6 +525,20 @@ class VenueBooking(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='venue_bookings')
     sports_venue = db.relationship('SportsVenue', foreign_keys=[venue_id])
 
+    __table_args__ = (
+        db.Index('ix_venue_booking_user', 'user_id'),
+        db.Index('uq_venue_booking_confirmed', 'venue_id', unique=True,
+                 sqlite_where=text("status = 'confirmed'"), postgresql_where=text("status = 'confirmed'")),
+    )
+
+class VenueHold(db.Model):
+    """Short-lived claim on a venue slot while the user confirms; at most one per slot"""
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('sports_venue.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Professional Training Models
 class ProfessionalTrainer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -253,9 +556,93 @@ class ProfessionalTrainer(db.Model):
     female_friendly = db.Column(db.Boolean, default=False)  # True for female trainers or trainers comfortable with female clients
     location = db.Column(db.String(200))
     languages = db.Column(db.Text)  # JSON array
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Listing order: rating, then review count, both descending (walked backwards)
+        db.Index('ix_trainer_available_rating', 'is_available', 'rating', 'review_count'),
+    )
+
+class TrainerTag(db.Model):
+    """Interned specialization, language or certification name"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'specialization', 'language', 'certification'
+    name = db.Column(db.String(100), nullable=False)
+    slug = db.Column(db.String(100), nullable=False)  # lowercased, whitespace-collapsed name
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'slug', name='uq_trainer_tag_kind_slug'),
+        db.Index('ix_trainer_tag_slug', 'slug'),
+    )
+
+class TrainerTagLink(db.Model):
+    trainer_id = db.Column(db.Integer, db.ForeignKey('professional_trainer.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('trainer_tag.id'), primary_key=True)
+
+    __table_args__ = (
+        # Tag -> trainers postings, intersected for AND filters
+        db.Index('ix_trainer_tag_link_tag_trainer', 'tag_id', 'trainer_id'),
+    )
+
+class TrainerTagCount(db.Model):
+    """Facet counts per tag, recomputed for the affected tags on every trainer write"""
+    tag_id = db.Column(db.Integer, db.ForeignKey('trainer_tag.id'), primary_key=True)
+    trainer_count = db.Column(db.Integer, default=0, nullable=False)
+    available_count = db.Column(db.Integer, default=0, nullable=False)
+
+class TrainerWorkingHours(db.Model):
+    """Weekly working window of a trainer; trainers with no rows use TRAINER_DEFAULT_HOURS every day"""
+    id = db.Column(db.Integer, primary_key=True)
+    trainer_id = db.Column(db.Integer, db.ForeignKey('professional_trainer.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_trainer_hours_trainer_weekday', 'trainer_id', 'weekday'),
+    )
+
+class TrainerReview(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    trainer_id = db.Column(db.Integer, db.ForeignKey('professional_trainer.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
+    comment = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('trainer_id', 'user_id', name='uq_trainer_review_user'),
+        # Top reviews slice: best rated, newest first
+        db.Index('ix_trainer_review_top', 'trainer_id', 'rating', 'created_at'),
+    )
+
+class ReviewAggregate(db.Model):
+    """Running rating totals per reviewed entity, kept in step with every review insert.
+
+    entity_id 0 holds the totals for the whole entity type, the prior for the Bayesian
+    mean. imported_* carry the seeded rating/review_count from before reviews were
+    stored; they have no per-star breakdown.
+    """
+    entity_type = db.Column(db.String(20), primary_key=True)  # 'gym', 'trainer'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Float, default=0.0, nullable=False)
+    stars_1 = db.Column(db.Integer, default=0, nullable=False)
+    stars_2 = db.Column(db.Integer, default=0, nullable=False)
+    stars_3 = db.Column(db.Integer, default=0, nullable=False)
+    stars_4 = db.Column(db.Integer, default=0, nullable=False)
+    stars_5 = db.Column(db.Integer, default=0, nullable=False)
+    imported_count = db.Column(db.Integer, default=0, nullable=False)
+    imported_sum = db.Column(db.Float, default=0.0, nullable=False)
+    bayes_rating = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_review_aggregate_bayes', 'entity_type', 'bayes_rating'),
+    )
+
 class DietPlan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -292,6 +679,36 @@ class HomeSessionBooking(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='home_session_bookings')
     trainer = db.relationship('ProfessionalTrainer', foreign_keys=[trainer_id])
 
+    __table_args__ = (
+        db.Index('ix_home_session_user_date_time', 'user_id', 'session_date', 'session_time'),
+        # Per-day interval lookups: one trainer when booking, every trainer when searching
+        db.Index('ix_home_session_trainer_date', 'trainer_id', 'session_date', 'status'),
+        db.Index('ix_home_session_date_trainer', 'session_date', 'trainer_id'),
+    )
+
+class BusyInterval(db.Model):
+    """Denormalized [starts_at, ends_at) of a user's commitments, maintained on every write"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    source_type = db.Column(db.String(20), nullable=False)  # 'workout', 'class', 'venue', 'home_session'
+    source_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_busy_interval_user_start', 'user_id', 'starts_at'),
+        db.Index('ix_busy_interval_source', 'source_type', 'source_id'),
+    )
+
+class IdempotencyRecord(db.Model):
+    """Stored outcome of a request sent with an Idempotency-Key; status_code is NULL while in flight"""
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of endpoint, caller and client key
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 # API Routes
 
 @app.route('/')
@@ -309,7 +726,9 @@ def index():
             'profile': '/api/profile',
             'partners_recommendations': '/api/partners/recommendations',
             'partners_search': '/api/partners/search',
-            'partners_connect': '/api/partners/connect'
+            'partners_connect': '/api/partners/connect',
+            'messages': '/api/messages',
+            'events_stream': '/api/events/stream'
         }
     })
 
@@ -321,6 +740,171 @@ def _generate_token(user_id: int):
     }
     return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
 
+def _token_user_id():
+    """User id from a valid Bearer token, or None"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    try:
+        payload = jwt.decode(auth_header[len('Bearer '):], app.config['SECRET_KEY'], algorithms=['HS256'])
+    except Exception:
+        return None
+    return payload.get('user_id')
+
+def _caller_user_id():
+    """Resolve the user a read is scoped to.
+
+    A valid Bearer token wins; the user_id query param is accepted for older clients
+    but must match the token when both are present. Returns (user_id, error_response).
+    """
+    token_user_id = _token_user_id()
+    user_id = request.args.get('user_id', type=int)
+    if token_user_id is not None:
+        if user_id is not None and user_id != token_user_id:
+            return None, (jsonify({'success': False, 'error': 'Forbidden'}), 403)
+        return token_user_id, None
+    if user_id is None:
+        return None, (jsonify({'success': False, 'error': 'user_id is required'}), 400)
+    return user_id, None
+
+# Idempotency keys
+# Completed responses are kept in memory and in idempotency_record. A claim row is committed
+# before the view runs, so duplicates in this worker wait on an Event and duplicates in other
+# workers poll that row until it is filled in.
+idempotency_cache = TTLCache(maxsize=app.config['IDEMPOTENCY_CACHE_SIZE'], ttl=app.config['IDEMPOTENCY_TTL_SECONDS'])
+_idempotency_inflight = {}
+_idempotency_lock = threading.Lock()
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+def _replay(stored, fingerprint):
+    stored_fingerprint, status_code, body = stored
+    if stored_fingerprint != fingerprint:
+        return jsonify({'success': False, 'error': 'Idempotency-Key was already used with a different request'}), 422
+    response = app.response_class(body, status=status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _stored_outcome(key, now):
+    """(fingerprint, status, body) for a completed key, 'pending' if in flight, else None"""
+    record = db.session.get(IdempotencyRecord, key)
+    if record is None or record.expires_at <= now:
+        return None
+    if record.status_code is None:
+        # A worker that died mid-request must not block the key forever
+        pending_limit = record.created_at + timedelta(seconds=app.config['IDEMPOTENCY_WAIT_SECONDS'])
+        return 'pending' if pending_limit > now else None
+    return (record.fingerprint, record.status_code, record.response_body)
+
+def _claim_idempotency_key(key, fingerprint):
+    """Commit a pending record for key; returns None on success or the existing outcome"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=app.config['IDEMPOTENCY_TTL_SECONDS'])
+    outcome = _stored_outcome(key, now)
+    if outcome is not None:
+        db.session.rollback()
+        return outcome
+    # Missing, expired or abandoned: (re)claim it
+    IdempotencyRecord.query.filter_by(key=key).delete(synchronize_session=False)
+    db.session.add(IdempotencyRecord(key=key, fingerprint=fingerprint, created_at=now, expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return 'pending'
+    return None
+
+def _await_idempotency_key(key, event):
+    """Wait for another execution of key; returns its stored outcome or None on timeout"""
+    deadline = time.monotonic() + app.config['IDEMPOTENCY_WAIT_SECONDS']
+    if event is not None:
+        event.wait(app.config['IDEMPOTENCY_WAIT_SECONDS'])
+        stored = idempotency_cache.get(key)
+        if stored is not None:
+            return stored
+    while time.monotonic() < deadline:
+        db.session.rollback()  # end the read transaction so we see the other worker's commit
+        outcome = _stored_outcome(key, datetime.utcnow())
+        if outcome != 'pending':
+            return outcome
+        time.sleep(0.05)
+    return None
+
+def _idempotency_key(client_key):
+    """Scope a client's Idempotency-Key to the endpoint and caller"""
+    data = request.get_json(silent=True)
+    # A non-object body (e.g. a JSON array) carries no user_id; fall back to the token alone
+    data = data if isinstance(data, dict) else {}
+    caller = _token_user_id() or data.get('user_id')
+    return hashlib.sha256(f'{request.endpoint}\0{caller}\0{client_key}'.encode()).hexdigest()
+
+def idempotent(view):
+    """Replay the first response for a repeated Idempotency-Key instead of re-running view"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get('Idempotency-Key')
+        if not client_key:
+            return view(*args, **kwargs)
+        if len(client_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'success': False, 'error': 'Idempotency-Key is too long'}), 400
+
+        key = _idempotency_key(client_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        stored = idempotency_cache.get(key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        with _idempotency_lock:
+            event = _idempotency_inflight.get(key)
+            leader = event is None
+            if leader:
+                event = _idempotency_inflight[key] = threading.Event()
+        if not leader:
+            stored = _await_idempotency_key(key, event)
+            if stored is None:
+                return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            return _replay(stored, fingerprint)
+
+        try:
+            outcome = _claim_idempotency_key(key, fingerprint)
+            if outcome == 'pending':
+                outcome = _await_idempotency_key(key, None)
+                if outcome is None:
+                    return jsonify({'success': False, 'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            if outcome is not None:
+                idempotency_cache.set(key, outcome)
+                return _replay(outcome, fingerprint)
+
+            response = app.make_response(view(*args, **kwargs))
+            record = db.session.get(IdempotencyRecord, key)
+            if response.status_code >= 500 or response.status_code in (409, 429):
+                # Let the client retry failures and contention for real
+                if record is not None:
+                    db.session.delete(record)
+            elif record is not None:
+                stored = (fingerprint, response.status_code, response.get_data(as_text=True))
+                record.status_code, record.response_body = stored[1], stored[2]
+                idempotency_cache.set(key, stored)
+            db.session.commit()
+            return response
+        finally:
+            with _idempotency_lock:
+                _idempotency_inflight.pop(key, None)
+            event.set()
+    return wrapper
+
+def _purge_idempotency_records():
+    removed = IdempotencyRecord.query.filter(
+        IdempotencyRecord.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete expired idempotency records"""
+    print(f"Removed {_purge_idempotency_records()} expired idempotency records")
+
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.get_json() or {}
@@ -427,8 +1011,152 @@ def profile():
         user.availability_schedule = json.dumps(data['availability_schedule']) if isinstance(data['availability_schedule'], dict) else data['availability_schedule']
     user.last_active = datetime.utcnow()
     db.session.commit()
+    if 'availability_schedule' in data or 'preferred_workout_time' in data:
+        _invalidate_freebusy([user.id])
     return jsonify({'success': True})
 
+# -------- REALTIME EVENTS ---------
+class _Subscription:
+    def __init__(self, user_id, backlog, needs_resync, queue_size):
+        self.user_id = user_id
+        self.backlog = backlog
+        self.needs_resync = needs_resync
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+class EventHub:
+    """In-process pub/sub for per-user events with a bounded replay buffer.
+
+    Events only live in this worker's memory, so ids are per worker and a client that
+    resumes from an id older than the buffer is told to resync over the REST endpoints.
+    """
+
+    def __init__(self, max_streams=4, replay_size=500, queue_size=100):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> set of _Subscription
+        self._replay = deque(maxlen=replay_size)
+        self._next_id = 1
+        self._max_streams = max_streams
+        self._queue_size = queue_size
+        self._active_streams = 0
+
+    def publish(self, user_id, event, data):
+        user_id = int(user_id)
+        with self._lock:
+            item = (self._next_id, user_id, event, data)
+            self._next_id += 1
+            self._replay.append(item)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(item)
+            except queue.Full:
+                # Slow consumer: its stream is closed and the client resumes via Last-Event-ID
+                sub.overflowed = True
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Register a stream, or return None when this worker is at its stream cap"""
+        with self._lock:
+            if self._active_streams >= self._max_streams:
+                return None
+            backlog = []
+            needs_resync = False
+            if last_event_id is not None:
+                oldest = self._replay[0][0] if self._replay else self._next_id
+                needs_resync = last_event_id < oldest - 1 or last_event_id >= self._next_id
+                if not needs_resync:
+                    backlog = [item for item in self._replay if item[0] > last_event_id and item[1] == user_id]
+            sub = _Subscription(user_id, backlog, needs_resync, self._queue_size)
+            self._subscribers.setdefault(user_id, set()).add(sub)
+            self._active_streams += 1
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+                self._active_streams -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_streams': self._active_streams,
+                'max_streams': self._max_streams,
+                'buffered_events': len(self._replay),
+                'last_event_id': self._next_id - 1,
+            }
+
+event_hub = EventHub(
+    max_streams=app.config['SSE_MAX_STREAMS'],
+    replay_size=app.config['SSE_REPLAY_BUFFER'],
+)
+
+def _sse_format(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _user_summary(user):
+    return {
+        'id': user.id,
+        'name': user.name,
+        'username': user.username,
+        'avatar_url': user.avatar_url,
+        'fitness_level': user.fitness_level,
+    }
+
+@app.route('/api/events/stream', methods=['GET'])
+def events_stream():
+    """Server-sent event stream of partner requests, responses and messages for one user.
+
+    The stream never touches the database: writes publish their payloads to the hub.
+    """
+    user_id = _token_user_id()
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    # Browsers send Last-Event-ID on reconnect; the query param covers the first connect
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    sub = event_hub.subscribe(user_id, last_event_id)
+    if sub is None:
+        return jsonify({'success': False, 'error': 'Too many open event streams, retry later'}), 503, {'Retry-After': '30'}
+
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            if sub.needs_resync:
+                yield 'event: resync\ndata: {}\n\n'
+            for event_id, _, event, data in sub.backlog:
+                yield _sse_format(event_id, event, data)
+            while not sub.overflowed:
+                try:
+                    event_id, _, event, data = sub.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield _sse_format(event_id, event, data)
+            yield 'event: resync\ndata: {}\n\n'
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/events/stats', methods=['GET'])
+def events_stats():
+    return jsonify({'success': True, 'stats': event_hub.stats()})
+
 # -------- PARTNERS ---------
 @app.route('/api/partners/search', methods=['GET'])
 def partners_search():
@@ -482,6 +1210,14 @@ def partners_connect():
     fp = FitnessPartner(user_id=user_id, partner_id=partner_id, status='pending')
     db.session.add(fp)
     db.session.commit()
+
+    sender = User.query.get(user_id)
+    event_hub.publish(partner_id, 'partner_request', {
+        'id': fp.id,
+        'from': _user_summary(sender) if sender else {'id': user_id},
+        'message': 'Wants to connect',
+        'timestamp': fp.created_at.isoformat(),
+    })
     return jsonify({'success': True, 'message': 'Connection request sent'})
 
 @app.route('/api/partners/recommendations', methods=['GET'])
@@ -606,6 +1342,10 @@ def partners_accept():
             reciprocal.updated_at = datetime.utcnow()
 
         db.session.commit()
+
+        payload = {'request_id': fp.id, 'user_id': user_id, 'partner_id': partner_id, 'status': 'accepted'}
+        event_hub.publish(partner_id, 'partner_accepted', payload)
+        event_hub.publish(user_id, 'partner_accepted', payload)
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error accepting partner request: {str(e)}")
@@ -628,12 +1368,198 @@ def partners_decline():
         fp.status = 'declined'
         fp.updated_at = datetime.utcnow()
         db.session.commit()
+
+        event_hub.publish(partner_id, 'partner_declined', {
+            'request_id': fp.id, 'user_id': user_id, 'partner_id': partner_id, 'status': 'declined',
+        })
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error declining partner request: {str(e)}")
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Batch variants: one IN lookup for existing edges and one commit for the whole list
+MAX_PARTNER_BATCH = 500
+
+def _parse_partner_batch(data):
+    user_id = data.get('user_id')
+    partner_ids = data.get('partner_ids')
+    if not user_id or not isinstance(partner_ids, list) or not partner_ids:
+        return None, None, 'user_id and a non-empty partner_ids list are required'
+    if len(partner_ids) > MAX_PARTNER_BATCH:
+        return None, None, f'At most {MAX_PARTNER_BATCH} partner_ids per request'
+    try:
+        user_id = int(user_id)
+        # Keep request order but drop duplicates
+        partner_ids = list(dict.fromkeys(int(pid) for pid in partner_ids))
+    except (TypeError, ValueError):
+        return None, None, 'IDs must be integers'
+    return user_id, partner_ids, None
+
+@app.route('/api/partners/connect/batch', methods=['POST'])
+def partners_connect_batch():
+    try:
+        user_id, partner_ids, error = _parse_partner_batch(request.get_json() or {})
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+
+        existing = {
+            fp.partner_id: fp.status
+            for fp in FitnessPartner.query.filter(
+                FitnessPartner.user_id == user_id,
+                FitnessPartner.partner_id.in_(partner_ids)
+            )
+        }
+        known_users = {
+            row.id for row in db.session.query(User.id).filter(User.id.in_(partner_ids + [user_id]))
+        }
+        if user_id not in known_users:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+
+        results = []
+        new_edges = []
+        now = datetime.utcnow()
+        for pid in partner_ids:
+            if pid == user_id:
+                results.append({'partner_id': pid, 'success': False, 'error': 'Invalid user/partner'})
+            elif pid not in known_users:
+                results.append({'partner_id': pid, 'success': False, 'error': 'User not found'})
+            elif pid in existing:
+                results.append({'partner_id': pid, 'success': False, 'error': f'Connection already {existing[pid]}'})
+            else:
+                new_edges.append(FitnessPartner(user_id=user_id, partner_id=pid, status='pending', created_at=now, updated_at=now))
+                results.append({'partner_id': pid, 'success': True})
+
+        db.session.add_all(new_edges)
+        db.session.flush()
+        # Read generated ids before commit expires the instances
+        created = [(fp.id, fp.partner_id) for fp in new_edges]
+        db.session.commit()
+
+        if created:
+            sender = _user_summary(User.query.get(user_id))
+            for request_id, pid in created:
+                event_hub.publish(pid, 'partner_request', {
+                    'id': request_id,
+                    'from': sender,
+                    'message': 'Wants to connect',
+                    'timestamp': now.isoformat(),
+                })
+        return jsonify({'success': True, 'sent': len(new_edges), 'results': results})
+    except Exception as e:
+        logger.error(f"Error sending partner requests in batch: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _respond_partner_batch(new_status):
+    user_id, partner_ids, error = _parse_partner_batch(request.get_json() or {})
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    # Incoming requests and our own reciprocal edges in one query
+    edges = FitnessPartner.query.filter(
+        db.or_(
+            db.and_(FitnessPartner.partner_id == user_id, FitnessPartner.user_id.in_(partner_ids)),
+            db.and_(FitnessPartner.user_id == user_id, FitnessPartner.partner_id.in_(partner_ids))
+        )
+    ).all()
+    incoming = {fp.user_id: fp for fp in edges if fp.partner_id == user_id and fp.status == 'pending'}
+    reciprocal = {fp.partner_id: fp for fp in edges if fp.user_id == user_id}
+
+    request_ids = {pid: fp.id for pid, fp in incoming.items()}
+    results = []
+    for pid in partner_ids:
+        if pid in incoming:
+            results.append({'partner_id': pid, 'request_id': request_ids[pid], 'success': True})
+        else:
+            results.append({'partner_id': pid, 'success': False, 'error': 'No pending request found'})
+
+    matched = [pid for pid in partner_ids if pid in incoming]
+    now = datetime.utcnow()
+    if matched:
+        update_ids = [request_ids[pid] for pid in matched]
+        if new_status == 'accepted':
+            update_ids += [reciprocal[pid].id for pid in matched if pid in reciprocal]
+            db.session.add_all([
+                FitnessPartner(user_id=user_id, partner_id=pid, status='accepted', created_at=now, updated_at=now)
+                for pid in matched if pid not in reciprocal
+            ])
+        FitnessPartner.query.filter(FitnessPartner.id.in_(update_ids)).update(
+            {FitnessPartner.status: new_status, FitnessPartner.updated_at: now},
+            synchronize_session=False
+        )
+    db.session.commit()
+
+    event = 'partner_accepted' if new_status == 'accepted' else 'partner_declined'
+    for pid in matched:
+        payload = {'request_id': request_ids[pid], 'user_id': user_id, 'partner_id': pid, 'status': new_status}
+        event_hub.publish(pid, event, payload)
+        if new_status == 'accepted':
+            event_hub.publish(user_id, event, payload)
+    return jsonify({'success': True, new_status: len(matched), 'results': results})
+
+@app.route('/api/partners/accept/batch', methods=['POST'])
+def partners_accept_batch():
+    try:
+        return _respond_partner_batch('accepted')
+    except Exception as e:
+        logger.error(f"Error accepting partner requests in batch: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/partners/decline/batch', methods=['POST'])
+def partners_decline_batch():
+    try:
+        return _respond_partner_batch('declined')
+    except Exception as e:
+        logger.error(f"Error declining partner requests in batch: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/messages', methods=['POST'])
+def send_message():
+    try:
+        data = request.get_json() or {}
+        body = data.get('message')
+        body = body.strip() if isinstance(body, str) else ''
+        if not data.get('sender_id') or not data.get('receiver_id') or not body:
+            return jsonify({'success': False, 'error': 'sender_id, receiver_id and message are required'}), 400
+        try:
+            sender_id = int(data['sender_id'])
+            receiver_id = int(data['receiver_id'])
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'IDs must be integers'}), 400
+        known_users = {
+            row.id for row in db.session.query(User.id).filter(User.id.in_([sender_id, receiver_id]))
+        }
+        if sender_id not in known_users or receiver_id not in known_users:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+
+        msg = Message(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            message=body,
+            message_type=data.get('message_type', 'text'),
+        )
+        db.session.add(msg)
+        db.session.commit()
+
+        payload = {
+            'id': msg.id,
+            'sender_id': msg.sender_id,
+            'receiver_id': msg.receiver_id,
+            'message': msg.message,
+            'message_type': msg.message_type,
+            'sent_at': msg.sent_at.isoformat(),
+        }
+        event_hub.publish(receiver_id, 'message', payload)
+        event_hub.publish(sender_id, 'message', payload)
+        return jsonify({'success': True, 'message_id': msg.id})
+    except Exception as e:
+        logger.error(f"Error sending message: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Gym endpoints
 @app.route('/api/gyms', methods=['GET'])
 def get_gyms():
@@ -675,7 +1601,10 @@ def get_gyms():
 
         # Apply sorting
         if sort_by == 'rating':
-            query = query.order_by(Gym.rating.desc())
+            # Bayesian mean from the maintained aggregates, so a single 5-star review does not top the list
+            query = query.outerjoin(ReviewAggregate, db.and_(
+                ReviewAggregate.entity_type == 'gym', ReviewAggregate.entity_id == Gym.id
+            )).order_by(db.func.coalesce(ReviewAggregate.bayes_rating, Gym.rating).desc(), Gym.review_count.desc())
         elif sort_by == 'price':
             query = query.order_by(Gym.price_per_month.asc())
         elif sort_by == 'name':
@@ -751,7 +1680,8 @@ def get_gym(gym_id):
                 'weekends': next((h.open_time + ' - ' + h.close_time for h in gym.operating_hours if h.day_of_week == 'weekends'), '')
             },
             'equipment': [eq.name for eq in gym.equipment],
-            'classes': [cls.name for cls in gym.classes]
+            'classes': [cls.name for cls in gym.classes],
+            'reviews': _review_summary('gym', gym.id),
         }
 
         return jsonify({
@@ -763,76 +1693,1177 @@ def get_gym(gym_id):
         logger.error(f"Error fetching gym {gym_id}: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Workout scheduling endpoints
-@app.route('/api/workouts', methods=['GET'])
-def get_workouts():
-    try:
-        user_id = request.args.get('user_id', type=int)
+# Reviews
+REVIEW_STARS = range(1, 6)
+top_reviews_cache = TTLCache(maxsize=app.config['REVIEW_CACHE_SIZE'], ttl=app.config['REVIEW_CACHE_TTL'])
+
+def _review_entities():
+    """entity_type -> (entity model, review model, review foreign key)"""
+    return {
+        'gym': (Gym, GymReview, GymReview.gym_id),
+        'trainer': (ProfessionalTrainer, TrainerReview, TrainerReview.trainer_id),
+    }
+
+def _refresh_review_ratings(entity_type, entity_ids):
+    """Recompute the Bayesian mean and the entity's rating/review_count from its aggregate row.
+
+    Runs as UPDATEs in the caller's transaction. The prior is the type's current mean, so
+    other entities' stored means lag it slightly until the next rebuild.
+    """
+    model = _review_entities()[entity_type][0]
+    agg = ReviewAggregate.__table__
+    totals = agg.alias('totals')
+    prior_weight = app.config['REVIEW_PRIOR_WEIGHT']
+    prior_mean = db.select(
+        db.case((totals.c.review_count > 0, totals.c.rating_sum / totals.c.review_count), else_=0.0)
+    ).where(totals.c.entity_type == entity_type, totals.c.entity_id == 0).scalar_subquery()
+    db.session.execute(
+        db.update(agg)
+        .where(agg.c.entity_type == entity_type, agg.c.entity_id.in_(entity_ids))
+        .values(bayes_rating=(prior_weight * db.func.coalesce(prior_mean, 0.0) + agg.c.rating_sum)
+                / (prior_weight + agg.c.review_count))
+        .execution_options(synchronize_session=False)
+    )
+    own = lambda column: db.select(column).where(
+        agg.c.entity_type == entity_type, agg.c.entity_id == model.id
+    ).scalar_subquery()
+    db.session.execute(
+        db.update(model)
+        .where(model.id.in_(entity_ids))
+        .values(
+            review_count=own(agg.c.review_count),
+            # PostgreSQL only has round(numeric, int)
+            rating=own(db.func.round(db.cast(agg.c.rating_sum / db.func.nullif(agg.c.review_count, 0), db.Numeric), 2)),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def _add_review(entity_type, entity_id, user_id, rating, comment=None):
+    """Insert a review and fold it into the aggregates; the caller commits.
+
+    Raises IntegrityError (after rolling back) if the user already reviewed this entity.
+    """
+    _, review_model, key = _review_entities()[entity_type]
+    review = review_model(**{key.key: entity_id}, user_id=user_id, rating=rating, comment=comment)
+    db.session.add(review)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        raise
+    # Entities added since startup still carry only their seeded numbers
+    _import_review_baselines(entity_type, [entity_id])
+    increments = {'review_count': 1, 'rating_sum': rating, f'stars_{rating}': 1}
+    for aggregate_id in (entity_id, 0):
+        _upsert_add(ReviewAggregate, {'entity_type': entity_type, 'entity_id': aggregate_id}, increments)
+    _refresh_review_ratings(entity_type, [entity_id])
+    return review
+
+def _serialize_review(review, user_name=None):
+    return {
+        'id': review.id,
+        'user_id': review.user_id,
+        'user_name': user_name,
+        'rating': review.rating,
+        'comment': review.comment or '',
+        'created_at': review.created_at.isoformat() if review.created_at else None,
+    }
+
+def _review_summary(entity_type, entity_id):
+    """Aggregate numbers plus the cached top reviews slice for one entity"""
+    key = (entity_type, entity_id)
+    summary = top_reviews_cache.get(key)
+    if summary is None:
+        _, review_model, fk = _review_entities()[entity_type]
+        aggregate = db.session.get(ReviewAggregate, (entity_type, entity_id))
+        top = db.session.query(review_model, User.name).join(User, User.id == review_model.user_id).filter(
+            fk == entity_id
+        ).order_by(review_model.rating.desc(), review_model.created_at.desc()).limit(app.config['REVIEW_TOP_SLICE']).all()
+        summary = {
+            'review_count': aggregate.review_count if aggregate else 0,
+            'rating': round(aggregate.rating_sum / aggregate.review_count, 2) if aggregate and aggregate.review_count else 0.0,
+            'bayes_rating': round(aggregate.bayes_rating, 3) if aggregate and aggregate.bayes_rating is not None else None,
+            'histogram': {str(s): getattr(aggregate, f'stars_{s}') if aggregate else 0 for s in REVIEW_STARS},
+            'imported_count': aggregate.imported_count if aggregate else 0,
+            'top_reviews': [_serialize_review(review, name) for review, name in top],
+        }
+        top_reviews_cache.set(key, summary)
+    return summary
+
+def _import_review_baselines(entity_type, entity_ids=None):
+    """Start aggregates for entities that have none from their seeded rating/review_count.
+
+    The insert skips rows another transaction created first, so a baseline is only
+    added to the type totals once. Returns the entity ids imported.
+    """
+    model = _review_entities()[entity_type][0]
+    existing = db.session.query(ReviewAggregate.entity_id).filter(ReviewAggregate.entity_type == entity_type)
+    query = db.session.query(model.id, model.rating, model.review_count).filter(~model.id.in_(existing))
+    if entity_ids is not None:
+        query = query.filter(model.id.in_(entity_ids))
+    imported = []
+    for entity_id, rating, count in query.all():
+        count = count or 0
+        total = (rating or 0.0) * count
+        row = {'entity_type': entity_type, 'entity_id': entity_id, 'review_count': count, 'rating_sum': total,
+               'imported_count': count, 'imported_sum': total}
+        if _insert_ignoring_conflicts(db.session.connection(), ReviewAggregate.__table__, [row], ['entity_type', 'entity_id']):
+            imported.append(entity_id)
+            _upsert_add(ReviewAggregate, {'entity_type': entity_type, 'entity_id': 0},
+                        {'review_count': count, 'rating_sum': total})
+    return imported
+
+def _backfill_review_aggregates():
+    for entity_type in _review_entities():
+        imported = _import_review_baselines(entity_type)
+        if imported:
+            _refresh_review_ratings(entity_type, imported)
+    db.session.commit()
+
+def _rebuild_review_aggregates():
+    """Recompute every aggregate from the review tables plus the imported baselines (repair)"""
+    for entity_type, (model, review_model, fk) in _review_entities().items():
+        aggregates = {a.entity_id: a for a in ReviewAggregate.query.filter_by(entity_type=entity_type)}
+        stars = defaultdict(lambda: dict.fromkeys(REVIEW_STARS, 0))
+        for entity_id, rating, count in db.session.query(fk, review_model.rating, db.func.count()).group_by(fk, review_model.rating):
+            stars[entity_id][rating] = count
+        totals = aggregates.get(0) or ReviewAggregate(entity_type=entity_type, entity_id=0)
+        totals.review_count, totals.rating_sum = 0, 0.0
+        for s in REVIEW_STARS:
+            setattr(totals, f'stars_{s}', 0)
+        for entity_id in set(aggregates) - {0} | set(stars):
+            aggregate = aggregates.get(entity_id) or ReviewAggregate(entity_type=entity_type, entity_id=entity_id)
+            aggregate.imported_count = aggregate.imported_count or 0
+            aggregate.imported_sum = aggregate.imported_sum or 0.0
+            counts = stars[entity_id]
+            aggregate.review_count = aggregate.imported_count + sum(counts.values())
+            aggregate.rating_sum = aggregate.imported_sum + sum(s * n for s, n in counts.items())
+            for s in REVIEW_STARS:
+                setattr(aggregate, f'stars_{s}', counts[s])
+                setattr(totals, f'stars_{s}', getattr(totals, f'stars_{s}') + counts[s])
+            totals.review_count += aggregate.review_count
+            totals.rating_sum += aggregate.rating_sum
+            db.session.add(aggregate)
+        db.session.add(totals)
+        db.session.flush()
+        entity_ids = [entity_id for entity_id in set(aggregates) | set(stars) if entity_id]
+        if entity_ids:
+            _refresh_review_ratings(entity_type, entity_ids)
+    db.session.commit()
+    top_reviews_cache.clear()
+    trainer_features.invalidate()
+
+@app.cli.command('rebuild-review-aggregates')
+def rebuild_review_aggregates_command():
+    """Recompute review counts, sums, histograms and Bayesian means"""
+    _rebuild_review_aggregates()
+    print(f"Rebuilt {ReviewAggregate.query.count()} review aggregates")
+
+REVIEW_ROUTE_KINDS = {'gyms': 'gym', 'trainers': 'trainer'}
+
+@app.route('/api/<any(gyms, trainers):kind>/<int:entity_id>/reviews', methods=['GET'])
+def get_reviews(kind, entity_id):
+    try:
+        entity_type = REVIEW_ROUTE_KINDS[kind]
+        model, review_model, fk = _review_entities()[entity_type]
+        if db.session.get(model, entity_id) is None:
+            return jsonify({'success': False, 'error': f'{entity_type.title()} not found'}), 404
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        offset = request.args.get('offset', 0, type=int)
+        rows = db.session.query(review_model, User.name).join(User, User.id == review_model.user_id).filter(
+            fk == entity_id
+        ).order_by(review_model.created_at.desc(), review_model.id.desc()).offset(offset).limit(limit).all()
+        return jsonify({
+            'success': True,
+            'summary': _review_summary(entity_type, entity_id),
+            'reviews': [_serialize_review(review, name) for review, name in rows],
+            'offset': offset,
+            'limit': limit,
+        })
+    except Exception as e:
+        logger.error(f"Error fetching reviews for {kind} {entity_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/<any(gyms, trainers):kind>/<int:entity_id>/reviews', methods=['POST'])
+def create_review(kind, entity_id):
+    try:
+        entity_type = REVIEW_ROUTE_KINDS[kind]
+        data = request.get_json() or {}
+        user_id = data.get('user_id')
+        rating = data.get('rating')
+        if not user_id or not isinstance(rating, int) or isinstance(rating, bool) or rating not in REVIEW_STARS:
+            return jsonify({'success': False, 'error': 'user_id and an integer rating from 1 to 5 are required'}), 400
+        model = _review_entities()[entity_type][0]
+        if db.session.get(model, entity_id) is None:
+            return jsonify({'success': False, 'error': f'{entity_type.title()} not found'}), 404
+        if db.session.get(User, user_id) is None:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        try:
+            review = _add_review(entity_type, entity_id, user_id, rating, (data.get('comment') or '').strip() or None)
+        except IntegrityError:
+            return jsonify({'success': False, 'error': f'You have already reviewed this {entity_type}'}), 400
+        db.session.commit()
+        top_reviews_cache.pop((entity_type, entity_id))
+        if entity_type == 'trainer':
+            # Core UPDATEs bypass the mapper events that normally refresh the ranking index
+            trainer_features.invalidate()
+        return jsonify({'success': True, 'review_id': review.id, 'summary': _review_summary(entity_type, entity_id)})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating review for {kind} {entity_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Overlap detection
+# Busy intervals are stored in chunks of at most this length, so any interval overlapping
+# [start, end) must begin inside (start - MAX_BUSY_INTERVAL, end): one bounded index seek.
+MAX_BUSY_INTERVAL = timedelta(hours=24)
+SERIES_CONFLICT_HORIZON_DAYS = 90
+
+def _busy_rows(user_ids, start, end, source_type, source_id):
+    rows = []
+    while start < end:
+        chunk_end = min(end, start + MAX_BUSY_INTERVAL)
+        for user_id in user_ids:
+            rows.append({
+                'user_id': user_id,
+                'starts_at': start,
+                'ends_at': chunk_end,
+                'source_type': source_type,
+                'source_id': source_id,
+            })
+        start = chunk_end
+    return rows
+
+def _clear_busy(source_type, source_id):
+    BusyInterval.query.filter_by(source_type=source_type, source_id=source_id).delete(synchronize_session=False)
+
+def _set_busy(source_type, source_id, user_ids, start=None, end=None):
+    """Replace the busy intervals recorded for one source row; with no start it only clears them"""
+    user_ids = [u for u in dict.fromkeys(user_ids) if u]
+    _clear_busy(source_type, source_id)
+    if start is not None:
+        rows = _busy_rows(user_ids, start, end, source_type, source_id)
+        if rows:
+            db.session.bulk_insert_mappings(BusyInterval, rows)
+    _invalidate_freebusy(user_ids)
+
+def _workout_interval(workout):
+    start = datetime.combine(workout.date, workout.time)
+    return start, start + timedelta(minutes=int(workout.duration or 0))
+
+def _sync_workout_busy(workout):
+    # Recurring series are checked by expanding them on demand, not materialized here
+    if workout.recurrence_rule or workout.status == 'cancelled':
+        _set_busy('workout', workout.id, [workout.user_id, workout.partner_id])
+    else:
+        _set_busy('workout', workout.id, [workout.user_id, workout.partner_id], *_workout_interval(workout))
+
+def _candidate_intervals(mapping):
+    """Intervals a new workout would occupy; series are checked over a bounded horizon"""
+    start = datetime.combine(mapping['date'], mapping['time'])
+    length = timedelta(minutes=int(mapping['duration'] or 0))
+    if not mapping.get('recurrence_rule'):
+        return [(start, start + length)]
+    first = max(mapping['date'], datetime.utcnow().date())
+    horizon = _earliest(first + timedelta(days=SERIES_CONFLICT_HORIZON_DAYS), mapping.get('series_end_date'))
+    rule = json.loads(mapping['recurrence_rule'])
+    return [
+        (datetime.combine(day, mapping['time']), datetime.combine(day, mapping['time']) + length)
+        for day in _iter_occurrence_dates(mapping['date'], rule, first, horizon)
+    ]
+
+def _load_busy(user_ids, window_start, window_end):
+    """Busy (start, end, user_id, source_type, source_id, occurrence_date) tuples in a window.
+
+    One indexed range scan over BusyInterval, plus recurring series expanded inside
+    the window. Intervals starting up to MAX_BUSY_INTERVAL before the window are included.
+    """
+    busy = [
+        (row.starts_at, row.ends_at, row.user_id, row.source_type, row.source_id, None)
+        for row in BusyInterval.query.filter(
+            BusyInterval.user_id.in_(user_ids),
+            BusyInterval.starts_at > window_start - MAX_BUSY_INTERVAL,
+            BusyInterval.starts_at < window_end
+        )
+    ]
+
+    series = ScheduledWorkout.query.filter(
+        db.or_(ScheduledWorkout.user_id.in_(user_ids), ScheduledWorkout.partner_id.in_(user_ids)),
+        ScheduledWorkout.recurrence_rule.isnot(None),
+        ScheduledWorkout.status != 'cancelled',
+        ScheduledWorkout.date <= window_end.date(),
+        db.or_(ScheduledWorkout.series_end_date.is_(None), ScheduledWorkout.series_end_date >= (window_start - MAX_BUSY_INTERVAL).date())
+    ).all()
+    if series:
+        cancelled = {
+            (o.workout_id, o.occurrence_date)
+            for o in WorkoutOccurrenceOverride.query.filter(
+                WorkoutOccurrenceOverride.workout_id.in_([w.id for w in series]),
+                WorkoutOccurrenceOverride.status == 'cancelled',
+                WorkoutOccurrenceOverride.occurrence_date.between((window_start - MAX_BUSY_INTERVAL).date(), window_end.date())
+            )
+        }
+        for workout in series:
+            rule = json.loads(workout.recurrence_rule)
+            window = _earliest(window_end.date(), workout.series_end_date)
+            owners = [u for u in (workout.user_id, workout.partner_id) if u in user_ids]
+            for day in _iter_occurrence_dates(workout.date, rule, (window_start - MAX_BUSY_INTERVAL).date(), window):
+                if (workout.id, day) in cancelled:
+                    continue
+                start = datetime.combine(day, workout.time)
+                for chunk in _busy_rows(owners, start, start + timedelta(minutes=int(workout.duration or 0)), 'workout', workout.id):
+                    busy.append((chunk['starts_at'], chunk['ends_at'], chunk['user_id'], 'workout', workout.id, day))
+    return busy
+
+def _find_conflicts(user_ids, intervals):
+    """Return the commitments of any of user_ids that overlap any of intervals.
+
+    Loads the users' busy intervals over the covering window once, then
+    binary-searches the sorted starts for each candidate interval.
+    """
+    user_ids = [u for u in dict.fromkeys(user_ids) if u]
+    if not user_ids or not intervals:
+        return []
+    busy = _load_busy(user_ids, min(start for start, _ in intervals), max(end for _, end in intervals))
+    busy.sort(key=lambda item: item[0])
+    return _overlapping(busy, [item[0] for item in busy], intervals)
+
+def _overlapping(busy, starts, intervals, user_ids=None):
+    """Conflicts from start-sorted busy tuples (and their starts) that overlap intervals"""
+    conflicts = {}
+    for start, end in intervals:
+        lo = bisect.bisect_right(starts, start - MAX_BUSY_INTERVAL)
+        hi = bisect.bisect_left(starts, end)
+        for busy_start, busy_end, user_id, source_type, source_id, day in busy[lo:hi]:
+            if busy_end > start and (user_ids is None or user_id in user_ids):
+                conflicts.setdefault((user_id, source_type, source_id, day), {
+                    'user_id': user_id,
+                    'source_type': source_type,
+                    'source_id': source_id,
+                    'occurrence_date': day.isoformat() if day else None,
+                    'starts_at': busy_start.isoformat(),
+                    'ends_at': busy_end.isoformat(),
+                })
+    return list(conflicts.values())
+
+def _conflict_response(conflicts):
+    return jsonify({'success': False, 'error': 'Schedule conflict', 'conflicts': conflicts}), 409
+
+def _rebuild_busy_intervals():
+    """Recompute BusyInterval from the source tables (backfill / repair)"""
+    BusyInterval.query.delete()
+    rows = []
+    for workout in ScheduledWorkout.query.filter(
+        ScheduledWorkout.recurrence_rule.is_(None), ScheduledWorkout.status != 'cancelled'
+    ).yield_per(500):
+        rows += _busy_rows([u for u in dict.fromkeys([workout.user_id, workout.partner_id]) if u],
+                           *_workout_interval(workout), 'workout', workout.id)
+    for booking, studio_class in db.session.query(ClassBooking, StudioClass).join(StudioClass).filter(
+        ClassBooking.status == 'confirmed'
+    ).yield_per(500):
+        start = datetime.combine(studio_class.date, studio_class.time)
+        rows += _busy_rows([booking.user_id], start, start + timedelta(minutes=studio_class.duration), 'class', booking.id)
+    for booking, venue in db.session.query(VenueBooking, SportsVenue).join(SportsVenue).filter(
+        VenueBooking.status == 'confirmed'
+    ).yield_per(500):
+        rows += _busy_rows([booking.user_id], datetime.combine(venue.date, venue.start_time),
+                           datetime.combine(venue.date, venue.end_time), 'venue', booking.id)
+    for booking in HomeSessionBooking.query.filter(
+        HomeSessionBooking.status.in_(['pending', 'confirmed'])
+    ).yield_per(500):
+        start = datetime.combine(booking.session_date, booking.session_time)
+        rows += _busy_rows([booking.user_id], start, start + timedelta(hours=booking.duration_hours or 1.0), 'home_session', booking.id)
+    if rows:
+        db.session.bulk_insert_mappings(BusyInterval, rows)
+    db.session.commit()
+    return len(rows)
+
+@app.cli.command('rebuild-busy-intervals')
+def rebuild_busy_intervals_command():
+    """Recompute the busy-interval index used for overlap checks"""
+    print(f"Rebuilt {_rebuild_busy_intervals()} busy intervals")
+
+# Free/busy and common free slots
+MAX_FREE_SLOT_WINDOW_DAYS = 31
+MAX_FREE_SLOT_PARTNERS = 20
+DEFAULT_AVAILABILITY = [('06:00', '22:00')]
+WORKOUT_TIME_WINDOWS = {
+    'morning': [('06:00', '12:00')],
+    'afternoon': [('12:00', '17:00')],
+    'evening': [('17:00', '22:00')],
+    'night': [('20:00', '23:59')],
+}
+
+freebusy_cache = TTLCache(app.config['FREEBUSY_CACHE_SIZE'], app.config['FREEBUSY_CACHE_TTL'])
+
+def _invalidate_freebusy(user_ids):
+    user_ids = set(user_ids)
+    if user_ids:
+        freebusy_cache.invalidate(lambda key: key[0] in user_ids)
+
+def _weekly_availability(user):
+    """Parse User.availability_schedule into {weekday: [(start, end), ...]} of time objects.
+
+    Accepts {"monday": [["06:00", "08:00"], "18:00-21:00"], ...}; days that are not
+    listed fall back to preferred_workout_time, then to DEFAULT_AVAILABILITY.
+    """
+    try:
+        schedule = json.loads(user.availability_schedule) if user.availability_schedule else {}
+    except (TypeError, ValueError):
+        schedule = {}
+    fallback = WORKOUT_TIME_WINDOWS.get((user.preferred_workout_time or '').lower(), DEFAULT_AVAILABILITY)
+
+    weekly = {}
+    for weekday, name in enumerate(WEEKDAY_NAMES):
+        entries = next((v for k, v in (schedule or {}).items() if str(k)[:3].lower() == name), None)
+        if entries is None:
+            entries = fallback
+        ranges = []
+        for entry in entries if isinstance(entries, list) else []:
+            if isinstance(entry, str):
+                entry = entry.split('-')
+            try:
+                start, end = (time_type.fromisoformat(str(value).strip()) for value in entry)
+            except (TypeError, ValueError):
+                continue
+            if start < end:
+                ranges.append((start, end))
+        weekly[weekday] = ranges
+    return weekly
+
+def _user_freebusy(users, window_start, window_end):
+    """Per-user (availability, busy) interval lists for the window, served from freebusy_cache"""
+    result = {}
+    missing = []
+    for user in users:
+        cached = freebusy_cache.get((user.id, window_start, window_end))
+        if cached is None:
+            missing.append(user)
+        else:
+            result[user.id] = cached
+    if missing:
+        busy_by_user = {user.id: [] for user in missing}
+        for start, end, user_id, *_ in _load_busy(list(busy_by_user), window_start, window_end):
+            busy_by_user[user_id].append((start, end))
+        for user in missing:
+            weekly = _weekly_availability(user)
+            available = []
+            day = window_start.date()
+            while day <= window_end.date():
+                for start, end in weekly[day.weekday()]:
+                    available.append((datetime.combine(day, start), datetime.combine(day, end)))
+                day += timedelta(days=1)
+            entry = (available, busy_by_user[user.id])
+            freebusy_cache.set((user.id, window_start, window_end), entry)
+            result[user.id] = entry
+    return result
+
+def _common_free_slots(freebusy, window_start, window_end, min_minutes, limit):
+    """Sweep-line merge: slots where every user is available and nobody is busy"""
+    events = []
+    for available, busy in freebusy:
+        # Merge each user's own availability so overlapping entries count once
+        merged = []
+        for start, end in sorted(available):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        for start, end in merged:
+            events.append((start, 0, 1))
+            events.append((end, 0, -1))
+        for start, end in busy:
+            events.append((start, 1, 1))
+            events.append((end, 1, -1))
+    events.append((window_start, 2, 0))
+    events.sort(key=lambda event: event[0])
+
+    needed = len(freebusy)
+    available_count = busy_count = 0
+    slots = []
+    slot_start = None
+    min_length = timedelta(minutes=min_minutes)
+    for index, (moment, kind, delta) in enumerate(events):
+        if kind == 0:
+            available_count += delta
+        elif kind == 1:
+            busy_count += delta
+        # Only evaluate once all events at this instant are applied
+        if index + 1 < len(events) and events[index + 1][0] == moment:
+            continue
+        free = available_count == needed and busy_count == 0 and window_start <= moment < window_end
+        if free and slot_start is None:
+            slot_start = moment
+        elif not free and slot_start is not None:
+            end = min(moment, window_end)
+            if end - slot_start >= min_length:
+                slots.append((slot_start, end))
+                if len(slots) >= limit:
+                    return slots
+            slot_start = None
+    if slot_start is not None and window_end - slot_start >= min_length:
+        slots.append((slot_start, window_end))
+    return slots[:limit]
+
+@app.route('/api/partners/free-slots', methods=['GET'])
+def partners_free_slots():
+    """Earliest common free slots between the caller and one or more partners.
+
+    Query: partner_id (repeatable) or partner_ids=1,2,3; from/to (YYYY-MM-DD, default
+    the next 7 days); duration in minutes (default 60); limit slots per partner (default 5).
+    """
+    try:
+        user_id, error = _caller_user_id()
+        if error:
+            return error
+
+        try:
+            partner_ids = [int(p) for p in request.args.getlist('partner_id')]
+            partner_ids += [int(p) for p in request.args.get('partner_ids', '').split(',') if p.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'error': 'partner ids must be integers'}), 400
+        partner_ids = [p for p in dict.fromkeys(partner_ids) if p != user_id]
+        if not partner_ids:
+            return jsonify({'success': False, 'error': 'partner_id is required'}), 400
+        if len(partner_ids) > MAX_FREE_SLOT_PARTNERS:
+            return jsonify({'success': False, 'error': f'At most {MAX_FREE_SLOT_PARTNERS} partners per request'}), 400
+
+        today = datetime.utcnow().date()
+        try:
+            date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else today
+            date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else date_from + timedelta(days=6)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+        if date_to < date_from or (date_to - date_from).days >= MAX_FREE_SLOT_WINDOW_DAYS:
+            return jsonify({'success': False, 'error': f'Window must be 1-{MAX_FREE_SLOT_WINDOW_DAYS} days'}), 400
+        duration = max(request.args.get('duration', 60, type=int), 1)
+        limit = min(max(request.args.get('limit', 5, type=int), 1), 50)
+
+        window_start = datetime.combine(date_from, time_type.min)
+        window_end = datetime.combine(date_to + timedelta(days=1), time_type.min)
+
+        users = {u.id: u for u in User.query.filter(User.id.in_([user_id] + partner_ids))}
+        if user_id not in users:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        freebusy = _user_freebusy(list(users.values()), window_start, window_end)
+
+        # Don't offer slots that have already started
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        earliest = max(window_start, now + timedelta(minutes=-now.minute % 15))
+
+        results = []
+        for partner_id in partner_ids:
+            if partner_id not in users:
+                results.append({'partner_id': partner_id, 'success': False, 'error': 'User not found'})
+                continue
+            slots = _common_free_slots(
+                [freebusy[user_id], freebusy[partner_id]], earliest, window_end, duration, limit
+            )
+            results.append({
+                'partner_id': partner_id,
+                'success': True,
+                'slots': [{
+                    'start': start.isoformat(),
+                    'end': end.isoformat(),
+                    'minutes': int((end - start).total_seconds() // 60),
+                } for start, end in slots],
+            })
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        logger.error(f"Error finding free slots: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Workout rollups and streaks
+ROLLUP_STATUSES = ('scheduled', 'completed', 'cancelled')
+
+def _insert_ignoring_conflicts(connection, table, rows, index_elements):
+    """Insert rows, skipping any that collide on index_elements; returns rows inserted"""
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        return connection.execute(insert(table).on_conflict_do_nothing(index_elements=index_elements), rows).rowcount
+    connection.execute(table.insert(), rows)
+    return len(rows)
+
+def _upsert_add(model, keys, increments):
+    """Atomically add increments to the row identified by keys, creating it if needed"""
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        stmt = insert(model).values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: model.__table__.c[column] + stmt.excluded[column] for column in increments}
+        )
+        db.session.execute(stmt)
+        return
+    updated = db.session.query(model).filter_by(**keys).update(
+        {getattr(model, column): getattr(model, column) + value for column, value in increments.items()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(model(**keys, **increments))
+        db.session.flush()
+
+def _workout_rollup_state(workout):
+    """(user_id, day, workout_type, minutes, status) a single workout contributes; None for series.
+
+    Recurring series contribute through their per-occurrence overrides instead.
+    """
+    get = workout.get if isinstance(workout, dict) else lambda key: getattr(workout, key)
+    if get('recurrence_rule'):
+        return None
+    status = get('status') if get('status') in ROLLUP_STATUSES else 'scheduled'
+    return (get('user_id'), get('date'), get('workout_type'), int(get('duration') or 0), status)
+
+def _occurrence_rollup_state(workout, day, override_status):
+    status = override_status or workout.status
+    if status not in ('completed', 'cancelled'):
+        return None
+    return (workout.user_id, day, workout.workout_type, int(workout.duration or 0), status)
+
+def _add_rollup_delta(deltas, state, sign):
+    if state is None:
+        return
+    user_id, day, workout_type, minutes, status = state
+    week_start = day - timedelta(days=day.weekday())
+    for key in ((WorkoutDailyRollup, user_id, 'day', day, workout_type),
+                (WorkoutWeeklyRollup, user_id, 'week_start', week_start, workout_type)):
+        counters = deltas.setdefault(key, defaultdict(int))
+        counters[f'{status}_count'] += sign
+        counters[f'{status}_minutes'] += sign * minutes
+
+def _apply_rollup_deltas(deltas):
+    streak_days = set()
+    for (model, user_id, day_column, day, workout_type), counters in deltas.items():
+        counters = {column: value for column, value in counters.items() if value}
+        if not counters:
+            continue
+        _upsert_add(model, {'user_id': user_id, day_column: day, 'workout_type': workout_type}, counters)
+        if model is WorkoutDailyRollup and 'completed_count' in counters:
+            streak_days.add((user_id, day))
+    for user_id, day in sorted(streak_days):
+        _refresh_streak(user_id, day)
+
+def _update_rollups(changes):
+    """Apply [(old_state, new_state), ...] to the rollups and streaks in the current transaction"""
+    deltas = {}
+    for old_state, new_state in changes:
+        if old_state != new_state:
+            _add_rollup_delta(deltas, old_state, -1)
+            _add_rollup_delta(deltas, new_state, 1)
+    if deltas:
+        _apply_rollup_deltas(deltas)
+
+def _completed_days_desc(user_id):
+    return (row.day for row in db.session.query(WorkoutDailyRollup.day).filter(
+        WorkoutDailyRollup.user_id == user_id,
+        WorkoutDailyRollup.completed_count > 0
+    ).group_by(WorkoutDailyRollup.day).order_by(WorkoutDailyRollup.day.desc()).yield_per(100))
+
+def _refresh_streak(user_id, day):
+    """Update the streak after completed counts changed on day.
+
+    Completing the day after the last completed one extends the streak in place;
+    anything else (backfills, un-completing) walks back over the daily rollups, which
+    reads only as many rows as the streak is long.
+    """
+    streak = db.session.get(WorkoutStreak, user_id)
+    if streak is None:
+        streak = WorkoutStreak(user_id=user_id, current_streak=0, longest_streak=0)
+        db.session.add(streak)
+    completed = db.session.query(db.func.coalesce(db.func.sum(WorkoutDailyRollup.completed_count), 0)).filter(
+        WorkoutDailyRollup.user_id == user_id, WorkoutDailyRollup.day == day
+    ).scalar()
+
+    last = streak.last_completed_date
+    if completed > 0 and (last is None or day > last):
+        streak.current_streak = streak.current_streak + 1 if last == day - timedelta(days=1) else 1
+        streak.last_completed_date = day
+    elif not (completed > 0 and day == last):
+        streak.current_streak = 0
+        streak.last_completed_date = None
+        for completed_day in _completed_days_desc(user_id):
+            if streak.last_completed_date is None:
+                streak.last_completed_date = completed_day
+            elif completed_day != streak.last_completed_date - timedelta(days=streak.current_streak):
+                break
+            streak.current_streak += 1
+    # longest_streak only grows incrementally; rebuild-workout-rollups recomputes it exactly
+    streak.longest_streak = max(streak.longest_streak or 0, streak.current_streak)
+
+def _rebuild_workout_rollups(user_id=None):
+    """Recompute rollups and streaks from ScheduledWorkout (backfill / repair)"""
+    for model in (WorkoutDailyRollup, WorkoutWeeklyRollup, WorkoutStreak):
+        query = model.query
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        query.delete(synchronize_session=False)
+
+    deltas = {}
+    workouts = ScheduledWorkout.query
+    if user_id is not None:
+        workouts = workouts.filter(ScheduledWorkout.user_id == user_id)
+    for workout in workouts.yield_per(500):
+        _add_rollup_delta(deltas, _workout_rollup_state(workout), 1)
+    overrides = db.session.query(WorkoutOccurrenceOverride, ScheduledWorkout).join(ScheduledWorkout)
+    if user_id is not None:
+        overrides = overrides.filter(ScheduledWorkout.user_id == user_id)
+    for override, workout in overrides.yield_per(500):
+        _add_rollup_delta(deltas, _occurrence_rollup_state(workout, override.occurrence_date, override.status), 1)
+
+    rows = defaultdict(list)
+    for (model, uid, day_column, day, workout_type), counters in deltas.items():
+        rows[model].append(dict(counters, user_id=uid, workout_type=workout_type, **{day_column: day}))
+    for model, mappings in rows.items():
+        db.session.bulk_insert_mappings(model, mappings)
+    db.session.flush()
+
+    users = {uid for (_, uid, _, _, _) in deltas}
+    streaks = []
+    for uid in users:
+        current = longest = 0
+        last = previous = None
+        for day in sorted(_completed_days_desc(uid)):
+            current = current + 1 if previous == day - timedelta(days=1) else 1
+            longest = max(longest, current)
+            previous = last = day
+        streaks.append({'user_id': uid, 'current_streak': current, 'longest_streak': longest, 'last_completed_date': last})
+    if streaks:
+        db.session.bulk_insert_mappings(WorkoutStreak, streaks)
+    db.session.commit()
+    return len(users)
+
+@app.cli.command('rebuild-workout-rollups')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user')
+def rebuild_workout_rollups_command(user_id):
+    """Recompute workout rollups and streaks from scheduled workouts"""
+    print(f"Rebuilt workout rollups for {_rebuild_workout_rollups(user_id)} users")
+
+def _series_occurrence_states(user_id, first_day, last_day):
+    """Rollup states for a user's series occurrences in [first_day, last_day] that the rollups don't hold.
+
+    Rollups only carry occurrences whose override makes them completed or cancelled, so every
+    other occurrence is expanded here with the status it inherits from its series.
+    """
+    series = ScheduledWorkout.query.filter(
+        ScheduledWorkout.user_id == user_id,
+        ScheduledWorkout.recurrence_rule.isnot(None),
+        ScheduledWorkout.date <= last_day,
+        db.or_(ScheduledWorkout.series_end_date.is_(None), ScheduledWorkout.series_end_date >= first_day)
+    ).all()
+    if not series:
+        return
+    rolled_up = set()
+    for override in WorkoutOccurrenceOverride.query.filter(
+        WorkoutOccurrenceOverride.workout_id.in_([workout.id for workout in series]),
+        WorkoutOccurrenceOverride.occurrence_date.between(first_day, last_day)
+    ):
+        if _occurrence_rollup_state(override.series, override.occurrence_date, override.status):
+            rolled_up.add((override.workout_id, override.occurrence_date))
+    for workout in series:
+        rule = json.loads(workout.recurrence_rule)
+        status = workout.status if workout.status in ROLLUP_STATUSES else 'scheduled'
+        for day in _iter_occurrence_dates(workout.date, rule, first_day, _earliest(last_day, workout.series_end_date)):
+            if (workout.id, day) not in rolled_up:
+                yield (workout.user_id, day, workout.workout_type, int(workout.duration or 0), status)
+
+@app.route('/api/workouts/stats', methods=['GET'])
+def get_workout_stats():
+    """Weekly minutes by workout type, completion rate and streaks for the caller"""
+    try:
+        user_id, error = _caller_user_id()
+        if error:
+            return error
+        weeks = min(max(request.args.get('weeks', 12, type=int), 1), 104)
+
+        today = datetime.utcnow().date()
+        this_week = today - timedelta(days=today.weekday())
+        first_week = this_week - timedelta(weeks=weeks - 1)
+        rows = WorkoutWeeklyRollup.query.filter(
+            WorkoutWeeklyRollup.user_id == user_id,
+            WorkoutWeeklyRollup.week_start >= first_week,
+            WorkoutWeeklyRollup.week_start <= this_week
+        ).all()
+
+        counters = defaultdict(lambda: defaultdict(int))
+        for row in rows:
+            for status in ROLLUP_STATUSES:
+                for column in (f'{status}_count', f'{status}_minutes'):
+                    counters[(row.week_start, row.workout_type)][column] += getattr(row, column)
+        # Series occurrences due so far count as planned even when nobody has touched them
+        deltas = {}
+        for state in _series_occurrence_states(user_id, first_week, today):
+            _add_rollup_delta(deltas, state, 1)
+        for (model, _, _, week_start, workout_type), delta in deltas.items():
+            if model is WorkoutWeeklyRollup:
+                for column, value in delta.items():
+                    counters[(week_start, workout_type)][column] += value
+
+        weekly = {}
+        totals = defaultdict(int)
+        for (week_start, workout_type), counts in sorted(counters.items()):
+            week = weekly.setdefault(week_start, {
+                'week_start': week_start.isoformat(),
+                'completed_minutes': 0,
+                'scheduled_minutes': 0,
+                'by_type': {},
+            })
+            week['completed_minutes'] += counts['completed_minutes']
+            week['scheduled_minutes'] += counts['scheduled_minutes']
+            week['by_type'][workout_type] = {
+                'completed_minutes': counts['completed_minutes'],
+                'scheduled_minutes': counts['scheduled_minutes'],
+                'completed': counts['completed_count'],
+                'cancelled': counts['cancelled_count'],
+            }
+            for status in ROLLUP_STATUSES:
+                totals[status] += counts[f'{status}_count']
+
+        planned = totals['scheduled'] + totals['completed'] + totals['cancelled']
+        streak = db.session.get(WorkoutStreak, user_id)
+        # A streak survives until the end of the day after its last completed workout
+        alive = streak is not None and streak.last_completed_date is not None \
+            and streak.last_completed_date >= today - timedelta(days=1)
+
+        return jsonify({
+            'success': True,
+            'stats': {
+                'weeks': list(weekly.values()),
+                'completed': totals['completed'],
+                'cancelled': totals['cancelled'],
+                'scheduled': totals['scheduled'],
+                'completion_rate': round(totals['completed'] / planned, 3) if planned else None,
+                'current_streak': streak.current_streak if alive else 0,
+                'longest_streak': streak.longest_streak if streak else 0,
+                'last_completed_date': streak.last_completed_date.isoformat() if streak and streak.last_completed_date else None,
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error fetching workout stats: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Workout scheduling endpoints
+MAX_WORKOUT_PAGE = 1000
+
+def _encode_cursor(*parts):
+    return base64.urlsafe_b64encode('|'.join(str(p) for p in parts).encode()).decode()
+
+def _decode_cursor(cursor):
+    return base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+
+WEEKDAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+MAX_RECURRENCE_COUNT = 1000
+
+def _parse_recurrence(rule):
+    """Validate a weekly recurrence rule from a request and return its normalized form"""
+    if not isinstance(rule, dict):
+        raise ValueError('recurrence must be an object')
+    days = []
+    for day in rule.get('days') or []:
+        if isinstance(day, str) and day[:3].lower() in WEEKDAY_NAMES:
+            day = WEEKDAY_NAMES.index(day[:3].lower())
+        if not isinstance(day, int) or not 0 <= day <= 6:
+            raise ValueError('recurrence.days must be weekdays (0=Mon..6=Sun or names)')
+        days.append(day)
+    if not days:
+        raise ValueError('recurrence.days is required')
+    interval = rule.get('interval', 1)
+    if not isinstance(interval, int) or interval < 1:
+        raise ValueError('recurrence.interval must be a positive integer')
+    if rule.get('until') and rule.get('count'):
+        raise ValueError('Use either recurrence.until or recurrence.count, not both')
+
+    normalized = {'days': sorted(set(days)), 'interval': interval}
+    if rule.get('until'):
+        normalized['until'] = datetime.strptime(rule['until'], '%Y-%m-%d').date().isoformat()
+    if rule.get('count'):
+        count = rule['count']
+        if not isinstance(count, int) or not 1 <= count <= MAX_RECURRENCE_COUNT:
+            raise ValueError(f'recurrence.count must be between 1 and {MAX_RECURRENCE_COUNT}')
+        normalized['count'] = count
+    normalized['exceptions'] = sorted({
+        datetime.strptime(d, '%Y-%m-%d').date().isoformat() for d in rule.get('exceptions') or []
+    })
+    return normalized
+
+def _iter_occurrence_dates(start, rule, window_start=None, window_end=None, skip_exceptions=True):
+    """Yield the dates of a weekly rule in order, starting at window_start.
+
+    Jumps straight to the first active week of the window, so cost depends on the
+    window size rather than on how long the series has been running.
+    """
+    days = rule['days']
+    interval = rule['interval']
+    until = rule.get('until')
+    end = datetime.strptime(until, '%Y-%m-%d').date() if until else None
+    if window_end and (end is None or window_end < end):
+        end = window_end
+    exceptions = set(rule.get('exceptions', ())) if skip_exceptions else ()
+
+    first = max(start, window_start) if window_start else start
+    series_monday = start - timedelta(days=start.weekday())
+    weeks = (first - series_monday).days // 7
+    week = series_monday + timedelta(weeks=weeks + (-weeks % interval))
+    while end is None or week <= end:
+        for day in days:
+            current = week + timedelta(days=day)
+            if current < first:
+                continue
+            if end is not None and current > end:
+                return
+            if current.isoformat() not in exceptions:
+                yield current
+        week += timedelta(weeks=interval)
+
+def _earliest(*dates):
+    dates = [d for d in dates if d is not None]
+    return min(dates) if dates else None
+
+def _series_end_date(start, rule):
+    if rule.get('until'):
+        return datetime.strptime(rule['until'], '%Y-%m-%d').date()
+    if rule.get('count'):
+        # COUNT includes excluded dates, as in RFC 5545
+        last = start
+        for i, last in enumerate(_iter_occurrence_dates(start, rule, skip_exceptions=False), 1):
+            if i == rule['count']:
+                break
+        return last
+    return None
+
+def _apply_recurrence(workout, rule):
+    if rule is None:
+        workout.recurrence_rule = None
+        workout.series_end_date = None
+        return
+    workout.recurrence_rule = json.dumps(rule)
+    workout.series_end_date = _series_end_date(workout.date, rule)
+
+def _serialize_workout(workout):
+    return {
+        'id': workout.id,
+        'title': workout.title,
+        'date': workout.date.isoformat(),
+        'time': workout.time.strftime('%H:%M'),
+        'duration': workout.duration,
+        'workout_type': workout.workout_type,
+        'partner_id': workout.partner_id,
+        'partner_name': workout.partner.name if workout.partner else None,
+        'location': workout.location,
+        'notes': workout.notes,
+        'status': workout.status,
+        'created_at': workout.created_at.isoformat()
+    }
+
+@app.route('/api/workouts', methods=['GET'])
+def get_workouts():
+    """List the caller's workouts in a date range, ordered by (date, time, id).
+
+    Accepts `from`/`to` (inclusive, YYYY-MM-DD) or a single `date`, plus `limit` and an
+    opaque `cursor` from the previous page's `next_cursor`.
+    """
+    try:
+        user_id, error = _caller_user_id()
+        if error:
+            return error
+
         date = request.args.get('date')
-        
-        query = ScheduledWorkout.query
-        
-        if user_id:
-            query = query.filter(ScheduledWorkout.user_id == user_id)
-        
-        if date:
-            query = query.filter(ScheduledWorkout.date == datetime.strptime(date, '%Y-%m-%d').date())
-        
-        workouts = query.order_by(ScheduledWorkout.date, ScheduledWorkout.time).all()
-        
+        date_from = request.args.get('from', date)
+        date_to = request.args.get('to', date)
+        limit = min(max(request.args.get('limit', 500, type=int), 1), MAX_WORKOUT_PAGE)
+        cursor = request.args.get('cursor')
+
+        try:
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+
+        after = None
+        if cursor:
+            try:
+                c_date, c_time, c_id = _decode_cursor(cursor)
+                after = (
+                    datetime.strptime(c_date, '%Y-%m-%d').date(),
+                    datetime.strptime(c_time, '%H:%M:%S').time(),
+                    int(c_id),
+                )
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+        # Partner names come from the same SELECT instead of one lazy load per row
+        base_query = ScheduledWorkout.query.options(
+            joinedload(ScheduledWorkout.partner).load_only(User.id, User.name)
+        ).filter(ScheduledWorkout.user_id == user_id)
+
+        query = base_query.filter(ScheduledWorkout.recurrence_rule.is_(None))
+        if date_from:
+            query = query.filter(ScheduledWorkout.date >= date_from)
+        if date_to:
+            query = query.filter(ScheduledWorkout.date <= date_to)
+        if after:
+            query = query.filter(
+                db.tuple_(ScheduledWorkout.date, ScheduledWorkout.time, ScheduledWorkout.id) > after
+            )
+        singles = query.order_by(
+            ScheduledWorkout.date, ScheduledWorkout.time, ScheduledWorkout.id
+        ).limit(limit + 1).all()
+
+        # Series rows overlapping the window; occurrences are expanded only inside it
+        series_query = base_query.filter(ScheduledWorkout.recurrence_rule.isnot(None))
+        if date_to:
+            series_query = series_query.filter(ScheduledWorkout.date <= date_to)
+        if date_from:
+            series_query = series_query.filter(db.or_(
+                ScheduledWorkout.series_end_date.is_(None),
+                ScheduledWorkout.series_end_date >= date_from
+            ))
+        series = series_query.all()
+
+        expand_from = date_from
+        if after and (expand_from is None or after[0] > expand_from):
+            expand_from = after[0]
+
+        def occurrences(workout):
+            rule = json.loads(workout.recurrence_rule)
+            window_end = _earliest(date_to, workout.series_end_date)
+            for day in _iter_occurrence_dates(workout.date, rule, expand_from, window_end):
+                key = (day, workout.time, workout.id)
+                if after is None or key > after:
+                    yield key, workout
+
+        streams = [((w.date, w.time, w.id), w) for w in singles]
+        page = list(islice(
+            heapq.merge(streams, *(occurrences(w) for w in series), key=lambda item: item[0]),
+            limit + 1
+        ))
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last_date, last_time, last_id = page[-1][0]
+            next_cursor = _encode_cursor(last_date.isoformat(), last_time.strftime('%H:%M:%S'), last_id)
+
+        overrides = {}
+        occurrence_keys = [(key[0], workout.id) for key, workout in page if workout.recurrence_rule]
+        if occurrence_keys:
+            days = [day for day, _ in occurrence_keys]
+            for override in WorkoutOccurrenceOverride.query.filter(
+                WorkoutOccurrenceOverride.workout_id.in_({wid for _, wid in occurrence_keys}),
+                WorkoutOccurrenceOverride.occurrence_date.between(min(days), max(days))
+            ):
+                overrides[(override.occurrence_date, override.workout_id)] = override
+
         workouts_data = []
-        for workout in workouts:
-            workout_data = {
-                'id': workout.id,
-                'title': workout.title,
-                'date': workout.date.isoformat(),
-                'time': workout.time.strftime('%H:%M'),
-                'duration': workout.duration,
-                'workout_type': workout.workout_type,
-                'partner_id': workout.partner_id,
-                'partner_name': workout.partner.name if workout.partner else None,
-                'location': workout.location,
-                'notes': workout.notes,
-                'status': workout.status,
-                'created_at': workout.created_at.isoformat()
-            }
+        for (day, _, _), workout in page:
+            workout_data = _serialize_workout(workout)
+            if workout.recurrence_rule:
+                workout_data.update({
+                    'id': f"{workout.id}:{day.isoformat()}",
+                    'series_id': workout.id,
+                    'occurrence_date': day.isoformat(),
+                    'date': day.isoformat(),
+                    'recurrence': json.loads(workout.recurrence_rule),
+                })
+                override = overrides.get((day, workout.id))
+                if override:
+                    if override.status is not None:
+                        workout_data['status'] = override.status
+                    if override.notes is not None:
+                        workout_data['notes'] = override.notes
             workouts_data.append(workout_data)
-        
+
         return jsonify({
             'success': True,
-            'workouts': workouts_data
+            'workouts': workouts_data,
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         logger.error(f"Error fetching workouts: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+WORKOUT_REQUIRED_FIELDS = ['user_id', 'title', 'date', 'time', 'duration', 'workout_type']
+MAX_WORKOUT_BATCH = 5000
+MAX_WORKOUT_MINUTES = 24 * 60
+
+def _missing_users(user_ids):
+    """The ids among user_ids that have no User row"""
+    user_ids = {u for u in user_ids if u}
+    if not user_ids:
+        return set()
+    return user_ids - {row.id for row in db.session.query(User.id).filter(User.id.in_(user_ids))}
+
+def _workout_mapping(data):
+    """Validate one workout payload and return column values; raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('workout must be an object')
+    for field in WORKOUT_REQUIRED_FIELDS:
+        if field not in data:
+            raise ValueError(f'Missing required field: {field}')
+    try:
+        # fromisoformat is C-implemented and much cheaper than strptime for bulk imports
+        day = date_type.fromisoformat(data['date'])
+        time_of_day = time_type.fromisoformat(data['time'])
+    except (TypeError, ValueError):
+        raise ValueError('date must be YYYY-MM-DD and time HH:MM')
+    try:
+        user_id = int(data['user_id'])
+        partner_id = int(data['partner_id']) if data.get('partner_id') else None
+        duration = int(data['duration'])
+    except (TypeError, ValueError):
+        raise ValueError('user_id, partner_id and duration must be integers')
+    if user_id < 1 or (partner_id is not None and partner_id < 1):
+        raise ValueError('user_id and partner_id must be positive')
+    if not 0 < duration <= MAX_WORKOUT_MINUTES:
+        raise ValueError(f'duration must be between 1 and {MAX_WORKOUT_MINUTES} minutes')
+    status = data.get('status', 'scheduled')
+    if status not in ROLLUP_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(ROLLUP_STATUSES)}")
+    mapping = {
+        'user_id': user_id,
+        'title': data['title'],
+        'date': day,
+        'time': time_of_day,
+        'duration': duration,
+        'workout_type': data['workout_type'],
+        'partner_id': partner_id,
+        'location': data.get('location'),
+        'notes': data.get('notes'),
+        'status': status,
+        'recurrence_rule': None,
+        'series_end_date': None,
+    }
+    if data.get('recurrence'):
+        rule = _parse_recurrence(data['recurrence'])
+        mapping['recurrence_rule'] = json.dumps(rule)
+        mapping['series_end_date'] = _series_end_date(day, rule)
+    return mapping
+
 @app.route('/api/workouts', methods=['POST'])
+@idempotent
 def create_workout():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
-        # Validate required fields
-        required_fields = ['user_id', 'title', 'date', 'time', 'duration', 'workout_type']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'success': False, 'error': f'Missing required field: {field}'}), 400
-        
-        # Create new workout
-        workout = ScheduledWorkout(
-            user_id=data['user_id'],
-            title=data['title'],
-            date=datetime.strptime(data['date'], '%Y-%m-%d').date(),
-            time=datetime.strptime(data['time'], '%H:%M').time(),
-            duration=data['duration'],
-            workout_type=data['workout_type'],
-            partner_id=data.get('partner_id'),
-            location=data.get('location'),
-            notes=data.get('notes'),
-            status=data.get('status', 'scheduled')
-        )
+        try:
+            mapping = _workout_mapping(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if _missing_users([mapping['user_id'], mapping['partner_id']]):
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+        
+        if mapping['status'] != 'cancelled' and not data.get('allow_overlap'):
+            conflicts = _find_conflicts([mapping['user_id'], mapping['partner_id']], _candidate_intervals(mapping))
+            if conflicts:
+                return _conflict_response(conflicts)
         
+        workout = ScheduledWorkout(**mapping)
         db.session.add(workout)
+        db.session.flush()
+        _sync_workout_busy(workout)
+        _update_rollups([(None, _workout_rollup_state(workout))])
         db.session.commit()
         
         return jsonify({
@@ -846,11 +2877,131 @@ def create_workout():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _batch_conflicts(mappings):
+    """Per-item conflicts for a batch, against stored commitments and earlier items of the batch.
+
+    Busy time for every user in the batch is loaded once over the covering window;
+    each checked item is then added to it so later items see it too.
+    """
+    candidates = [
+        (index, [u for u in dict.fromkeys([m['user_id'], m['partner_id']]) if u], _candidate_intervals(m))
+        for index, m in enumerate(mappings) if m['status'] != 'cancelled'
+    ]
+    intervals = [interval for _, _, item_intervals in candidates for interval in item_intervals]
+    if not intervals:
+        return []
+    busy = _load_busy(
+        list({u for _, user_ids, _ in candidates for u in user_ids}),
+        min(start for start, _ in intervals), max(end for _, end in intervals)
+    )
+    busy.sort(key=lambda item: item[0])
+    starts = [item[0] for item in busy]
+
+    errors = []
+    for index, user_ids, item_intervals in candidates:
+        if not mappings[index]['allow_overlap']:
+            conflicts = _overlapping(busy, starts, item_intervals, set(user_ids))
+            if conflicts:
+                errors.append({'index': index, 'error': 'Schedule conflict', 'conflicts': conflicts})
+                continue
+        for start, end in item_intervals:
+            for chunk in _busy_rows(user_ids, start, end, 'batch', index):
+                position = bisect.bisect_right(starts, chunk['starts_at'])
+                starts.insert(position, chunk['starts_at'])
+                busy.insert(position, (chunk['starts_at'], chunk['ends_at'], chunk['user_id'], 'batch', index, None))
+    return errors
+
+@app.route('/api/workouts/batch', methods=['POST'])
+def create_workouts_batch():
+    """Create many workouts in one transaction (program imports, wearable history).
+
+    Body: {"user_id": optional default, "allow_overlap": optional, "workouts": [...]}.
+    Every item is validated and checked for overlaps (with stored commitments and with
+    earlier items) before anything is written; any failing item rejects the whole batch.
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get('workouts') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'workouts must be a non-empty list'}), 400
+        if len(items) > MAX_WORKOUT_BATCH:
+            return jsonify({'success': False, 'error': f'At most {MAX_WORKOUT_BATCH} workouts per request'}), 400
+
+        default_user_id = data.get('user_id') if isinstance(data, dict) else None
+        allow_overlap = isinstance(data, dict) and data.get('allow_overlap')
+        mappings = []
+        errors = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({'index': index, 'error': 'Each workout must be an object'})
+                continue
+            if default_user_id is not None and 'user_id' not in item:
+                item = dict(item, user_id=default_user_id)
+            try:
+                mappings.append(_workout_mapping(item))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+                continue
+            mappings[-1]['allow_overlap'] = allow_overlap or item.get('allow_overlap')
+        if errors:
+            return jsonify({'success': False, 'error': 'Invalid workouts', 'errors': errors}), 400
+
+        missing = _missing_users(u for m in mappings for u in (m['user_id'], m['partner_id']))
+        errors = [
+            {'index': index, 'error': 'User not found'}
+            for index, mapping in enumerate(mappings)
+            if {mapping['user_id'], mapping['partner_id']} & missing
+        ]
+        if errors:
+            return jsonify({'success': False, 'error': 'Invalid workouts', 'errors': errors}), 404
+
+        errors = _batch_conflicts(mappings)
+        if errors:
+            return jsonify({'success': False, 'error': 'Schedule conflict', 'errors': errors}), 409
+        for mapping in mappings:
+            del mapping['allow_overlap']
+
+        now = datetime.utcnow()
+        for mapping in mappings:
+            mapping['created_at'] = now
+            mapping['updated_at'] = now
+        # return_defaults fills mapping['id'] from batched INSERT ... RETURNING
+        db.session.bulk_insert_mappings(ScheduledWorkout, mappings, return_defaults=True)
+        busy_rows = []
+        for mapping in mappings:
+            if not mapping['recurrence_rule'] and mapping['status'] != 'cancelled':
+                start = datetime.combine(mapping['date'], mapping['time'])
+                busy_rows += _busy_rows(
+                    [u for u in dict.fromkeys([mapping['user_id'], mapping['partner_id']]) if u],
+                    start, start + timedelta(minutes=int(mapping['duration'] or 0)), 'workout', mapping['id']
+                )
+        if busy_rows:
+            db.session.bulk_insert_mappings(BusyInterval, busy_rows)
+        _update_rollups([(None, _workout_rollup_state(mapping)) for mapping in mappings])
+        db.session.commit()
+        _invalidate_freebusy({m['user_id'] for m in mappings} | {m['partner_id'] for m in mappings if m['partner_id']})
+
+        return jsonify({
+            'success': True,
+            'message': f'{len(mappings)} workouts scheduled successfully',
+            'workout_ids': [mapping['id'] for mapping in mappings]
+        })
+    except Exception as e:
+        logger.error(f"Error creating workouts in batch: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/workouts/<int:workout_id>', methods=['PUT'])
 def update_workout(workout_id):
     try:
         workout = ScheduledWorkout.query.get_or_404(workout_id)
         data = request.get_json()
+        rollup_before = _workout_rollup_state(workout)
+        # A series contributes through its overrides, which pick up the new type, duration and user
+        overrides_before = [
+            (override, _occurrence_rollup_state(workout, override.occurrence_date, override.status))
+            for override in workout.occurrence_overrides
+        ]
         
         # Update fields
         if 'title' in data:
@@ -871,8 +3022,20 @@ def update_workout(workout_id):
             workout.notes = data['notes']
         if 'status' in data:
             workout.status = data['status']
+        if 'recurrence' in data:
+            try:
+                _apply_recurrence(workout, _parse_recurrence(data['recurrence']) if data['recurrence'] else None)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        elif 'date' in data and workout.recurrence_rule:
+            _apply_recurrence(workout, json.loads(workout.recurrence_rule))
         
         workout.updated_at = datetime.utcnow()
+        _sync_workout_busy(workout)
+        _update_rollups([(rollup_before, _workout_rollup_state(workout))] + [
+            (state, _occurrence_rollup_state(workout, override.occurrence_date, override.status))
+            for override, state in overrides_before
+        ])
         db.session.commit()
         
         return jsonify({
@@ -889,6 +3052,11 @@ def update_workout(workout_id):
 def delete_workout(workout_id):
     try:
         workout = ScheduledWorkout.query.get_or_404(workout_id)
+        _set_busy('workout', workout.id, [workout.user_id, workout.partner_id])
+        _update_rollups([(_workout_rollup_state(workout), None)] + [
+            (_occurrence_rollup_state(workout, override.occurrence_date, override.status), None)
+            for override in workout.occurrence_overrides
+        ])
         db.session.delete(workout)
         db.session.commit()
         
@@ -902,54 +3070,244 @@ def delete_workout(workout_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _get_series_occurrence(workout_id, occurrence_date):
+    workout = ScheduledWorkout.query.get(workout_id)
+    if not workout or not workout.recurrence_rule:
+        return None, None, (jsonify({'success': False, 'error': 'Recurring workout not found'}), 404)
+    try:
+        day = datetime.strptime(occurrence_date, '%Y-%m-%d').date()
+    except ValueError:
+        return None, None, (jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400)
+    rule = json.loads(workout.recurrence_rule)
+    if next(_iter_occurrence_dates(workout.date, rule, day, _earliest(day, workout.series_end_date)), None) != day:
+        return None, None, (jsonify({'success': False, 'error': 'No occurrence on that date'}), 404)
+    return workout, day, None
+
+@app.route('/api/workouts/<int:workout_id>/occurrences/<occurrence_date>', methods=['PUT'])
+def update_workout_occurrence(workout_id, occurrence_date):
+    """Override status and/or notes for a single occurrence of a recurring workout"""
+    try:
+        workout, day, error = _get_series_occurrence(workout_id, occurrence_date)
+        if error:
+            return error
+        data = request.get_json() or {}
+
+        override = WorkoutOccurrenceOverride.query.filter_by(workout_id=workout.id, occurrence_date=day).first()
+        if not override:
+            override = WorkoutOccurrenceOverride(workout_id=workout.id, occurrence_date=day)
+            db.session.add(override)
+        rollup_before = _occurrence_rollup_state(workout, day, override.status)
+        if 'status' in data:
+            override.status = data['status']
+        if 'notes' in data:
+            override.notes = data['notes']
+
+        _update_rollups([(rollup_before, _occurrence_rollup_state(workout, day, override.status))])
+        _invalidate_freebusy([workout.user_id, workout.partner_id])
+        # Keep overrides sparse: drop rows that no longer differ from the series
+        if override.status in (None, workout.status) and override.notes in (None, workout.notes):
+            if override.id:
+                db.session.delete(override)
+            else:
+                db.session.expunge(override)
+        db.session.commit()
+
+        return jsonify({'success': True, 'message': 'Occurrence updated successfully'})
+    except Exception as e:
+        logger.error(f"Error updating occurrence {workout_id}/{occurrence_date}: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/workouts/<int:workout_id>/occurrences/<occurrence_date>', methods=['DELETE'])
+def delete_workout_occurrence(workout_id, occurrence_date):
+    """Skip a single occurrence by adding it to the series exceptions"""
+    try:
+        workout, day, error = _get_series_occurrence(workout_id, occurrence_date)
+        if error:
+            return error
+
+        rule = json.loads(workout.recurrence_rule)
+        rule['exceptions'] = sorted(set(rule.get('exceptions', [])) | {day.isoformat()})
+        workout.recurrence_rule = json.dumps(rule)
+        override = WorkoutOccurrenceOverride.query.filter_by(workout_id=workout.id, occurrence_date=day).first()
+        if override:
+            _update_rollups([(_occurrence_rollup_state(workout, day, override.status), None)])
+            db.session.delete(override)
+        db.session.commit()
+        _invalidate_freebusy([workout.user_id, workout.partner_id])
+
+        return jsonify({'success': True, 'message': 'Occurrence removed successfully'})
+    except Exception as e:
+        logger.error(f"Error deleting occurrence {workout_id}/{occurrence_date}: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Sports Activity endpoints
+def _date_arg(name):
+    try:
+        return datetime.strptime(request.args[name], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return None  # Missing or invalid, ignore
+
+def _time_arg(name):
+    try:
+        return datetime.strptime(request.args[name], '%H:%M').time()
+    except (KeyError, ValueError):
+        return None
+
+def _upcoming_filters(query, date_column, time_column, price_column):
+    """Date, date range, time-of-day window and max price filters shared by class and venue listings.
+
+    Dates stay a range on the leading (date, time) index columns, so the index still
+    yields rows in listing order and the other filters are checked as it is walked.
+    """
+    # Only show future or today's sessions (even if time passed, show today's)
+    date_from = max(_date_arg('date_from') or date_type.min, datetime.utcnow().date())
+    date_to = _date_arg('date_to') or date_type.max
+    day = _date_arg('date')
+    if day:
+        # As a one-day range: mixing date = ? with date >= ? makes SQLite sort again
+        date_from, date_to = max(date_from, day), min(date_to, day)
+    query = query.filter(date_column >= date_from)
+    if date_to != date_type.max:
+        query = query.filter(date_column <= date_to)
+    time_from = _time_arg('time_from')
+    if time_from:
+        query = query.filter(time_column >= time_from)
+    time_to = _time_arg('time_to')
+    if time_to:
+        query = query.filter(time_column <= time_to)
+    max_price = request.args.get('max_price', type=float)
+    if max_price is not None:
+        query = query.filter(price_column <= max_price)
+    return query
+
+# Class occupancy
+# Listing pages cache class metadata only; spots come from class_occupancy, which the booking,
+# cancellation and waitlist paths update after commit and a background job reconciles.
+class_occupancy = OccupancyMap(ttl=app.config['CLASS_OCCUPANCY_TTL'])
+class_listing_cache = TTLCache(maxsize=app.config['CLASS_LISTING_CACHE_SIZE'], ttl=app.config['CLASS_LISTING_CACHE_TTL'])
+_occupancy_reconciler_started = threading.Event()
+
+def _class_occupancy(class_ids):
+    """{class_id: (spots_booked, max_spots)}, loading stale or missing entries in one query"""
+    live = class_occupancy.get_many(class_ids)
+    missing = [cid for cid in class_ids if cid not in live]
+    if missing:
+        rows = db.session.query(StudioClass.id, StudioClass.spots_booked, StudioClass.max_spots).filter(
+            StudioClass.id.in_(missing)
+        ).all()
+        class_occupancy.set_many(rows)
+        live.update({cid: (booked, max_spots) for cid, booked, max_spots in rows})
+    return live
+
+def _reconcile_class_occupancy():
+    """Refresh tracked classes from the database and repair lost spots_booked increments.
+
+    spots_booked is raised to the confirmed ClassBooking count when it has fallen behind;
+    it is never lowered, since seeded or offline bookings have no ClassBooking row.
+    Returns the number of classes repaired.
+    """
+    class_ids = class_occupancy.keys()
+    if not class_ids:
+        return 0
+    today = datetime.utcnow().date()
+    rows = db.session.query(StudioClass.id, StudioClass.spots_booked, StudioClass.max_spots, StudioClass.date).filter(
+        StudioClass.id.in_(class_ids)
+    ).all()
+    class_occupancy.discard([row.id for row in rows if row.date < today] + list(set(class_ids) - {row.id for row in rows}))
+    rows = [row for row in rows if row.date >= today]
+    confirmed = dict(db.session.query(ClassBooking.class_id, db.func.count(ClassBooking.id)).filter(
+        ClassBooking.class_id.in_([row.id for row in rows]), ClassBooking.status == 'confirmed'
+    ).group_by(ClassBooking.class_id).all())
+
+    repaired = 0
+    fresh = []
+    for row in rows:
+        spots_booked = row.spots_booked
+        if confirmed.get(row.id, 0) > spots_booked:
+            spots_booked = confirmed[row.id]
+            db.session.execute(
+                db.update(StudioClass)
+                .where(StudioClass.id == row.id, StudioClass.spots_booked < spots_booked)
+                .values(spots_booked=spots_booked)
+                .execution_options(synchronize_session=False)
+            )
+            repaired += 1
+        fresh.append((row.id, spots_booked, row.max_spots))
+    db.session.commit()
+    class_occupancy.set_many(fresh)
+    if repaired:
+        logger.warning(f"Repaired spots_booked on {repaired} classes")
+    return repaired
+
+def _occupancy_reconciler():
+    while True:
+        time.sleep(app.config['CLASS_OCCUPANCY_RECONCILE_SECONDS'])
+        with app.app_context():
+            try:
+                _reconcile_class_occupancy()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error reconciling class occupancy: {str(e)}")
+
+def _start_occupancy_reconciler():
+    if not _occupancy_reconciler_started.is_set():
+        _occupancy_reconciler_started.set()
+        threading.Thread(target=_occupancy_reconciler, name='occupancy-reconciler', daemon=True).start()
+
 @app.route('/api/sports/classes', methods=['GET'])
 def get_studio_classes():
     try:
-        sport_type = request.args.get('sport_type')  # filter by sport type
-        date = request.args.get('date')  # filter by date
-        level = request.args.get('level')
-        limit = request.args.get('limit', 50, type=int)  # limit results
-        
-        query = StudioClass.query.filter(StudioClass.is_active == True)
-        
-        if sport_type:
-            query = query.filter(StudioClass.sport_type == sport_type)
-        if date:
-            try:
-                filter_date = datetime.strptime(date, '%Y-%m-%d').date()
-                query = query.filter(StudioClass.date == filter_date)
-            except ValueError:
-                pass  # Invalid date format, ignore
-        if level:
-            query = query.filter(StudioClass.level == level)
-        
-        # Only show future or today's classes (even if time passed, show today's classes)
-        today = datetime.utcnow().date()
-        query = query.filter(StudioClass.date >= today)
+        cache_key = (datetime.utcnow().date(), tuple(sorted(request.args.items(multi=True))))
+        classes_data = class_listing_cache.get(cache_key)
+        if classes_data is None:
+            sport_type = request.args.get('sport_type')  # filter by sport type
+            level = request.args.get('level')
+            intensity = request.args.get('intensity')
+            limit = request.args.get('limit', 50, type=int)  # limit results
+            
+            query = StudioClass.query.filter(StudioClass.is_active == True)
+            
+            if sport_type:
+                query = query.filter(StudioClass.sport_type == sport_type)
+            if level:
+                query = query.filter(StudioClass.level == level)
+            if intensity:
+                query = query.filter(StudioClass.intensity == intensity)
+            query = _upcoming_filters(query, StudioClass.date, StudioClass.time, StudioClass.price)
+            
+            # Limit and order
+            classes = query.order_by(StudioClass.date, StudioClass.time).limit(limit).all()
+            
+            classes_data = []
+            for cls in classes:
+                classes_data.append({
+                    'id': cls.id,
+                    'name': cls.name,
+                    'sport_type': cls.sport_type,
+                    'instructor_name': cls.instructor_name,
+                    'date': cls.date.isoformat(),
+                    'time': cls.time.strftime('%H:%M'),
+                    'duration': cls.duration,
+                    'level': cls.level,
+                    'intensity': cls.intensity,
+                    'max_spots': cls.max_spots,
+                    'location': cls.location,
+                    'description': cls.description,
+                    'price': cls.price,
+                })
+            class_listing_cache.set(cache_key, classes_data)
+            class_occupancy.set_many((cls.id, cls.spots_booked, cls.max_spots) for cls in classes)
+            _start_occupancy_reconciler()
         
-        # Limit and order
-        classes = query.order_by(StudioClass.date, StudioClass.time).limit(limit).all()
-        
-        classes_data = []
-        for cls in classes:
-            classes_data.append({
-                'id': cls.id,
-                'name': cls.name,
-                'sport_type': cls.sport_type,
-                'instructor_name': cls.instructor_name,
-                'date': cls.date.isoformat(),
-                'time': cls.time.strftime('%H:%M'),
-                'duration': cls.duration,
-                'level': cls.level,
-                'intensity': cls.intensity,
-                'max_spots': cls.max_spots,
-                'spots_booked': cls.spots_booked,
-                'spots_left': cls.max_spots - cls.spots_booked,
-                'location': cls.location,
-                'description': cls.description,
-                'price': cls.price,
-            })
+        # Overlay live availability on the cached page
+        occupancy = _class_occupancy([cls['id'] for cls in classes_data])
+        classes_data = [
+            dict(cls, spots_booked=occupancy[cls['id']][0], max_spots=occupancy[cls['id']][1],
+                 spots_left=max(0, occupancy[cls['id']][1] - occupancy[cls['id']][0]))
+            for cls in classes_data if cls['id'] in occupancy
+        ]
         
         return jsonify({'success': True, 'classes': classes_data})
     except Exception as e:
@@ -960,23 +3318,13 @@ def get_studio_classes():
 def get_sports_venues():
     try:
         sport_type = request.args.get('sport_type')  # filter by sport type
-        date = request.args.get('date')  # filter by date
         limit = request.args.get('limit', 50, type=int)  # limit results
         
         query = SportsVenue.query.filter(SportsVenue.is_available == True)
         
         if sport_type:
             query = query.filter(SportsVenue.sport_type == sport_type)
-        if date:
-            try:
-                filter_date = datetime.strptime(date, '%Y-%m-%d').date()
-                query = query.filter(SportsVenue.date == filter_date)
-            except ValueError:
-                pass  # Invalid date format, ignore
-        
-        # Only show future or today's venues (even if time passed, show today's venues)
-        today = datetime.utcnow().date()
-        query = query.filter(SportsVenue.date >= today)
+        query = _upcoming_filters(query, SportsVenue.date, SportsVenue.start_time, SportsVenue.price_per_hour)
         
         # Limit and order
         venues = query.order_by(SportsVenue.date, SportsVenue.start_time).limit(limit).all()
@@ -1003,7 +3351,18 @@ def get_sports_venues():
         logger.error(f"Error fetching sports venues: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _claim_class_spot(class_id):
+    """Atomically take one spot in a class; False if it is already full"""
+    result = db.session.execute(
+        db.update(StudioClass)
+        .where(StudioClass.id == class_id, StudioClass.spots_booked < StudioClass.max_spots)
+        .values(spots_booked=StudioClass.spots_booked + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
 @app.route('/api/sports/classes/book', methods=['POST'])
+@idempotent
 def book_class():
     try:
         data = request.get_json() or {}
@@ -1013,20 +3372,18 @@ def book_class():
         if not user_id or not class_id:
             return jsonify({'success': False, 'error': 'user_id and class_id are required'}), 400
         
-        # Check if class exists and has spots
         studio_class = StudioClass.query.get(class_id)
         if not studio_class:
             return jsonify({'success': False, 'error': 'Class not found'}), 404
         
-        if studio_class.spots_booked >= studio_class.max_spots:
-            return jsonify({'success': False, 'error': 'Class is full'}), 400
+        class_start = datetime.combine(studio_class.date, studio_class.time)
+        class_end = class_start + timedelta(minutes=studio_class.duration)
+        if not data.get('allow_overlap'):
+            conflicts = _find_conflicts([user_id], [(class_start, class_end)])
+            if conflicts:
+                return _conflict_response(conflicts)
         
-        # Check if user already booked this class
-        existing = ClassBooking.query.filter_by(user_id=user_id, class_id=class_id, status='confirmed').first()
-        if existing:
-            return jsonify({'success': False, 'error': 'You have already booked this class'}), 400
-        
-        # Create booking
+        # The partial unique index rejects a second confirmed booking, even from a concurrent request
         booking = ClassBooking(
             user_id=user_id,
             class_id=class_id,
@@ -1034,18 +3391,462 @@ def book_class():
             status='confirmed'
         )
         db.session.add(booking)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'You have already booked this class'}), 400
+        
+        # Claim a spot in the database rather than read-check-increment in Python
+        if not _claim_class_spot(class_id):
+            db.session.rollback()
+            if data.get('waitlist'):
+                entry, _ = _join_waitlist(user_id, class_id)
+                db.session.commit()
+                return jsonify({'success': True, 'status': 'waiting', 'position': _waitlist_position(entry),
+                                'message': 'Class is full; you are on the waitlist'}), 202
+            return jsonify({'success': False, 'error': 'Class is full'}), 400
+        _set_busy('class', booking.id, [user_id], class_start, class_end)
+        db.session.commit()
+        class_occupancy.adjust(studio_class.id, 1)
         
-        # Update spots booked
-        studio_class.spots_booked += 1
+        return jsonify({'success': True, 'message': 'Class booked successfully', 'booking_id': booking.id})
+    except Exception as e:
+        logger.error(f"Error booking class: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Class templates
+CLASS_TEMPLATE_FIELDS = ('name', 'sport_type', 'instructor_name', 'duration', 'level', 'intensity',
+                         'max_spots', 'location', 'description', 'price')
+
+def _template_dates(template, start, end):
+    """Dates in [start, end] on which the template runs"""
+    start = max(start, template.starts_on or start)
+    end = min(end, template.ends_on or end)
+    day = start + timedelta(days=(template.weekday - start.weekday()) % 7)
+    while day <= end:
+        yield day
+        day += timedelta(days=7)
+
+def _materialize_class_templates(weeks=None, template_ids=None):
+    """Make sure every active template has a StudioClass row for each date in the next N weeks.
+
+    Idempotent: rows are keyed by (template_id, date), existing ones are left alone, so
+    a run costs one read of the window plus one bulk insert. Returns rows created.
+    """
+    weeks = weeks or app.config['CLASS_TEMPLATE_WEEKS']
+    start = datetime.utcnow().date()
+    end = start + timedelta(weeks=weeks) - timedelta(days=1)
+
+    templates = ClassTemplate.query.filter(ClassTemplate.is_active == True)
+    if template_ids is not None:
+        templates = templates.filter(ClassTemplate.id.in_(template_ids))
+    templates = templates.all()
+    if not templates:
+        return 0
+
+    existing = set(db.session.query(StudioClass.template_id, StudioClass.date).filter(
+        StudioClass.template_id.in_([t.id for t in templates]),
+        StudioClass.date >= start,
+        StudioClass.date <= end
+    ))
+    rows = [
+        dict({field: getattr(template, field) for field in CLASS_TEMPLATE_FIELDS},
+             template_id=template.id, date=day, time=template.time, spots_booked=0, is_active=True)
+        for template in templates
+        for day in _template_dates(template, start, end)
+        if (template.id, day) not in existing
+    ]
+    if not rows:
+        return 0
+
+    # A concurrent run (another worker) may have inserted some of the same keys
+    now = datetime.utcnow()
+    for row in rows:
+        row.update(created_at=now, updated_at=now)
+    created = _insert_ignoring_conflicts(db.session.connection(), StudioClass.__table__, rows, ['template_id', 'date'])
+    db.session.commit()
+    class_listing_cache.clear()
+    return created
+
+def _class_materializer():
+    interval = app.config['CLASS_TEMPLATE_INTERVAL_HOURS'] * 3600
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                created = _materialize_class_templates()
+                if created:
+                    logger.info(f"Materialized {created} classes from templates")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error materializing class templates: {str(e)}")
+
+_class_materializer_started = threading.Event()
+
+@app.before_request
+def _start_class_materializer():
+    # Started on the first request so scripts importing the app don't spawn threads;
+    # init_db has already materialized the current window
+    if app.config['CLASS_TEMPLATE_INTERVAL_HOURS'] > 0 and not _class_materializer_started.is_set():
+        _class_materializer_started.set()
+        threading.Thread(target=_class_materializer, name='class-materializer', daemon=True).start()
+
+@app.cli.command('materialize-classes')
+@click.option('--weeks', type=int, default=None, help='How many weeks ahead to fill')
+def materialize_classes_command(weeks):
+    """Create upcoming StudioClass rows from class templates"""
+    print(f"Created {_materialize_class_templates(weeks)} classes")
+
+def _serialize_class_template(template):
+    return {
+        'id': template.id,
+        'name': template.name,
+        'sport_type': template.sport_type,
+        'instructor_name': template.instructor_name,
+        'weekday': WEEKDAY_NAMES[template.weekday],
+        'time': template.time.strftime('%H:%M'),
+        'duration': template.duration,
+        'level': template.level,
+        'intensity': template.intensity,
+        'max_spots': template.max_spots,
+        'location': template.location,
+        'description': template.description,
+        'price': template.price,
+        'starts_on': template.starts_on.isoformat() if template.starts_on else None,
+        'ends_on': template.ends_on.isoformat() if template.ends_on else None,
+        'is_active': template.is_active,
+    }
+
+@app.route('/api/sports/class-templates', methods=['GET'])
+def get_class_templates():
+    templates = ClassTemplate.query.filter(ClassTemplate.is_active == True).order_by(
+        ClassTemplate.weekday, ClassTemplate.time
+    ).all()
+    return jsonify({'success': True, 'templates': [_serialize_class_template(t) for t in templates]})
+
+@app.route('/api/sports/class-templates', methods=['POST'])
+def create_class_template():
+    """Create a weekly class template and materialize its upcoming classes"""
+    try:
+        data = request.get_json() or {}
+        missing = [f for f in ('name', 'sport_type', 'weekday', 'time', 'duration') if f not in data]
+        if missing:
+            return jsonify({'success': False, 'error': f'Missing required fields: {", ".join(missing)}'}), 400
+
+        weekday = data['weekday']
+        if isinstance(weekday, str):
+            weekday = WEEKDAY_NAMES.index(weekday[:3].lower()) if weekday[:3].lower() in WEEKDAY_NAMES else -1
+        if not isinstance(weekday, int) or not 0 <= weekday <= 6:
+            return jsonify({'success': False, 'error': 'weekday must be 0-6 or a day name'}), 400
+        duration = data['duration']
+        if not isinstance(duration, int) or isinstance(duration, bool) or duration < 1:
+            return jsonify({'success': False, 'error': 'duration must be a positive number of minutes'}), 400
+        if not isinstance(data['time'], str):
+            return jsonify({'success': False, 'error': 'time must be an HH:MM string'}), 400
+        try:
+            template = ClassTemplate(
+                weekday=weekday,
+                time=datetime.strptime(data['time'], '%H:%M').time(),
+                starts_on=date_type.fromisoformat(data['starts_on']) if data.get('starts_on') else None,
+                ends_on=date_type.fromisoformat(data['ends_on']) if data.get('ends_on') else None,
+                **{field: data[field] for field in CLASS_TEMPLATE_FIELDS if field in data}
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'Invalid date or time: {e}'}), 400
+        db.session.add(template)
+        db.session.commit()
+
+        created = _materialize_class_templates(template_ids=[template.id])
+        return jsonify({'success': True, 'template': _serialize_class_template(template), 'classes_created': created}), 201
+    except Exception as e:
+        logger.error(f"Error creating class template: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Class waitlist and cancellation
+def _waitlist_position(entry):
+    return ClassWaitlistEntry.query.filter(
+        ClassWaitlistEntry.class_id == entry.class_id,
+        ClassWaitlistEntry.status == 'waiting',
+        ClassWaitlistEntry.id <= entry.id
+    ).count()
+
+def _join_waitlist(user_id, class_id):
+    """Queue the user for a full class; returns (entry, created). Joining twice returns the same entry"""
+    entry = ClassWaitlistEntry(user_id=user_id, class_id=class_id, status='waiting')
+    try:
+        with db.session.begin_nested():
+            db.session.add(entry)
+        return entry, True
+    except IntegrityError:
+        return ClassWaitlistEntry.query.filter_by(user_id=user_id, class_id=class_id, status='waiting').first(), False
+
+def _promote_from_waitlist(studio_class):
+    """Hand a spot the caller already holds to the head of the waitlist.
+
+    Runs in the caller's transaction. Entries whose user meanwhile booked the class
+    directly are skipped and closed. Returns the promoted (entry, booking) or None
+    when nobody is waiting, in which case the caller still owns the spot.
+    """
+    class_start = datetime.combine(studio_class.date, studio_class.time)
+    class_end = class_start + timedelta(minutes=studio_class.duration)
+    while True:
+        entry = ClassWaitlistEntry.query.filter_by(
+            class_id=studio_class.id, status='waiting'
+        ).order_by(ClassWaitlistEntry.id).first()
+        if entry is None:
+            return None
+        # Claim the entry itself so two concurrent cancellations cannot promote the same user
+        claimed = db.session.execute(
+            db.update(ClassWaitlistEntry)
+            .where(ClassWaitlistEntry.id == entry.id, ClassWaitlistEntry.status == 'waiting')
+            .values(status='left', updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            continue
+        booking = ClassBooking(user_id=entry.user_id, class_id=studio_class.id, status='confirmed',
+                               notes='Promoted from waitlist')
+        try:
+            with db.session.begin_nested():
+                db.session.add(booking)
+        except IntegrityError:
+            continue
+        db.session.expire(entry)
+        entry.status = 'promoted'
+        entry.booking_id = booking.id
+        _set_busy('class', booking.id, [entry.user_id], class_start, class_end)
+        return entry, booking
+
+def _release_class_spot(class_id):
+    db.session.execute(
+        db.update(StudioClass)
+        .where(StudioClass.id == class_id, StudioClass.spots_booked > 0)
+        .values(spots_booked=StudioClass.spots_booked - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def _publish_promotion(studio_class, entry, booking):
+    event_hub.publish(entry.user_id, 'class_promoted', {
+        'class_id': studio_class.id,
+        'class_name': studio_class.name,
+        'date': studio_class.date.isoformat(),
+        'time': studio_class.time.strftime('%H:%M'),
+        'booking_id': booking.id,
+    })
+
+@app.route('/api/sports/classes/<int:class_id>/waitlist', methods=['GET', 'POST', 'DELETE'])
+def class_waitlist(class_id):
+    """Join (POST), check position in (GET) or leave (DELETE) a class waitlist"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = data.get('user_id') or request.args.get('user_id', type=int)
+        if not user_id:
+            return jsonify({'success': False, 'error': 'user_id is required'}), 400
+
+        studio_class = StudioClass.query.get(class_id)
+        if not studio_class:
+            return jsonify({'success': False, 'error': 'Class not found'}), 404
+
+        if request.method == 'POST':
+            if ClassBooking.query.filter_by(user_id=user_id, class_id=class_id, status='confirmed').first():
+                return jsonify({'success': False, 'error': 'You have already booked this class'}), 400
+            entry, created = _join_waitlist(user_id, class_id)
+            promoted = None
+            # A spot may have opened after the client saw the class as full
+            if created and _claim_class_spot(class_id):
+                promoted = _promote_from_waitlist(studio_class)
+                if promoted is None:
+                    _release_class_spot(class_id)
+            db.session.commit()
+            if promoted:
+                class_occupancy.adjust(studio_class.id, 1)
+                _publish_promotion(studio_class, *promoted)
+            if entry.status == 'promoted':
+                return jsonify({'success': True, 'status': 'booked', 'booking_id': entry.booking_id})
+            return jsonify({'success': True, 'status': 'waiting', 'position': _waitlist_position(entry)}), 201 if created else 200
+
+        entry = ClassWaitlistEntry.query.filter_by(user_id=user_id, class_id=class_id, status='waiting').first()
+        if request.method == 'DELETE':
+            if entry:
+                entry.status = 'left'
+                db.session.commit()
+            return jsonify({'success': True, 'status': 'left'})
+
+        if not entry:
+            return jsonify({'success': True, 'status': 'not_waiting'})
+        return jsonify({'success': True, 'status': 'waiting', 'position': _waitlist_position(entry)})
+    except Exception as e:
+        logger.error(f"Error updating class waitlist: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/sports/classes/bookings/<int:booking_id>/cancel', methods=['POST'])
+def cancel_class_booking(booking_id):
+    """Cancel a confirmed booking and pass the spot to the head of the waitlist"""
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            user_id = int(data.get('user_id'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'user_id is required and must be an integer'}), 400
+
+        booking = ClassBooking.query.get(booking_id)
+        if not booking:
+            return jsonify({'success': False, 'error': 'Booking not found'}), 404
+        if booking.user_id != user_id:
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+
+        # Conditional so that concurrent cancels of the same booking free only one spot
+        cancelled = db.session.execute(
+            db.update(ClassBooking)
+            .where(ClassBooking.id == booking_id, ClassBooking.status == 'confirmed')
+            .values(status='cancelled', updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not cancelled:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Booking is not active'}), 400
+        _set_busy('class', booking_id, [booking.user_id])
+
+        studio_class = StudioClass.query.get(booking.class_id)
+        promoted = _promote_from_waitlist(studio_class)
+        if promoted is None:
+            _release_class_spot(studio_class.id)
+        db.session.commit()
+
+        if promoted:
+            _publish_promotion(studio_class, *promoted)
+        else:
+            class_occupancy.adjust(studio_class.id, -1)
+        return jsonify({
+            'success': True,
+            'message': 'Booking cancelled',
+            'promoted_user_id': promoted[0].user_id if promoted else None,
+        })
+    except Exception as e:
+        logger.error(f"Error cancelling class booking: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Venue slot holds
+# Each SportsVenue row is one bookable slot (venue, court, date, start, end). Holds live in
+# venue_hold and are mirrored in an in-memory expiring map so bursts against a held slot are
+# turned away without touching the database. The map can only over-report a hold (e.g. one
+# released on another worker) until its expiry; the conditional claim in book_venue is what
+# prevents double-booking.
+venue_holds = TTLCache(maxsize=app.config['VENUE_HOLD_CACHE_SIZE'], ttl=app.config['VENUE_HOLD_SECONDS'])
+_hold_reaper_started = threading.Event()
+
+def _active_hold(venue_id, now):
+    """(user_id, expires_at) of the live hold on a slot, or None"""
+    hold = venue_holds.get(venue_id)
+    if hold is not None:
+        return hold if hold[1] > now else None
+    row = VenueHold.query.filter(VenueHold.venue_id == venue_id, VenueHold.expires_at > now).first()
+    if row is None:
+        return None
+    hold = (row.user_id, row.expires_at)
+    venue_holds.set(venue_id, hold, ttl=(row.expires_at - now).total_seconds())
+    return hold
+
+def _held_response(hold, now):
+    response = jsonify({'success': False, 'error': 'Venue slot is held by another user',
+                        'held_until': hold[1].isoformat()})
+    response.headers['Retry-After'] = str(max(1, int((hold[1] - now).total_seconds())))
+    return response, 409
+
+def _reap_expired_venue_holds():
+    """Delete expired holds; returns how many were removed"""
+    removed = VenueHold.query.filter(VenueHold.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+def _hold_reaper():
+    interval = app.config['VENUE_HOLD_REAP_SECONDS']
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                removed = _reap_expired_venue_holds()
+                if removed:
+                    logger.info(f"Reaped {removed} expired venue holds")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error reaping venue holds: {str(e)}")
+
+def _start_hold_reaper():
+    # Started on first use so scripts importing the app don't spawn threads
+    if not _hold_reaper_started.is_set():
+        _hold_reaper_started.set()
+        threading.Thread(target=_hold_reaper, name='venue-hold-reaper', daemon=True).start()
+
+@app.route('/api/sports/venues/<int:venue_id>/hold', methods=['POST', 'DELETE'])
+def venue_hold(venue_id):
+    """Hold a venue slot for VENUE_HOLD_SECONDS while the user confirms (DELETE releases it)"""
+    try:
+        data = request.get_json(silent=True)
+        data = data if isinstance(data, dict) else {}
+        try:
+            user_id = int(data.get('user_id'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'user_id is required and must be an integer'}), 400
+        now = datetime.utcnow()
+
+        if request.method == 'DELETE':
+            VenueHold.query.filter_by(venue_id=venue_id, user_id=user_id).delete(synchronize_session=False)
+            db.session.commit()
+            venue_holds.pop(venue_id)
+            return jsonify({'success': True})
+
+        hold = _active_hold(venue_id, now)
+        if hold and hold[0] != user_id:
+            return _held_response(hold, now)
+
+        venue = SportsVenue.query.get(venue_id)
+        if not venue:
+            return jsonify({'success': False, 'error': 'Venue not found'}), 404
+        if not venue.is_available:
+            return jsonify({'success': False, 'error': 'Venue is not available'}), 400
+
+        expires_at = now + timedelta(seconds=app.config['VENUE_HOLD_SECONDS'])
+        # Take over an expired hold or create one; the unique venue_id settles concurrent holders
+        taken = db.session.execute(
+            db.update(VenueHold)
+            .where(VenueHold.venue_id == venue_id,
+                   db.or_(VenueHold.expires_at <= now, VenueHold.user_id == user_id))
+            .values(user_id=user_id, expires_at=expires_at, created_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not taken:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(VenueHold(venue_id=venue_id, user_id=user_id, expires_at=expires_at))
+            except IntegrityError:
+                db.session.rollback()
+                hold = _active_hold(venue_id, now)
+                if hold is None:
+                    return jsonify({'success': False, 'error': 'Venue slot is being held, try again'}), 409
+                return _held_response(hold, now)
         db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Class booked successfully', 'booking_id': booking.id})
+
+        venue_holds.set(venue_id, (user_id, expires_at), ttl=app.config['VENUE_HOLD_SECONDS'])
+        _start_hold_reaper()
+        return jsonify({'success': True, 'venue_id': venue_id, 'expires_at': expires_at.isoformat()})
     except Exception as e:
-        logger.error(f"Error booking class: {str(e)}")
+        logger.error(f"Error holding venue: {str(e)}")
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.cli.command('reap-venue-holds')
+def reap_venue_holds_command():
+    """Delete expired venue slot holds"""
+    print(f"Removed {_reap_expired_venue_holds()} expired venue holds")
+
 @app.route('/api/sports/venues/book', methods=['POST'])
+@idempotent
 def book_venue():
     try:
         data = request.get_json() or {}
@@ -1055,20 +3856,30 @@ def book_venue():
         if not user_id or not venue_id:
             return jsonify({'success': False, 'error': 'user_id and venue_id are required'}), 400
         
-        # Check if venue exists and is available
+        user_id = int(user_id)
+        now = datetime.utcnow()
+        hold = _active_hold(venue_id, now)
+        if hold and hold[0] != user_id:
+            return _held_response(hold, now)
+        
         venue = SportsVenue.query.get(venue_id)
         if not venue:
             return jsonify({'success': False, 'error': 'Venue not found'}), 404
         
-        if not venue.is_available:
+        # Claim the slot in one statement: still available and not held by someone else
+        foreign_hold = db.session.query(VenueHold.id).filter(
+            VenueHold.venue_id == venue_id, VenueHold.expires_at > now, VenueHold.user_id != user_id
+        ).exists()
+        claimed = db.session.execute(
+            db.update(SportsVenue)
+            .where(SportsVenue.id == venue_id, SportsVenue.is_available == True, ~foreign_hold)
+            .values(is_available=False, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
             return jsonify({'success': False, 'error': 'Venue is not available'}), 400
         
-        # Check if venue is already booked
-        existing = VenueBooking.query.filter_by(venue_id=venue_id, status='confirmed').first()
-        if existing:
-            return jsonify({'success': False, 'error': 'Venue is already booked'}), 400
-        
-        # Create booking
         booking = VenueBooking(
             user_id=user_id,
             venue_id=venue_id,
@@ -1076,10 +3887,16 @@ def book_venue():
             status='confirmed'
         )
         db.session.add(booking)
-        
-        # Mark venue as unavailable
-        venue.is_available = False
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Venue is already booked'}), 400
+        VenueHold.query.filter_by(venue_id=venue_id).delete(synchronize_session=False)
+        _set_busy('venue', booking.id, [user_id],
+                  datetime.combine(venue.date, venue.start_time), datetime.combine(venue.date, venue.end_time))
         db.session.commit()
+        venue_holds.pop(venue_id)
         
         return jsonify({'success': True, 'message': 'Venue booked successfully', 'booking_id': booking.id})
     except Exception as e:
@@ -1088,6 +3905,362 @@ def book_venue():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Professional Training endpoints
+trainer_catalog_cache = TTLCache(maxsize=8, ttl=app.config['TRAINER_CATALOG_CACHE_TTL'])
+
+def _trainer_catalog_counts():
+    """Trainer counts for diagnostics and facets, cached until the next trainer write"""
+    counts = trainer_catalog_cache.get('counts')
+    if counts is None:
+        row = db.session.query(
+            db.func.count(ProfessionalTrainer.id),
+            db.func.count(ProfessionalTrainer.id).filter(ProfessionalTrainer.is_available == True),
+            db.func.count(ProfessionalTrainer.id).filter(ProfessionalTrainer.gender == 'female'),
+            db.func.count(ProfessionalTrainer.id).filter(ProfessionalTrainer.female_friendly == True),
+        ).one()
+        counts = dict(zip(('total', 'available', 'female', 'female_friendly'), row))
+        trainer_catalog_cache.set('counts', counts)
+    return counts
+
+def _on_trainer_write(mapper, connection, trainer):
+    # Mapper events also catch the seeding scripts; the TTL covers writes from other workers
+    trainer_catalog_cache.clear()
+    trainer_features.invalidate()
+
+for _trainer_event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(ProfessionalTrainer, _trainer_event, _on_trainer_write)
+
+# Trainer tags
+TRAINER_TAG_KINDS = ('specialization', 'language', 'certification')
+
+def _tag_slug(name):
+    return ' '.join(str(name).lower().split())
+
+def _trainer_tag_names(trainer):
+    """{(kind, slug): name} parsed from the trainer's specialization, languages and certification"""
+    names = {}
+    values = {'specialization': (trainer.specialization or '').split(',')}
+    for kind, raw in (('language', trainer.languages), ('certification', trainer.certification)):
+        try:
+            parsed = json.loads(raw) if raw else []
+        except ValueError:
+            parsed = raw.split(',')
+        values[kind] = parsed if isinstance(parsed, list) else [parsed]
+    for kind, items in values.items():
+        for item in items:
+            if str(item).strip():
+                names.setdefault((kind, _tag_slug(item)), str(item).strip())
+    return names
+
+def _recount_trainer_tags(connection, tag_ids):
+    if not tag_ids:
+        return
+    link, trainer, counts = TrainerTagLink.__table__, ProfessionalTrainer.__table__, TrainerTagCount.__table__
+    rows = connection.execute(
+        db.select(
+            link.c.tag_id,
+            db.func.count(),
+            db.func.count().filter(trainer.c.is_available == True),
+        ).select_from(link.join(trainer, trainer.c.id == link.c.trainer_id))
+        .where(link.c.tag_id.in_(tag_ids)).group_by(link.c.tag_id)
+    ).all()
+    connection.execute(counts.delete().where(counts.c.tag_id.in_(tag_ids)))
+    if rows:
+        connection.execute(counts.insert(), [
+            {'tag_id': tag_id, 'trainer_count': total, 'available_count': available}
+            for tag_id, total, available in rows
+        ])
+
+def _sync_trainer_tags(connection, trainer_id, names, recount_all=False):
+    """Point trainer_id's tag links at names, interning new tags, and refresh affected counts"""
+    tag, link = TrainerTag.__table__, TrainerTagLink.__table__
+    tag_ids = {}
+    if names:
+        slugs = {slug for _, slug in names}
+        for tag_id, kind, slug in connection.execute(
+            db.select(tag.c.id, tag.c.kind, tag.c.slug).where(tag.c.slug.in_(slugs))
+        ):
+            if (kind, slug) in names:
+                tag_ids[(kind, slug)] = tag_id
+        missing = [{'kind': kind, 'slug': slug, 'name': names[(kind, slug)]} for kind, slug in names if (kind, slug) not in tag_ids]
+        if missing:
+            _insert_ignoring_conflicts(connection, tag, missing, ['kind', 'slug'])
+            for tag_id, kind, slug in connection.execute(
+                db.select(tag.c.id, tag.c.kind, tag.c.slug).where(tag.c.slug.in_({row['slug'] for row in missing}))
+            ):
+                if (kind, slug) in names:
+                    tag_ids[(kind, slug)] = tag_id
+
+    wanted = set(tag_ids.values())
+    current = set(connection.execute(db.select(link.c.tag_id).where(link.c.trainer_id == trainer_id)).scalars())
+    removed, added = current - wanted, wanted - current
+    if removed:
+        connection.execute(link.delete().where(link.c.trainer_id == trainer_id, link.c.tag_id.in_(removed)))
+    if added:
+        connection.execute(link.insert(), [{'trainer_id': trainer_id, 'tag_id': tag_id} for tag_id in added])
+    _recount_trainer_tags(connection, (current | wanted) if recount_all else (removed | added))
+
+def _on_trainer_tags_insert(mapper, connection, trainer):
+    _sync_trainer_tags(connection, trainer.id, _trainer_tag_names(trainer), recount_all=True)
+
+def _on_trainer_tags_update(mapper, connection, trainer):
+    state = db.inspect(trainer)
+    availability_changed = state.attrs.is_available.history.has_changes()
+    if any(state.attrs[field].history.has_changes() for field in ('specialization', 'languages', 'certification')):
+        _sync_trainer_tags(connection, trainer.id, _trainer_tag_names(trainer), recount_all=availability_changed)
+    elif availability_changed:
+        link = TrainerTagLink.__table__
+        _recount_trainer_tags(connection, set(connection.execute(
+            db.select(link.c.tag_id).where(link.c.trainer_id == trainer.id)
+        ).scalars()))
+
+def _on_trainer_tags_delete(mapper, connection, trainer):
+    _sync_trainer_tags(connection, trainer.id, {})
+
+event.listen(ProfessionalTrainer, 'after_insert', _on_trainer_tags_insert)
+event.listen(ProfessionalTrainer, 'after_update', _on_trainer_tags_update)
+event.listen(ProfessionalTrainer, 'before_delete', _on_trainer_tags_delete)
+
+def _rebuild_trainer_tags():
+    """Re-derive every trainer's tag links and all facet counts (backfill / repair)"""
+    connection = db.session.connection()
+    for trainer in ProfessionalTrainer.query.all():
+        _sync_trainer_tags(connection, trainer.id, _trainer_tag_names(trainer))
+    _recount_trainer_tags(connection, [tag_id for (tag_id,) in db.session.query(TrainerTag.id)])
+    db.session.commit()
+    return TrainerTag.query.count()
+
+@app.cli.command('rebuild-trainer-tags')
+def rebuild_trainer_tags_command():
+    """Rebuild the trainer tag index and facet counts"""
+    print(f"Indexed {_rebuild_trainer_tags()} trainer tags")
+
+def _resolve_trainer_tags(tokens):
+    """[[tag ids], ...] per requested token; tokens are 'name' or 'kind:name'"""
+    wanted = []
+    for token in tokens:
+        kind, _, name = token.rpartition(':')
+        wanted.append((kind.strip().lower() or None, _tag_slug(name)))
+    by_slug = defaultdict(list)
+    for tag_id, kind, slug in db.session.query(TrainerTag.id, TrainerTag.kind, TrainerTag.slug).filter(
+        TrainerTag.slug.in_({slug for _, slug in wanted})
+    ):
+        by_slug[slug].append((kind, tag_id))
+    return [[tag_id for kind, tag_id in by_slug[slug] if want_kind in (None, kind)] for want_kind, slug in wanted]
+
+def _trainer_tag_filter(tokens, match_all=True):
+    """Condition on ProfessionalTrainer.id answered from the tag postings index"""
+    link = TrainerTagLink.__table__
+    groups = _resolve_trainer_tags(tokens)
+    if match_all:
+        if any(not ids for ids in groups):
+            return db.false()
+        postings = [db.select(link.c.trainer_id).where(link.c.tag_id.in_(ids)) for ids in groups]
+        return ProfessionalTrainer.id.in_(postings[0] if len(postings) == 1 else db.intersect(*postings))
+    ids = [tag_id for group in groups for tag_id in group]
+    return ProfessionalTrainer.id.in_(db.select(link.c.trainer_id).where(link.c.tag_id.in_(ids))) if ids else db.false()
+
+# Personalized trainer ranking
+TRAINER_RANK_WEIGHTS = {
+    'goals': 3.0,
+    'language': 2.0,
+    'price': 1.5,
+    'gender': 2.0,
+    'experience': 1.0,
+    'rating': 2.0,
+    'distance': 1.5,
+}
+# Words that appear in most specializations and say nothing about fit
+TRAINER_RANK_STOPWORDS = {'training', 'fitness', 'and', '&', 'specialist', 'coach', 'coaching'}
+
+def _rank_terms(values):
+    """Specialization words for goals like 'weight_loss' or names like 'Weight Loss, Yoga'"""
+    terms = set()
+    for value in values:
+        for part in str(value).replace('_', ' ').split(','):
+            terms.update(w for w in _tag_slug(part).split() if w not in TRAINER_RANK_STOPWORDS)
+    return terms
+
+def _json_list(raw):
+    try:
+        value = json.loads(raw) if raw else []
+    except ValueError:
+        value = raw.split(',')
+    return value if isinstance(value, list) else [value]
+
+class TrainerFeatureIndex:
+    """Per-trainer feature matrices for ranking, rebuilt lazily after trainer writes.
+
+    `terms` is a 0/1 matrix over one vocabulary of specialization words, languages and
+    location areas, so the categorical part of a user's score is one matrix-vector
+    product; the numeric features are precomputed columns combined elementwise.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._built_at = 0.0
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._built_at < self.ttl:
+                return self._snapshot
+            generation = self._generation
+        snapshot = self._build()
+        with self._lock:
+            # A write that landed while we were building makes this snapshot stale already
+            if generation == self._generation:
+                self._snapshot, self._built_at = snapshot, time.monotonic()
+        return snapshot
+
+    def _build(self):
+        # Rating order doubles as the tie-breaker: argsort below is stable
+        rows = db.session.query(
+            ProfessionalTrainer.id, ProfessionalTrainer.gender, ProfessionalTrainer.female_friendly,
+            ProfessionalTrainer.specialization, ProfessionalTrainer.languages, ProfessionalTrainer.location,
+            ProfessionalTrainer.experience_years, ProfessionalTrainer.rating, ProfessionalTrainer.review_count,
+            ProfessionalTrainer.hourly_rate, ProfessionalTrainer.latitude, ProfessionalTrainer.longitude,
+        ).order_by(ProfessionalTrainer.rating.desc(), ProfessionalTrainer.review_count.desc(), ProfessionalTrainer.id).all()
+
+        vocabulary = {}
+        cells = []
+        for row_index, row in enumerate(rows):
+            keys = {('goal', term) for term in _rank_terms([row.specialization or ''])}
+            keys.update(('language', _tag_slug(lang)) for lang in _json_list(row.languages) if str(lang).strip())
+            if row.location:
+                keys.add(('area', _tag_slug(row.location)))
+            cells.extend((row_index, vocabulary.setdefault(key, len(vocabulary))) for key in keys)
+        terms = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+        if cells:
+            terms[tuple(np.array(cells).T)] = 1.0
+
+        column = lambda values, dtype=np.float64: np.array(values, dtype=dtype)
+        rating = column([row.rating or 0.0 for row in rows])
+        reviews = column([row.review_count or 0 for row in rows])
+        prior = app.config['REVIEW_PRIOR_WEIGHT']
+        mean = (rating * reviews).sum() / reviews.sum() if reviews.sum() else (rating.mean() if len(rows) else 0.0)
+        experience = np.log1p(column([max(row.experience_years or 0, 0) for row in rows]))
+        female = column([row.gender == 'female' for row in rows], bool)
+        return {
+            'ids': column([row.id for row in rows], np.int64),
+            'vocabulary': vocabulary,
+            'terms': terms,
+            'experience': experience / experience.max() if len(rows) and experience.max() else experience,
+            # Bayesian average: few reviews pull a trainer towards the catalog mean
+            'rating': (prior * mean + rating * reviews) / (prior + reviews) / 5.0,
+            'female_pref': female | column([bool(row.female_friendly) for row in rows], bool),
+            'male_pref': column([row.gender == 'male' for row in rows], bool),
+            'rate': column([row.hourly_rate or 0.0 for row in rows]),
+            'lat': np.radians(column([row.latitude if row.latitude is not None else np.nan for row in rows])),
+            'lng': np.radians(column([row.longitude if row.longitude is not None else np.nan for row in rows])),
+        }
+
+    def rank(self, profile, candidate_ids, limit):
+        """[(trainer_id, score)] for the best `limit` candidates, best first"""
+        snapshot = self.snapshot()
+        candidates = np.unique(np.array(candidate_ids, dtype=np.int64))
+        mask = np.isin(snapshot['ids'], candidates)
+        if mask.sum() < len(candidates):
+            # Trainers added by another worker since the last build
+            self.invalidate()
+            snapshot = self.snapshot()
+            mask = np.isin(snapshot['ids'], candidates)
+        scores = self.scores(snapshot, profile)
+        rows = np.flatnonzero(mask)
+        top = rows[np.argsort(-scores[rows], kind='stable')][:limit]
+        return [(int(snapshot['ids'][i]), round(float(scores[i]), 4)) for i in top]
+
+    @staticmethod
+    def scores(snapshot, profile):
+        weights = TRAINER_RANK_WEIGHTS
+        vocabulary = snapshot['vocabulary']
+        user = np.zeros(len(vocabulary), dtype=np.float32)
+        for kind, values, weight in (
+            ('goal', profile.get('goals') or set(), weights['goals']),
+            ('language', profile.get('languages') or set(), weights['language']),
+        ):
+            for value in values:
+                if (kind, value) in vocabulary:
+                    user[vocabulary[(kind, value)]] = weight / len(values)
+        score = snapshot['terms'] @ user
+        score = score + weights['experience'] * snapshot['experience'] + weights['rating'] * snapshot['rating']
+
+        if profile.get('gender') == 'female':
+            score = score + weights['gender'] * snapshot['female_pref']
+        elif profile.get('gender') == 'male':
+            score = score + weights['gender'] * snapshot['male_pref']
+
+        budget = profile.get('max_price')
+        if budget:
+            over = np.clip((snapshot['rate'] - budget) / budget, 0.0, 1.0)
+            score = score + weights['price'] * (1.0 - over)
+
+        # Where either side lacks coordinates, being in the same named area stands in for distance
+        area = vocabulary.get(('area', profile.get('area')))
+        closeness = snapshot['terms'][:, area].astype(np.float64) if area is not None else np.zeros(len(snapshot['ids']))
+        if profile.get('lat') is not None and profile.get('lng') is not None:
+            lat, lng = np.radians(profile['lat']), np.radians(profile['lng'])
+            a = (np.sin((snapshot['lat'] - lat) / 2) ** 2
+                 + np.cos(lat) * np.cos(snapshot['lat']) * np.sin((snapshot['lng'] - lng) / 2) ** 2)
+            km = 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+            located = ~np.isnan(km)
+            closeness[located] = np.exp(-km[located] / app.config['TRAINER_RANK_DISTANCE_KM'])
+        return score + weights['distance'] * closeness
+
+trainer_features = TrainerFeatureIndex(ttl=app.config['TRAINER_CATALOG_CACHE_TTL'])
+
+def _ranking_profile(user_id=None):
+    """Ranking inputs from the user's profile, overridden by query parameters"""
+    args = request.args
+    profile = {}
+    user = User.query.get(user_id) if user_id else None
+    if user:
+        preference = PartnerPreference.query.filter_by(user_id=user.id).first()
+        profile.update(
+            goals=_rank_terms(_json_list(user.goals)),
+            gender=(user.gender or '').lower() or None,
+            area=_tag_slug(user.location) if user.location else None,
+            languages={_tag_slug(l) for l in _json_list(preference.language_preferences)} if preference else set(),
+        )
+    if args.get('goals'):
+        profile['goals'] = _rank_terms(args['goals'].split(','))
+    if args.get('languages'):
+        profile['languages'] = {_tag_slug(l) for l in args['languages'].split(',') if l.strip()}
+    if args.get('user_gender'):
+        profile['gender'] = args['user_gender'].lower()
+    if args.get('location'):
+        profile['area'] = _tag_slug(args['location'])
+    profile['max_price'] = args.get('max_price', type=float)
+    profile['lat'] = args.get('lat', type=float)
+    profile['lng'] = args.get('lng', type=float)
+    return profile
+
+@app.route('/api/trainers/tags', methods=['GET'])
+def get_trainer_tags():
+    """Tag facets with trainer counts, read from the maintained counter table"""
+    kind = request.args.get('kind')
+    query = db.session.query(TrainerTag, TrainerTagCount).join(TrainerTagCount, TrainerTagCount.tag_id == TrainerTag.id)
+    if kind:
+        query = query.filter(TrainerTag.kind == kind)
+    rows = query.order_by(TrainerTagCount.available_count.desc(), TrainerTag.name).all()
+    return jsonify({'success': True, 'tags': [{
+        'kind': tag.kind,
+        'name': tag.name,
+        'slug': tag.slug,
+        'trainers': counts.trainer_count,
+        'available': counts.available_count,
+    } for tag, counts in rows]})
+
+@app.route('/api/trainers/stats', methods=['GET'])
+def get_trainer_stats():
+    return jsonify({'success': True, 'counts': _trainer_catalog_counts()})
+
 @app.route('/api/trainers', methods=['GET'])
 def get_trainers():
     try:
@@ -1096,42 +4269,46 @@ def get_trainers():
         min_rating = request.args.get('min_rating', type=float)
         limit = request.args.get('limit', 50, type=int)
         
-        base_query = ProfessionalTrainer.query.filter(ProfessionalTrainer.is_available == True)
+        query = ProfessionalTrainer.query.filter(ProfessionalTrainer.is_available == True)
         
-        # Gender-based filtering (with fallback if no matches)
-        query = base_query
-        if user_gender:
-            if user_gender.lower() == 'female':
-                # For female users: only show female trainers or trainers marked as female_friendly
-                gender_query = base_query.filter(
-                    db.or_(
-                        ProfessionalTrainer.gender == 'female',
-                        ProfessionalTrainer.female_friendly == True
-                    )
-                )
-                # Check if any trainers match, if not, show all available
-                if gender_query.count() > 0:
-                    query = gender_query
-                else:
-                    logger.warning(f"No female-friendly trainers found, showing all trainers")
-            elif user_gender.lower() == 'male':
-                # For male users: show male trainers (they are unisex)
-                # Male trainers work with all genders
-                gender_query = base_query.filter(ProfessionalTrainer.gender == 'male')
-                # Check if any trainers match, if not, show all available
-                if gender_query.count() > 0:
-                    query = gender_query
-                else:
-                    logger.warning(f"No male trainers found, showing all trainers")
-        # If no gender specified, show all available trainers
+        # Gender preference: female users see female or female-friendly trainers, male users
+        # see male trainers (they are unisex). If nobody available matches, show everyone;
+        # the NOT EXISTS fallback keeps that decision inside the same query.
+        preferred = None
+        if user_gender and user_gender.lower() == 'female':
+            preferred = db.or_(ProfessionalTrainer.gender == 'female', ProfessionalTrainer.female_friendly == True)
+        elif user_gender and user_gender.lower() == 'male':
+            preferred = ProfessionalTrainer.gender == 'male'
+        if preferred is not None:
+            preferred_exists = db.session.query(ProfessionalTrainer.id).filter(
+                ProfessionalTrainer.is_available == True, preferred
+            ).exists()
+            query = query.filter(db.or_(preferred, ~preferred_exists))
         
         if specialization:
             query = query.filter(ProfessionalTrainer.specialization.contains(specialization))
         
+        # e.g. tags=yoga,language:hindi (all must match) or tag_mode=any
+        tags = [t for t in request.args.get('tags', '').split(',') if t.strip()]
+        if tags:
+            query = query.filter(_trainer_tag_filter(tags, request.args.get('tag_mode', 'all') != 'any'))
+        
         if min_rating:
             query = query.filter(ProfessionalTrainer.rating >= min_rating)
         
-        trainers = query.order_by(ProfessionalTrainer.rating.desc(), ProfessionalTrainer.review_count.desc()).limit(limit).all()
+        # With a user (or sort=relevance) the filtered trainers are ranked for that user
+        user_id = request.args.get('user_id', type=int)
+        sort = request.args.get('sort', 'relevance' if user_id else 'rating')
+        scores = {}
+        if sort == 'relevance':
+            ranked = trainer_features.rank(
+                _ranking_profile(user_id), [i for (i,) in query.with_entities(ProfessionalTrainer.id)], limit
+            )
+            scores = dict(ranked)
+            by_id = {t.id: t for t in ProfessionalTrainer.query.filter(ProfessionalTrainer.id.in_(scores))}
+            trainers = [by_id[i] for i, _ in ranked if i in by_id]
+        else:
+            trainers = query.order_by(ProfessionalTrainer.rating.desc(), ProfessionalTrainer.review_count.desc()).limit(limit).all()
         
         trainers_data = []
         for trainer in trainers:
@@ -1153,15 +4330,14 @@ def get_trainers():
                     'female_friendly': bool(trainer.female_friendly),
                     'is_available': bool(trainer.is_available),
                 })
+                if scores:
+                    trainers_data[-1]['match_score'] = scores[trainer.id]
             except Exception as e:
                 logger.error(f"Error serializing trainer {trainer.id}: {e}")
                 continue
         
-        total_in_db = ProfessionalTrainer.query.count()
-        logger.info(f"Returning {len(trainers_data)} trainers (user_gender: {user_gender or 'not specified'}, total in DB: {total_in_db})")
-        
-        # Log warning if no trainers found
         if len(trainers_data) == 0:
+            total_in_db = _trainer_catalog_counts()['total']
             if total_in_db == 0:
                 logger.warning("⚠️ No trainers in database! Database may need initialization. Restart backend server.")
             else:
@@ -1172,6 +4348,163 @@ def get_trainers():
         logger.error(f"Error fetching trainers: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Trainer availability
+MAX_HOME_SESSION_HOURS = 8
+TRAINER_ACTIVE_SESSION_STATUSES = ('pending', 'confirmed')
+
+def _minutes(clock):
+    return clock.hour * 60 + clock.minute
+
+def _clock(minutes):
+    return '24:00' if minutes >= 24 * 60 else f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+def _trainer_hours(trainer_ids, weekday):
+    """{trainer_id: [(start_min, end_min), ...]} working windows on a weekday"""
+    default = [tuple(_minutes(datetime.strptime(t, '%H:%M').time()) for t in app.config['TRAINER_DEFAULT_HOURS'].split('-'))]
+    hours = {trainer_id: [] for trainer_id in trainer_ids}
+    scheduled = set()
+    for row in TrainerWorkingHours.query.filter(TrainerWorkingHours.trainer_id.in_(trainer_ids)):
+        scheduled.add(row.trainer_id)
+        if row.weekday == weekday:
+            hours[row.trainer_id].append((_minutes(row.start_time), _minutes(row.end_time) or 24 * 60))
+    for trainer_id in trainer_ids:
+        if trainer_id not in scheduled:
+            hours[trainer_id] = list(default)
+    return hours
+
+def _trainer_sessions(day, trainer_ids=None):
+    """{trainer_id: [(start_min, end_min), ...]} of pending/confirmed home sessions on day"""
+    query = db.session.query(
+        HomeSessionBooking.trainer_id, HomeSessionBooking.session_time, HomeSessionBooking.duration_hours
+    ).filter(
+        HomeSessionBooking.session_date == day,
+        HomeSessionBooking.status.in_(TRAINER_ACTIVE_SESSION_STATUSES)
+    )
+    if trainer_ids is not None:
+        query = query.filter(HomeSessionBooking.trainer_id.in_(trainer_ids))
+    sessions = defaultdict(list)
+    for trainer_id, session_time, duration_hours in query:
+        start = _minutes(session_time)
+        sessions[trainer_id].append((start, start + int(round((duration_hours or 1) * 60))))
+    return sessions
+
+def _free_gaps(hours, busy, window_start, window_end):
+    """Parts of the working windows inside [window_start, window_end) not covered by busy"""
+    gaps = []
+    busy = sorted(busy)
+    for start, end in sorted(hours):
+        cursor, end = max(start, window_start), min(end, window_end)
+        for busy_start, busy_end in busy:
+            if busy_end <= cursor or busy_start >= end:
+                continue
+            if busy_start > cursor:
+                gaps.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+    return gaps
+
+def _serialize_hours(rows):
+    return [{'weekday': WEEKDAY_NAMES[row.weekday], 'start': row.start_time.strftime('%H:%M'),
+             'end': row.end_time.strftime('%H:%M')} for row in rows]
+
+@app.route('/api/trainers/<int:trainer_id>/hours', methods=['GET', 'PUT'])
+def trainer_working_hours(trainer_id):
+    """Get or replace a trainer's weekly working hours"""
+    try:
+        ProfessionalTrainer.query.get_or_404(trainer_id)
+        if request.method == 'PUT':
+            data = request.get_json() or {}
+            rows = []
+            try:
+                for entry in data.get('hours') or []:
+                    weekday = entry['weekday']
+                    if isinstance(weekday, str):
+                        weekday = WEEKDAY_NAMES.index(weekday[:3].lower())
+                    start = datetime.strptime(entry['start'], '%H:%M').time()
+                    end = datetime.strptime(entry['end'], '%H:%M').time()
+                    if not 0 <= weekday <= 6 or start >= end:
+                        raise ValueError(entry)
+                    rows.append(TrainerWorkingHours(trainer_id=trainer_id, weekday=weekday, start_time=start, end_time=end))
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'hours must be a list of {weekday, start, end} with start before end'}), 400
+            TrainerWorkingHours.query.filter_by(trainer_id=trainer_id).delete(synchronize_session=False)
+            db.session.add_all(rows)
+            db.session.commit()
+
+        rows = TrainerWorkingHours.query.filter_by(trainer_id=trainer_id).order_by(
+            TrainerWorkingHours.weekday, TrainerWorkingHours.start_time
+        ).all()
+        return jsonify({
+            'success': True,
+            'hours': _serialize_hours(rows),
+            'default_hours': None if rows else app.config['TRAINER_DEFAULT_HOURS'],
+        })
+    except Exception as e:
+        logger.error(f"Error updating trainer hours: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/trainers/available', methods=['GET'])
+def get_available_trainers():
+    """Trainers free on `date` between `start` and `end` (HH:MM), optionally near `location`.
+
+    Without `duration` (minutes) a trainer must be free for the whole window; with it,
+    any free stretch of that length inside the window counts. Costs three queries
+    however many trainers there are: trainers, working hours and that day's sessions.
+    """
+    try:
+        try:
+            day = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+            window_start = _minutes(datetime.strptime(request.args['start'], '%H:%M').time())
+            window_end = _minutes(datetime.strptime(request.args['end'], '%H:%M').time()) or 24 * 60
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'error': 'date (YYYY-MM-DD), start and end (HH:MM) are required'}), 400
+        if window_end <= window_start:
+            return jsonify({'success': False, 'error': 'end must be after start'}), 400
+        needed = request.args.get('duration', type=int) or window_end - window_start
+        location = request.args.get('location')
+        specialization = request.args.get('specialization')
+        limit = request.args.get('limit', 50, type=int)
+
+        query = ProfessionalTrainer.query.filter(ProfessionalTrainer.is_available == True)
+        if location:
+            query = query.filter(ProfessionalTrainer.location.ilike(f'%{location}%'))
+        if specialization:
+            query = query.filter(ProfessionalTrainer.specialization.contains(specialization))
+        trainers = query.order_by(ProfessionalTrainer.rating.desc(), ProfessionalTrainer.review_count.desc()).all()
+        if not trainers:
+            return jsonify({'success': True, 'trainers': []})
+
+        trainer_ids = [t.id for t in trainers]
+        hours = _trainer_hours(trainer_ids, day.weekday())
+        sessions = _trainer_sessions(day, trainer_ids)
+
+        results = []
+        for trainer in trainers:
+            gaps = [gap for gap in _free_gaps(hours[trainer.id], sessions.get(trainer.id, []), window_start, window_end)
+                    if gap[1] - gap[0] >= needed]
+            if not gaps:
+                continue
+            results.append({
+                'id': trainer.id,
+                'name': trainer.name,
+                'gender': trainer.gender,
+                'specialization': trainer.specialization or '',
+                'rating': float(trainer.rating) if trainer.rating else 0.0,
+                'hourly_rate': float(trainer.hourly_rate) if trainer.hourly_rate else 0.0,
+                'location': trainer.location or '',
+                'female_friendly': bool(trainer.female_friendly),
+                'free_slots': [{'start': _clock(start), 'end': _clock(end)} for start, end in gaps],
+            })
+            if len(results) >= limit:
+                break
+
+        return jsonify({'success': True, 'date': day.isoformat(), 'trainers': results})
+    except Exception as e:
+        logger.error(f"Error searching available trainers: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/trainers/init', methods=['POST'])
 def init_trainers_manual():
     """Manual endpoint to initialize trainers if they're missing"""
@@ -1251,92 +4584,276 @@ def get_diet_plans():
         logger.error(f"Error fetching diet plans: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/diet-plans/custom', methods=['POST'])
-def create_custom_diet_plan():
-    """Generate a custom diet plan based on user preferences"""
-    try:
-        data = request.get_json() or {}
-        user_gender = data.get('user_gender', '').lower()
-        goals = data.get('goals', [])
-        difficulty = data.get('difficulty', 'beginner')
-        duration_weeks = data.get('duration_weeks', 4)
-        dietary_restrictions = data.get('dietary_restrictions', [])
-        menstrual_cycle_phase = data.get('menstrual_cycle_phase')  # 'menstrual', 'follicular', 'ovulation', 'luteal'
-        activity_level = data.get('activity_level', 'moderate')
-        age = data.get('age', 30)
-        weight = data.get('weight', 65)
-        height = data.get('height', 165)
-        
-        # Calculate BMR and daily calories
-        if user_gender == 'female':
-            bmr = 655 + (9.6 * weight) + (1.8 * height) - (4.7 * age)
-        else:
-            bmr = 66 + (13.7 * weight) + (5 * height) - (6.8 * age)
-        
-        # Activity multiplier
-        activity_multipliers = {
-            'sedentary': 1.2,
-            'light': 1.375,
-            'moderate': 1.55,
-            'active': 1.725,
-            'very_active': 1.9
+# Custom diet plans
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'active': 1.725,
+    'very_active': 1.9
+}
+# Menstrual cycle calorie adjustment (women only)
+CYCLE_CALORIE_ADJUSTMENTS = {'menstrual': -100, 'follicular': 0, 'ovulation': 0, 'luteal': 100}
+class FoodCatalog:
+    """Dishes from food_catalog.json with their tags packed into bitmasks.
+
+    `contains` has a bit per ingredient tag (meat, dairy, gluten, ...), `diets` a bit per
+    diet the dish fits and `nutrients` a bit per cycle-nutrient tag, so filtering the
+    catalog for a set of restrictions is a bitwise AND over NumPy arrays.
+    """
+
+    def __init__(self, data):
+        ingredients = data['ingredients']
+        self.tags = sorted({
+            tag for group in (ingredients, data['diets'], data['allergens']) for tags in group.values() for tag in tags
+        })
+        self.diet_names = sorted(data['diets'])
+        self.nutrient_names = sorted({n for dish in data['dishes'] for n in dish.get('nutrients', [])})
+        if max(len(self.tags), len(self.diet_names), len(self.nutrient_names)) > 64:
+            raise ValueError('food catalog has more than 64 tags of one kind')
+        self.tag_bits = {tag: 1 << i for i, tag in enumerate(self.tags)}
+        self.diet_bits = {diet: 1 << i for i, diet in enumerate(self.diet_names)}
+        self.nutrient_bits = {n: 1 << i for i, n in enumerate(self.nutrient_names)}
+        self.diet_avoids = {diet: self._mask(self.tag_bits, tags) for diet, tags in data['diets'].items()}
+        self.allergens = {keyword: self._mask(self.tag_bits, tags) for keyword, tags in data['allergens'].items()}
+        self.cycle_phases = data.get('cycle_phases', {})
+
+        self.dishes = data['dishes']
+        contains = []
+        for dish in self.dishes:
+            unknown = [i for i in dish['ingredients'] if i not in ingredients]
+            if unknown:
+                raise ValueError(f"dish {dish['name']!r} uses unknown ingredients {unknown}")
+            contains.append(self._mask(self.tag_bits, [t for i in dish['ingredients'] for t in ingredients[i]]))
+        self.names = np.array([dish['name'] for dish in self.dishes], dtype=object)
+        self.contains = np.array(contains, dtype=np.uint64)
+        self.diets = np.array([
+            self._mask(self.diet_bits, [d for d, avoid in self.diet_avoids.items() if not c & avoid]) for c in contains
+        ], dtype=np.uint64)
+        self.nutrients = np.array([self._mask(self.nutrient_bits, d.get('nutrients', [])) for d in self.dishes], dtype=np.uint64)
+        # Dishes only suggested when the cycle phase calls for one of their nutrients
+        self.cycle_pick = np.array([bool(d.get('cycle_pick')) for d in self.dishes])
+        self.meal_rows = defaultdict(list)
+        for row, dish in enumerate(self.dishes):
+            self.meal_rows[dish['meal']].append(row)
+        self.meal_rows = {meal: np.array(rows, dtype=np.int64) for meal, rows in self.meal_rows.items()}
+        self.macros = {
+            key: np.array([d['macros'][key] for d in self.dishes], dtype=np.float64)
+            for key in ('calories', 'protein', 'carbs', 'fat')
         }
-        tdee = bmr * activity_multipliers.get(activity_level, 1.55)
-        
-        # Adjust calories based on goals
-        if 'weight_loss' in goals:
-            daily_calories = int(tdee * 0.85)  # 15% deficit
-        elif 'muscle_gain' in goals:
-            daily_calories = int(tdee * 1.15)  # 15% surplus
-        else:
-            daily_calories = int(tdee)
-        
-        # Adjust for menstrual cycle (women only)
-        if user_gender == 'female' and menstrual_cycle_phase:
-            cycle_adjustments = {
-                'menstrual': {'calories': -100, 'iron': 'high', 'magnesium': 'high', 'vitamin_b6': 'high'},
-                'follicular': {'calories': 0, 'protein': 'normal', 'carbs': 'normal'},
-                'ovulation': {'calories': 0, 'protein': 'normal', 'carbs': 'normal'},
-                'luteal': {'calories': 100, 'magnesium': 'high', 'vitamin_b6': 'high', 'carbs': 'moderate'}
-            }
-            adjustment = cycle_adjustments.get(menstrual_cycle_phase, {})
-            daily_calories += adjustment.get('calories', 0)
-        
-        # Generate meal plan based on preferences
-        meal_plan = generate_meal_plan(
-            daily_calories=daily_calories,
-            goals=goals,
-            dietary_restrictions=dietary_restrictions,
-            user_gender=user_gender,
-            menstrual_phase=menstrual_cycle_phase if user_gender == 'female' else None
-        )
-        
-        # Create plan name
-        goal_str = ', '.join([g.replace('_', ' ').title() for g in goals[:2]])
-        plan_name = f"Custom {goal_str} Plan"
-        if user_gender == 'female' and menstrual_cycle_phase:
-            phase_name = menstrual_cycle_phase.replace('_', ' ').title()
-            plan_name += f" - {phase_name} Phase"
-        
-        custom_plan = {
+
+    @staticmethod
+    def _mask(bits, names):
+        mask = 0
+        for name in names:
+            mask |= bits[name]
+        return mask
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def restriction_masks(self, restrictions):
+        """(ingredient tags to avoid, diets required) for free-text restrictions like 'gluten-free'
+
+        Keywords match whole words or their plural ('nut allergy', 'no eggs'), never prefixes,
+        so 'nutrient-dense' does not rule out nuts.
+        """
+        avoid = required = 0
+        for restriction in restrictions:
+            for word in re.split(r'[^a-z]+', str(restriction).lower()):
+                singular = word[:-1] if word.endswith('s') else word
+                keyword = singular if singular in self.allergens or singular in self.diet_bits else word
+                if keyword in self.diet_bits:
+                    required |= self.diet_bits[keyword]
+                if keyword in self.allergens:
+                    avoid |= self.allergens[keyword]
+        return np.uint64(avoid), np.uint64(required)
+
+    def matching_rows(self, meal=None, restrictions=(), nutrients=()):
+        """Catalog rows (in catalog order) for a meal that satisfy every restriction"""
+        rows = self.meal_rows.get(meal, np.empty(0, dtype=np.int64)) if meal else np.arange(len(self.dishes))
+        avoid, required = self.restriction_masks(restrictions)
+        ok = ((self.contains[rows] & avoid) == 0) & ((self.diets[rows] & required) == required)
+        if nutrients:
+            wanted = np.uint64(self._mask(self.nutrient_bits, [n for n in nutrients if n in self.nutrient_bits]))
+            ok &= (self.nutrients[rows] & wanted) != 0
+        return rows[ok]
+
+    def suggest(self, meal, restrictions=(), cycle_nutrients=(), limit=3):
+        """Dish names for a meal: cycle picks for the phase's nutrients first, then the rest"""
+        rows = self.matching_rows(meal, restrictions)
+        wanted = np.uint64(self._mask(self.nutrient_bits, [n for n in cycle_nutrients if n in self.nutrient_bits]))
+        picked = self.cycle_pick[rows] & ((self.nutrients[rows] & wanted) != 0)
+        ordered = np.concatenate([rows[picked], rows[~self.cycle_pick[rows]]])
+        return self.names[ordered[:limit]].tolist()
+
+    def serialize(self, row):
+        dish = self.dishes[row]
+        contains = int(self.contains[row])
+        diets = int(self.diets[row])
+        return {
+            'name': dish['name'],
+            'meal': dish['meal'],
+            'ingredients': dish['ingredients'],
+            'macros': dish['macros'],
+            'nutrients': dish.get('nutrients', []),
+            'contains': [tag for tag, bit in self.tag_bits.items() if contains & bit],
+            'diets': [diet for diet, bit in self.diet_bits.items() if diets & bit],
+        }
+
+food_catalog = FoodCatalog.load(app.config['FOOD_CATALOG_PATH'])
+MAX_DIET_PLAN_BATCH = 100
+
+DietPlanKey = namedtuple('DietPlanKey', 'gender goals activity_level age weight height restrictions cycle_phase')
+# The plan is a pure function of its key, so entries never go stale
+diet_plan_cache = TTLCache(maxsize=app.config['DIET_PLAN_CACHE_SIZE'], ttl=float('inf'))
+
+def _quantize(value, step, default):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = default
+    if not math.isfinite(value):
+        value = default
+    return round(round(value / step) * step, 2)
+
+def _text_field(data, field, default=None):
+    value = data.get(field)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    return value
+
+def _text_list_field(data, field):
+    """A list of strings; a single string counts as a one-item list"""
+    values = data.get(field) or []
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f'{field} must be a list of strings')
+    return values
+
+def _diet_plan_key(data):
+    """Quantized plan inputs: profiles that differ by less than a step share a cache entry.
+
+    Raises ValueError for inputs of the wrong type, since every field must be hashable.
+    """
+    gender = _text_field(data, 'user_gender', '').lower()
+    return DietPlanKey(
+        gender=gender,
+        goals=tuple(dict.fromkeys(_text_list_field(data, 'goals'))),
+        activity_level=_text_field(data, 'activity_level', 'moderate'),
+        age=int(_quantize(data.get('age', 30), 1, 30)),
+        weight=_quantize(data.get('weight', 65), app.config['DIET_WEIGHT_STEP'], 65),
+        height=_quantize(data.get('height', 165), 1, 165),
+        restrictions=tuple(sorted({r.lower() for r in _text_list_field(data, 'dietary_restrictions')})),
+        cycle_phase=_text_field(data, 'menstrual_cycle_phase') if gender == 'female' else None,
+    )
+
+def _daily_calories(keys):
+    """Daily calorie targets for many plan keys at once: BMR and TDEE as NumPy vectors"""
+    female = np.array([key.gender == 'female' for key in keys])
+    age = np.array([key.age for key in keys], dtype=np.float64)
+    weight = np.array([key.weight for key in keys], dtype=np.float64)
+    height = np.array([key.height for key in keys], dtype=np.float64)
+    # Harris-Benedict
+    bmr = np.where(female,
+                   655 + (9.6 * weight) + (1.8 * height) - (4.7 * age),
+                   66 + (13.7 * weight) + (5 * height) - (6.8 * age))
+    tdee = bmr * np.array([ACTIVITY_MULTIPLIERS.get(key.activity_level, 1.55) for key in keys])
+    # 15% deficit for weight loss, 15% surplus for muscle gain
+    goal_factor = np.array([
+        0.85 if 'weight_loss' in key.goals else 1.15 if 'muscle_gain' in key.goals else 1.0 for key in keys
+    ])
+    calories = (tdee * goal_factor).astype(np.int64)
+    calories += np.array([CYCLE_CALORIE_ADJUSTMENTS.get(key.cycle_phase, 0) for key in keys], dtype=np.int64)
+    return calories.tolist()
+
+def _custom_diet_plans(keys):
+    """Generated plan parts for each key, computing only the ones not cached yet"""
+    plans = [diet_plan_cache.get(key) for key in keys]
+    missing = list(dict.fromkeys(key for key, plan in zip(keys, plans) if plan is None))
+    if not missing:
+        return plans
+    computed = {}
+    for key, daily_calories in zip(missing, _daily_calories(missing)):
+        plan_name = f"Custom {', '.join([g.replace('_', ' ').title() for g in key.goals[:2]])} Plan"
+        if key.cycle_phase:
+            plan_name += f" - {key.cycle_phase.replace('_', ' ').title()} Phase"
+        computed[key] = {
             'name': plan_name,
-            'gender_target': user_gender if user_gender in ['male', 'female'] else 'unisex',
-            'description': f"Personalized {duration_weeks}-week nutrition plan tailored to your goals and preferences.",
-            'duration_weeks': duration_weeks,
+            'gender_target': key.gender if key.gender in ['male', 'female'] else 'unisex',
             'daily_calories': daily_calories,
-            'meal_plan': meal_plan,
-            'goals': goals,
-            'difficulty': difficulty,
-            'price': 0,  # Custom plans are free
-            'dietary_restrictions': dietary_restrictions,
-            'menstrual_cycle_phase': menstrual_cycle_phase if user_gender == 'female' else None
+            'meal_plan': generate_meal_plan(
+                daily_calories=daily_calories,
+                goals=key.goals,
+                dietary_restrictions=key.restrictions,
+                user_gender=key.gender,
+                menstrual_phase=key.cycle_phase
+            ),
         }
-        
-        return jsonify({'success': True, 'diet_plan': custom_plan})
+        diet_plan_cache.set(key, computed[key])
+    return [plan if plan is not None else computed[key] for key, plan in zip(keys, plans)]
+
+def _custom_diet_plan_response(data, key, plan):
+    duration_weeks = data.get('duration_weeks', 4)
+    return {
+        'name': plan['name'],
+        'gender_target': plan['gender_target'],
+        'description': f"Personalized {duration_weeks}-week nutrition plan tailored to your goals and preferences.",
+        'duration_weeks': duration_weeks,
+        'daily_calories': plan['daily_calories'],
+        'meal_plan': plan['meal_plan'],
+        'goals': data.get('goals', []),
+        'difficulty': data.get('difficulty', 'beginner'),
+        'price': 0,  # Custom plans are free
+        'dietary_restrictions': data.get('dietary_restrictions', []),
+        'menstrual_cycle_phase': key.cycle_phase
+    }
+
+@app.route('/api/diet-plans/custom', methods=['POST'])
+def create_custom_diet_plan():
+    """Generate a custom diet plan based on user preferences"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'Body must be a JSON object'}), 400
+        try:
+            key = _diet_plan_key(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        plan, = _custom_diet_plans([key])
+        return jsonify({'success': True, 'diet_plan': _custom_diet_plan_response(data, key, plan)})
     except Exception as e:
         logger.error(f"Error creating custom diet plan: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/diet-plans/custom/batch', methods=['POST'])
+def create_custom_diet_plans():
+    """Generate custom diet plans for many profiles in one call"""
+    try:
+        profiles = (request.get_json() or {}).get('profiles')
+        if not isinstance(profiles, list) or not all(isinstance(p, dict) for p in profiles):
+            return jsonify({'success': False, 'error': 'profiles must be a list of objects'}), 400
+        if len(profiles) > MAX_DIET_PLAN_BATCH:
+            return jsonify({'success': False, 'error': f'At most {MAX_DIET_PLAN_BATCH} profiles per batch'}), 400
+        keys = []
+        for index, data in enumerate(profiles):
+            try:
+                keys.append(_diet_plan_key(data))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': f'profiles[{index}]: {e}'}), 400
+        plans = _custom_diet_plans(keys) if keys else []
+        return jsonify({'success': True, 'diet_plans': [
+            _custom_diet_plan_response(data, key, plan) for data, key, plan in zip(profiles, keys, plans)
+        ]})
+    except Exception as e:
+        logger.error(f"Error creating custom diet plans: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 def generate_meal_plan(daily_calories, goals, dietary_restrictions, user_gender, menstrual_phase=None):
     """Generate a meal plan based on calories and preferences"""
     # Macro distribution
@@ -1355,18 +4872,7 @@ def generate_meal_plan(daily_calories, goals, dietary_restrictions, user_gender,
     # Adjust for menstrual cycle
     cycle_foods = {}
     if user_gender == 'female' and menstrual_phase:
-        if menstrual_phase == 'menstrual':
-            cycle_foods = {
-                'iron_rich': ['spinach', 'lentils', 'lean beef', 'dark chocolate'],
-                'magnesium_rich': ['almonds', 'bananas', 'dark leafy greens', 'pumpkin seeds'],
-                'vitamin_b6': ['chicken', 'salmon', 'chickpeas', 'potatoes']
-            }
-        elif menstrual_phase == 'luteal':
-            cycle_foods = {
-                'magnesium_rich': ['almonds', 'dark chocolate', 'avocado', 'whole grains'],
-                'complex_carbs': ['sweet potatoes', 'brown rice', 'oats', 'quinoa'],
-                'vitamin_b6': ['salmon', 'chicken', 'bananas', 'sunflower seeds']
-            }
+        cycle_foods = food_catalog.cycle_phases.get(menstrual_phase, {})
     
     # Sample meal structure
     breakfast_cals = int(daily_calories * 0.25)
@@ -1413,73 +4919,25 @@ def generate_meal_plan(daily_calories, goals, dietary_restrictions, user_gender,
 
 def generate_meal_suggestions(meal_type, calories, dietary_restrictions, cycle_foods):
     """Generate meal suggestions based on meal type and restrictions"""
-    suggestions = []
-    
-    if meal_type == 'breakfast':
-        base_suggestions = [
-            "Oatmeal with berries and Greek yogurt",
-            "Scrambled eggs with whole grain toast and avocado",
-            "Protein smoothie with banana and spinach",
-            "Greek yogurt parfait with granola and fruits",
-            "Whole grain pancakes with eggs"
-        ]
-        if cycle_foods:
-            if 'iron_rich' in cycle_foods:
-                base_suggestions.insert(0, "Spinach and egg scramble with whole grain toast")
-            if 'magnesium_rich' in cycle_foods:
-                base_suggestions.insert(0, "Oatmeal with almonds, banana, and pumpkin seeds")
-    elif meal_type == 'lunch':
-        base_suggestions = [
-            "Grilled chicken salad with mixed vegetables",
-            "Quinoa bowl with roasted vegetables and chickpeas",
-            "Salmon with sweet potato and steamed broccoli",
-            "Lentil soup with whole grain bread",
-            "Turkey wrap with vegetables and hummus"
-        ]
-        if cycle_foods:
-            if 'iron_rich' in cycle_foods:
-                base_suggestions.insert(0, "Lean beef stir-fry with dark leafy greens")
-            if 'vitamin_b6' in cycle_foods:
-                base_suggestions.insert(0, "Chicken breast with chickpeas and vegetables")
-    elif meal_type == 'dinner':
-        base_suggestions = [
-            "Baked salmon with quinoa and roasted vegetables",
-            "Grilled chicken with brown rice and steamed broccoli",
-            "Lean beef with sweet potato and green beans",
-            "Turkey meatballs with whole grain pasta and marinara",
-            "Baked cod with roasted vegetables and quinoa"
-        ]
-        if cycle_foods:
-            if 'iron_rich' in cycle_foods:
-                base_suggestions.insert(0, "Lean beef with spinach and lentils")
-            if 'complex_carbs' in cycle_foods:
-                base_suggestions.insert(0, "Salmon with sweet potato and quinoa")
-    else:  # snacks
-        base_suggestions = [
-            "Greek yogurt with berries",
-            "Apple with almond butter",
-            "Mixed nuts and dried fruits",
-            "Protein bar",
-            "Hummus with vegetable sticks"
-        ]
-        if cycle_foods:
-            if 'magnesium_rich' in cycle_foods:
-                base_suggestions.insert(0, "Dark chocolate with almonds")
-            if 'vitamin_b6' in cycle_foods:
-                base_suggestions.insert(0, "Banana with sunflower seeds")
-    
-    # Filter based on dietary restrictions
-    for restriction in dietary_restrictions:
-        if 'vegetarian' in restriction.lower():
-            base_suggestions = [s for s in base_suggestions if 'chicken' not in s.lower() and 'beef' not in s.lower() and 'turkey' not in s.lower() and 'salmon' not in s.lower() and 'cod' not in s.lower()]
-        if 'vegan' in restriction.lower():
-            base_suggestions = [s for s in base_suggestions if 'egg' not in s.lower() and 'yogurt' not in s.lower() and 'chicken' not in s.lower() and 'beef' not in s.lower()]
-        if 'gluten' in restriction.lower():
-            base_suggestions = [s for s in base_suggestions if 'bread' not in s.lower() and 'pasta' not in s.lower() and 'wheat' not in s.lower()]
-    
-    return base_suggestions[:3]  # Return top 3 suggestions
+    if meal_type not in food_catalog.meal_rows:
+        meal_type = 'snacks'
+    return food_catalog.suggest(meal_type, dietary_restrictions, cycle_foods or ())  # Return top 3 suggestions
+
+@app.route('/api/diet-plans/foods', methods=['GET'])
+def get_foods():
+    """Catalog dishes for a meal that fit the given restrictions (comma separated)"""
+    try:
+        meal = request.args.get('meal')
+        restrictions = [r.strip() for r in request.args.get('restrictions', '').split(',') if r.strip()]
+        nutrients = [n.strip() for n in request.args.get('nutrients', '').split(',') if n.strip()]
+        rows = food_catalog.matching_rows(meal, restrictions, nutrients)
+        return jsonify({'success': True, 'foods': [food_catalog.serialize(int(row)) for row in rows]})
+    except Exception as e:
+        logger.error(f"Error fetching foods: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/home-sessions/book', methods=['POST'])
+@idempotent
 def book_home_session():
     try:
         data = request.get_json() or {}
@@ -1503,14 +4961,56 @@ def book_home_session():
         if not trainer.is_available:
             return jsonify({'success': False, 'error': 'Trainer is not available'}), 400
         
+        try:
+            session_day = datetime.strptime(session_date, '%Y-%m-%d').date()
+            session_clock = datetime.strptime(session_time, '%H:%M').time()
+            duration_hours = float(duration_hours)
+            if not (math.isfinite(duration_hours) and 0 < duration_hours <= MAX_HOME_SESSION_HOURS):
+                raise ValueError(duration_hours)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': f'session_date must be YYYY-MM-DD, session_time HH:MM and duration_hours a number of hours between 0 and {MAX_HOME_SESSION_HOURS}'}), 400
         # Calculate total price
         total_price = trainer.hourly_rate * duration_hours
         
+        session_start = datetime.combine(session_day, session_clock)
+        session_end = session_start + timedelta(hours=duration_hours)
+        if not data.get('allow_overlap'):
+            conflicts = _find_conflicts([user_id], [(session_start, session_end)])
+            if conflicts:
+                return _conflict_response(conflicts)
+        
+        # Serialize bookings per trainer before the overlap check: this no-op UPDATE takes the
+        # trainer's row lock (PostgreSQL) or the write lock (SQLite) until commit
+        locked = db.session.execute(
+            db.update(ProfessionalTrainer)
+            .where(ProfessionalTrainer.id == trainer_id, ProfessionalTrainer.is_available == True)
+            .values(is_available=ProfessionalTrainer.is_available, updated_at=ProfessionalTrainer.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not locked:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Trainer is not available'}), 400
+        
+        start_minute = _minutes(session_clock)
+        end_minute = start_minute + int(round(duration_hours * 60))
+        working = _trainer_hours([trainer.id], session_day.weekday())[trainer.id]
+        if not any(start <= start_minute and end_minute <= end for start, end in working):
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': 'Trainer does not work at that time',
+                'working_hours': [{'start': _clock(start), 'end': _clock(end)} for start, end in sorted(working)],
+            }), 400
+        taken = _trainer_sessions(session_day, [trainer.id]).get(trainer.id, [])
+        if any(start < end_minute and start_minute < end for start, end in taken):
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Trainer is already booked at that time'}), 409
+        
         booking = HomeSessionBooking(
             user_id=user_id,
             trainer_id=trainer_id,
-            session_date=datetime.strptime(session_date, '%Y-%m-%d').date(),
-            session_time=datetime.strptime(session_time, '%H:%M').time(),
+            session_date=session_day,
+            session_time=session_clock,
             duration_hours=duration_hours,
             location=location,
             session_type=session_type,
@@ -1520,6 +5020,8 @@ def book_home_session():
         )
         
         db.session.add(booking)
+        db.session.flush()
+        _set_busy('home_session', booking.id, [user_id], session_start, session_end)
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Home session booked successfully', 'booking_id': booking.id})
@@ -1534,7 +5036,9 @@ def get_home_sessions():
         user_id = request.args.get('user_id', type=int)
         status = request.args.get('status')
         
-        query = HomeSessionBooking.query
+        query = HomeSessionBooking.query.options(
+            joinedload(HomeSessionBooking.trainer).load_only(ProfessionalTrainer.id, ProfessionalTrainer.name)
+        )
         
         if user_id:
             query = query.filter(HomeSessionBooking.user_id == user_id)
@@ -1567,6 +5071,399 @@ def get_home_sessions():
         logger.error(f"Error fetching home sessions: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Bookings timeline
+MAX_TIMELINE_PAGE = 200
+TIMELINE_KINDS = ['workout', 'class', 'venue', 'home_session']  # tie-break order at equal start times
+
+def _timeline_after(key, after):
+    return after is None or key > after
+
+def _timeline_range(day_column, time_column, id_column, rank, after):
+    """SQL condition for rows of one stream whose (start, rank, id) key sorts after the cursor"""
+    after_start, after_rank, after_id = after
+    start = db.tuple_(day_column, time_column)
+    cursor_start = (after_start.date(), after_start.time())
+    if rank > after_rank:
+        return start >= cursor_start
+    if rank < after_rank:
+        return start > cursor_start
+    return db.tuple_(day_column, time_column, id_column) > cursor_start + (after_id,)
+
+def _timeline_workouts(user_id, date_from, date_to, after, limit, include_cancelled):
+    base_query = ScheduledWorkout.query.options(
+        joinedload(ScheduledWorkout.partner).load_only(User.id, User.name)
+    ).filter(ScheduledWorkout.user_id == user_id)
+    if not include_cancelled:
+        base_query = base_query.filter(ScheduledWorkout.status != 'cancelled')
+
+    query = base_query.filter(ScheduledWorkout.recurrence_rule.is_(None), ScheduledWorkout.date >= date_from)
+    if date_to:
+        query = query.filter(ScheduledWorkout.date <= date_to)
+    if after:
+        query = query.filter(_timeline_range(ScheduledWorkout.date, ScheduledWorkout.time, ScheduledWorkout.id, 0, after))
+    singles = (
+        ((datetime.combine(w.date, w.time), 0, w.id), w, None)
+        for w in query.order_by(ScheduledWorkout.date, ScheduledWorkout.time, ScheduledWorkout.id).limit(limit + 1)
+    )
+
+    series_query = base_query.filter(
+        ScheduledWorkout.recurrence_rule.isnot(None),
+        db.or_(ScheduledWorkout.series_end_date.is_(None), ScheduledWorkout.series_end_date >= date_from)
+    )
+    if date_to:
+        series_query = series_query.filter(ScheduledWorkout.date <= date_to)
+    series = series_query.all()
+    expand_from = max(date_from, after[0].date()) if after else date_from
+    overrides = {}
+    if series:
+        for override in WorkoutOccurrenceOverride.query.filter(
+            WorkoutOccurrenceOverride.workout_id.in_([w.id for w in series]),
+            WorkoutOccurrenceOverride.occurrence_date >= expand_from
+        ):
+            overrides[(override.workout_id, override.occurrence_date)] = override
+
+    def occurrences(workout):
+        rule = json.loads(workout.recurrence_rule)
+        for day in _iter_occurrence_dates(workout.date, rule, expand_from, _earliest(date_to, workout.series_end_date)):
+            override = overrides.get((workout.id, day))
+            if not include_cancelled and override is not None and override.status == 'cancelled':
+                continue
+            yield (datetime.combine(day, workout.time), 0, workout.id), workout, override
+
+    return heapq.merge(singles, *(occurrences(w) for w in series), key=lambda item: item[0])
+
+def _timeline_joined(relationship, day_column, time_column, user_id, date_from, date_to, after, limit,
+                     include_cancelled, kind):
+    """Bookings of one kind joined to what they book, ordered by the session start time"""
+    model, parent = relationship.class_, relationship.property.mapper.class_
+    query = db.session.query(model, parent).join(relationship).filter(model.user_id == user_id, day_column >= date_from)
+    if not include_cancelled:
+        query = query.filter(model.status != 'cancelled')
+    if date_to:
+        query = query.filter(day_column <= date_to)
+    rank = TIMELINE_KINDS.index(kind)
+    if after:
+        query = query.filter(_timeline_range(day_column, time_column, model.id, rank, after))
+    for booking, booked in query.order_by(day_column, time_column, model.id).limit(limit + 1):
+        owner = booked if day_column.class_ is parent else booking
+        yield (datetime.combine(getattr(owner, day_column.key), getattr(owner, time_column.key)), rank, booking.id), booking, booked
+
+def _timeline_item(kind, key, row, extra):
+    starts_at = key[0]
+    if kind == 'workout':
+        item = _serialize_workout(row)
+        if row.recurrence_rule:
+            item.update({
+                'id': f"{row.id}:{starts_at.date().isoformat()}",
+                'series_id': row.id,
+                'occurrence_date': starts_at.date().isoformat(),
+                'date': starts_at.date().isoformat(),
+            })
+            if extra is not None and extra.status is not None:
+                item['status'] = extra.status
+            if extra is not None and extra.notes is not None:
+                item['notes'] = extra.notes
+        ends_at = starts_at + timedelta(minutes=int(row.duration or 0))
+    elif kind == 'class':
+        ends_at = starts_at + timedelta(minutes=extra.duration)
+        item = {'id': row.id, 'class_id': extra.id, 'title': extra.name, 'sport_type': extra.sport_type,
+                'instructor_name': extra.instructor_name, 'location': extra.location, 'status': row.status}
+    elif kind == 'venue':
+        ends_at = datetime.combine(extra.date, extra.end_time)
+        item = {'id': row.id, 'venue_id': extra.id, 'title': extra.name, 'sport_type': extra.sport_type,
+                'court_number': extra.court_number, 'location': extra.location, 'status': row.status}
+    else:
+        ends_at = starts_at + timedelta(hours=row.duration_hours or 1)
+        item = {'id': row.id, 'trainer_id': row.trainer_id, 'title': f"Session with {extra.name}",
+                'trainer_name': extra.name, 'session_type': row.session_type, 'location': row.location,
+                'status': row.status, 'total_price': row.total_price}
+    item.update({'type': kind, 'starts_at': starts_at.isoformat(), 'ends_at': ends_at.isoformat()})
+    return item
+
+@app.route('/api/bookings/timeline', methods=['GET'])
+def get_bookings_timeline():
+    """The caller's workouts, class, venue and home-session bookings as one time-ordered list.
+
+    Accepts `from` (default today) / `to` (YYYY-MM-DD), `limit`, `include_cancelled` and
+    the opaque `cursor` from the previous page's `next_cursor`.
+    """
+    try:
+        user_id, error = _caller_user_id()
+        if error:
+            return error
+
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_TIMELINE_PAGE)
+        include_cancelled = request.args.get('include_cancelled', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+                else datetime.utcnow().date()
+            date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+
+        after = None
+        if request.args.get('cursor'):
+            try:
+                c_start, c_kind, c_id = _decode_cursor(request.args['cursor'])
+                after = (datetime.fromisoformat(c_start), TIMELINE_KINDS.index(c_kind), int(c_id))
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+        # Each stream is one indexed range query already in (start, kind, id) order;
+        # heapq.merge pulls from them lazily, so at most limit + 1 rows are consumed in total
+        window = (user_id, date_from, date_to, after, limit, include_cancelled)
+        streams = [
+            (('workout', key, row, extra) for key, row, extra in _timeline_workouts(*window)),
+            (('class', key, row, extra) for key, row, extra in _timeline_joined(
+                ClassBooking.studio_class, StudioClass.date, StudioClass.time, *window, kind='class')),
+            (('venue', key, row, extra) for key, row, extra in _timeline_joined(
+                VenueBooking.sports_venue, SportsVenue.date, SportsVenue.start_time, *window, kind='venue')),
+            (('home_session', key, row, extra) for key, row, extra in _timeline_joined(
+                HomeSessionBooking.trainer, HomeSessionBooking.session_date, HomeSessionBooking.session_time,
+                *window, kind='home_session')),
+        ]
+        merged = (item for item in heapq.merge(*streams, key=lambda item: item[1]) if _timeline_after(item[1], after))
+        page = list(islice(merged, limit + 1))
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last_start, last_rank, last_id = page[-1][1]
+            next_cursor = _encode_cursor(last_start.isoformat(), TIMELINE_KINDS[last_rank], last_id)
+
+        return jsonify({
+            'success': True,
+            'items': [_timeline_item(kind, key, row, extra) for kind, key, row, extra in page],
+            'next_cursor': next_cursor,
+        })
+    except Exception as e:
+        logger.error(f"Error fetching bookings timeline: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Calendar feed endpoints
+CALENDAR_FEED_PAST_DAYS = 90
+ICS_WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+def _ics_escape(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _ics_fold(line):
+    """Fold a content line at 75 octets without splitting UTF-8 sequences (RFC 5545 3.1)"""
+    data = line.encode('utf-8')
+    chunks = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+        limit = 74  # continuation lines start with a space
+    chunks.append(data)
+    return b'\r\n '.join(chunks).decode('utf-8') + '\r\n'
+
+def _ics_datetime(day, time_of_day):
+    # Floating local time: workouts and bookings are stored without a timezone
+    return datetime.combine(day, time_of_day).strftime('%Y%m%dT%H%M%S')
+
+def _ics_event(uid, start, minutes, summary, stamp, location=None, description=None,
+               status=None, extra=()):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{(stamp or datetime.utcnow()).strftime("%Y%m%dT%H%M%SZ")}',
+        f'DTSTART:{start}',
+        f'DURATION:PT{max(int(minutes or 0), 1)}M',
+        f'SUMMARY:{_ics_escape(summary)}',
+    ]
+    if location:
+        lines.append(f'LOCATION:{_ics_escape(location)}')
+    if description:
+        lines.append(f'DESCRIPTION:{_ics_escape(description)}')
+    if status:
+        lines.append(f'STATUS:{status}')
+    lines.extend(extra)
+    lines.append('END:VEVENT')
+    return ''.join(_ics_fold(line) for line in lines)
+
+def _ics_status(status):
+    return {'cancelled': 'CANCELLED', 'pending': 'TENTATIVE'}.get(status, 'CONFIRMED')
+
+def _ics_rrule(workout, rule):
+    parts = ['FREQ=WEEKLY', f"INTERVAL={rule['interval']}",
+             'BYDAY=' + ','.join(ICS_WEEKDAYS[d] for d in rule['days'])]
+    if rule.get('count'):
+        parts.append(f"COUNT={rule['count']}")
+    elif rule.get('until'):
+        parts.append(f"UNTIL={datetime.strptime(rule['until'], '%Y-%m-%d').strftime('%Y%m%d')}T235959")
+    extra = ['RRULE:' + ';'.join(parts)]
+    for day in rule.get('exceptions', []):
+        extra.append(f"EXDATE:{_ics_datetime(datetime.strptime(day, '%Y-%m-%d').date(), workout.time)}")
+    return extra
+
+def _calendar_etag(user_id, since):
+    """Weak ETag from per-source row counts and max(updated_at), in a single SELECT.
+
+    Counts are included so deletions change the tag even though they leave no timestamp.
+    """
+    sources = [
+        (ScheduledWorkout, ScheduledWorkout.user_id == user_id, None),
+        (WorkoutOccurrenceOverride, ScheduledWorkout.user_id == user_id, ScheduledWorkout),
+        (ClassBooking, ClassBooking.user_id == user_id, None),
+        (StudioClass, ClassBooking.user_id == user_id, ClassBooking),
+        (VenueBooking, VenueBooking.user_id == user_id, None),
+        (SportsVenue, VenueBooking.user_id == user_id, VenueBooking),
+        (HomeSessionBooking, HomeSessionBooking.user_id == user_id, None),
+    ]
+    columns = []
+    for model, condition, join_model in sources:
+        for aggregate in (db.func.count(model.id), db.func.max(model.updated_at)):
+            stmt = db.select(aggregate).select_from(model)
+            if join_model is not None:
+                stmt = stmt.join(join_model)
+            columns.append(stmt.where(condition).scalar_subquery())
+    row = db.session.execute(db.select(*columns)).one()
+    fingerprint = '|'.join(str(value) for value in row) + f'|{since.isoformat()}'
+    return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+def _generate_calendar(user_id, since):
+    yield ''.join(_ics_fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//FitSanskriti//Workout Calendar//EN',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:FitSanskriti',
+        'REFRESH-INTERVAL;VALUE=DURATION:PT15M',
+    ])
+
+    workouts = ScheduledWorkout.query.filter(
+        ScheduledWorkout.user_id == user_id,
+        db.or_(
+            db.and_(ScheduledWorkout.recurrence_rule.is_(None), ScheduledWorkout.date >= since),
+            db.and_(
+                ScheduledWorkout.recurrence_rule.isnot(None),
+                db.or_(ScheduledWorkout.series_end_date.is_(None), ScheduledWorkout.series_end_date >= since)
+            )
+        )
+    ).order_by(ScheduledWorkout.date, ScheduledWorkout.time).yield_per(200)
+    for workout in workouts:
+        start_date, extra = workout.date, ()
+        if workout.recurrence_rule:
+            rule = json.loads(workout.recurrence_rule)
+            # DTSTART is itself an instance, so anchor it on the first day the rule matches
+            start_date = next(_iter_occurrence_dates(workout.date, rule, skip_exceptions=False), workout.date)
+            extra = _ics_rrule(workout, rule)
+        yield _ics_event(
+            f'workout-{workout.id}@fitsanskriti', _ics_datetime(start_date, workout.time),
+            workout.duration, workout.title, workout.updated_at,
+            location=workout.location, description=workout.notes,
+            status=_ics_status(workout.status), extra=extra,
+        )
+
+    overrides = db.session.query(WorkoutOccurrenceOverride, ScheduledWorkout).join(ScheduledWorkout).filter(
+        ScheduledWorkout.user_id == user_id,
+        WorkoutOccurrenceOverride.occurrence_date >= since
+    ).yield_per(200)
+    for override, workout in overrides:
+        start = _ics_datetime(override.occurrence_date, workout.time)
+        yield _ics_event(
+            f'workout-{workout.id}@fitsanskriti', start, workout.duration, workout.title,
+            override.updated_at, location=workout.location,
+            description=override.notes if override.notes is not None else workout.notes,
+            status=_ics_status(override.status or workout.status), extra=[f'RECURRENCE-ID:{start}'],
+        )
+
+    class_rows = db.session.query(ClassBooking, StudioClass).join(StudioClass).filter(
+        ClassBooking.user_id == user_id,
+        StudioClass.date >= since
+    ).yield_per(200)
+    for booking, studio_class in class_rows:
+        yield _ics_event(
+            f'class-booking-{booking.id}@fitsanskriti', _ics_datetime(studio_class.date, studio_class.time),
+            studio_class.duration, studio_class.name, booking.updated_at,
+            location=studio_class.location,
+            description=f'Instructor: {studio_class.instructor_name}' if studio_class.instructor_name else None,
+            status=_ics_status(booking.status),
+        )
+
+    venue_rows = db.session.query(VenueBooking, SportsVenue).join(SportsVenue).filter(
+        VenueBooking.user_id == user_id,
+        SportsVenue.date >= since
+    ).yield_per(200)
+    for booking, venue in venue_rows:
+        start = datetime.combine(venue.date, venue.start_time)
+        minutes = (datetime.combine(venue.date, venue.end_time) - start).total_seconds() // 60
+        yield _ics_event(
+            f'venue-booking-{booking.id}@fitsanskriti', _ics_datetime(venue.date, venue.start_time),
+            minutes, venue.name, booking.updated_at,
+            location=f'{venue.location} {venue.court_number or ""}'.strip(),
+            status=_ics_status(booking.status),
+        )
+
+    session_rows = db.session.query(HomeSessionBooking, ProfessionalTrainer.name).outerjoin(ProfessionalTrainer).filter(
+        HomeSessionBooking.user_id == user_id,
+        HomeSessionBooking.session_date >= since
+    ).yield_per(200)
+    for booking, trainer_name in session_rows:
+        summary = (booking.session_type or 'home session').replace('_', ' ').title()
+        yield _ics_event(
+            f'home-session-{booking.id}@fitsanskriti', _ics_datetime(booking.session_date, booking.session_time),
+            (booking.duration_hours or 1.0) * 60, f'{summary} with {trainer_name}' if trainer_name else summary,
+            booking.updated_at, location=booking.location, description=booking.notes,
+            status=_ics_status(booking.status),
+        )
+
+    yield _ics_fold('END:VCALENDAR')
+
+@app.route('/api/calendar/token', methods=['POST'])
+def rotate_calendar_token():
+    """Create (or rotate) the secret token behind the caller's calendar feed URL"""
+    try:
+        user_id = _token_user_id()
+        if user_id is None:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+
+        user.calendar_token = secrets.token_urlsafe(32)
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'feed_url': url_for('calendar_feed', token=user.calendar_token, _external=True)
+        })
+    except Exception as e:
+        logger.error(f"Error creating calendar token: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/calendar/<token>.ics', methods=['GET'])
+def calendar_feed(token):
+    """iCalendar feed of workouts, class/venue bookings and home sessions.
+
+    Clients polling with If-None-Match get a 304 after one aggregate query.
+    """
+    user = User.query.filter_by(calendar_token=token).first()
+    if not user:
+        return jsonify({'success': False, 'error': 'Calendar not found'}), 404
+
+    since = datetime.utcnow().date() - timedelta(days=CALENDAR_FEED_PAST_DAYS)
+    etag = _calendar_etag(user.id, since)
+    headers = {'Cache-Control': 'private, max-age=900'}
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag, weak=True)
+        return response
+
+    response = Response(
+        stream_with_context(_generate_calendar(user.id, since)),
+        mimetype='text/calendar',
+        headers=headers,
+    )
+    response.set_etag(etag, weak=True)
+    return response
+
 # Exercise endpoints
 @app.route('/api/exercises', methods=['GET'])
 def get_exercises():
@@ -1608,6 +5505,42 @@ def get_exercises():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Initialize database
+def _dedupe_confirmed_bookings():
+    """Cancel duplicate confirmed bookings left by the old racy booking paths.
+
+    Keeps each user's earliest booking per class (giving the extra spots back) and the
+    earliest booking per venue slot, so the uq_*_booking_confirmed indexes can be
+    created on existing databases.
+    """
+    keep = db.session.query(db.func.min(ClassBooking.id)).filter(
+        ClassBooking.status == 'confirmed'
+    ).group_by(ClassBooking.user_id, ClassBooking.class_id)
+    duplicates = ClassBooking.query.filter(
+        ClassBooking.status == 'confirmed', ClassBooking.id.notin_(keep)
+    ).all()
+    for booking in duplicates:
+        booking.status = 'cancelled'
+        _clear_busy('class', booking.id)
+        db.session.execute(
+            db.update(StudioClass)
+            .where(StudioClass.id == booking.class_id, StudioClass.spots_booked > 0)
+            .values(spots_booked=StudioClass.spots_booked - 1)
+        )
+
+    keep = db.session.query(db.func.min(VenueBooking.id)).filter(
+        VenueBooking.status == 'confirmed'
+    ).group_by(VenueBooking.venue_id)
+    venue_duplicates = VenueBooking.query.filter(
+        VenueBooking.status == 'confirmed', VenueBooking.id.notin_(keep)
+    ).all()
+    for booking in venue_duplicates:
+        booking.status = 'cancelled'
+        _clear_busy('venue', booking.id)
+
+    if duplicates or venue_duplicates:
+        db.session.commit()
+        logger.warning(f"Cancelled {len(duplicates)} duplicate class and {len(venue_duplicates)} duplicate venue bookings")
+
 def init_db():
     """Initialize the database with sample data and ensure columns exist"""
     with app.app_context():
@@ -1635,6 +5568,23 @@ def init_db():
         _ensure_column('user', 'gender', 'VARCHAR(20)')
         _ensure_column('user', 'height', 'FLOAT')
         _ensure_column('user', 'weight', 'FLOAT')
+        _ensure_column('user', 'calendar_token', 'VARCHAR(64)')
+        _ensure_column('scheduled_workout', 'recurrence_rule', 'TEXT')
+        _ensure_column('scheduled_workout', 'series_end_date', 'DATE')
+        _ensure_column('studio_class', 'template_id', 'INTEGER')
+        _ensure_column('professional_trainer', 'latitude', 'FLOAT')
+        _ensure_column('professional_trainer', 'longitude', 'FLOAT')
+
+        _dedupe_confirmed_bookings()
+
+        # create_all() skips indexes on tables that already exist (and on columns added above)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except Exception as e:
+                    logger.warning(f"Skip creating index {index.name}: {e}")
+
         
         # Check if gym data exists (for backward compatibility)
         gyms_exist = Gym.query.first() is not None
@@ -2509,6 +6459,22 @@ def init_db():
         
         db.session.commit()
         
+        # One-time backfill of the overlap index for databases that predate it
+        if BusyInterval.query.first() is None and (
+            ScheduledWorkout.query.first() is not None or ClassBooking.query.first() is not None
+            or VenueBooking.query.first() is not None or HomeSessionBooking.query.first() is not None
+        ):
+            logger.info(f"Backfilled {_rebuild_busy_intervals()} busy intervals")
+        if WorkoutDailyRollup.query.first() is None and ScheduledWorkout.query.first() is not None:
+            logger.info(f"Backfilled workout rollups for {_rebuild_workout_rollups()} users")
+        created = _materialize_class_templates()
+        if created:
+            logger.info(f"Materialized {created} classes from templates")
+        _purge_idempotency_records()
+        _backfill_review_aggregates()
+        if TrainerTag.query.first() is None and ProfessionalTrainer.query.first() is not None:
+            logger.info(f"Indexed {_rebuild_trainer_tags()} trainer tags")
+        
         # Log final counts
         final_trainer_count = ProfessionalTrainer.query.count()
         final_diet_count = DietPlan.query.count()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Check that class and venue listings are served from their indexes
+Run: python check_query_plans.py
+
+Calls GET /api/sports/classes and /api/sports/venues with a range of filter
+combinations, captures the SQL each one runs and asks the database for its
+plan. Fails if a listing scans the whole table or sorts in a temp B-tree
+instead of reading an index in (date, time) order. SQLite only.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logging
+logging.disable(logging.ERROR)
+
+from sqlalchemy import event, text
+from app import app, db, init_db
+
+today = datetime.utcnow().date()
+week = (today + timedelta(days=7)).isoformat()
+
+CASES = [
+    ('/api/sports/classes', {}),
+    ('/api/sports/classes', {'sport_type': 'yoga'}),
+    ('/api/sports/classes', {'sport_type': 'yoga', 'level': 'beginner'}),
+    ('/api/sports/classes', {'date': today.isoformat()}),
+    ('/api/sports/classes', {'date_from': today.isoformat(), 'date_to': week}),
+    ('/api/sports/classes', {'time_from': '17:00', 'time_to': '21:00', 'max_price': '25'}),
+    ('/api/sports/classes', {'sport_type': 'pilates', 'intensity': 'moderate', 'date_to': week}),
+    ('/api/sports/venues', {}),
+    ('/api/sports/venues', {'sport_type': 'pickleball'}),
+    ('/api/sports/venues', {'date_to': week, 'time_from': '18:00', 'max_price': '40'}),
+    ('/api/sports/venues', {'sport_type': 'tennis', 'date': today.isoformat()}),
+]
+
+def listing_statements(path, params):
+    """SQL statements (with parameters) the endpoint runs for these filters"""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            response = app.test_client().get(path, query_string=params)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+    if response.status_code != 200:
+        raise SystemExit(f'{path} {params} returned {response.status_code}: {response.get_data(as_text=True)}')
+    return captured
+
+def plan(statement, parameters):
+    with app.app_context():
+        connection = db.session.connection().connection.driver_connection
+        return [row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()]
+
+def main():
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        raise SystemExit('Query plan checks only support SQLite')
+    init_db()
+    failures = 0
+    for path, params in CASES:
+        for statement, parameters in listing_statements(path, params):
+            details = plan(statement, parameters)
+            bad = [d for d in details if d.startswith('SCAN ') or 'TEMP B-TREE' in d]
+            failures += bool(bad)
+            print(f"{'❌' if bad else '✅'} {path} {params}")
+            for detail in details:
+                print(f"     {detail}")
+    if failures:
+        raise SystemExit(f'{failures} listing queries are not index-driven')
+
+if __name__ == '__main__':
+    main()
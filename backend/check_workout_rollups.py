@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Check that workout stats count recurring series occurrences
+Run: python check_workout_rollups.py
+
+Schedules a daily series that started six days ago plus a one-off workout,
+completes one occurrence of the series through an override and checks that
+GET /api/workouts/stats reports the untouched occurrences as scheduled, the
+override and the one-off as completed, and the same numbers after the rollups
+are rebuilt from scratch. Uses a throwaway SQLite database unless DATABASE_URL
+is set.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rollups.db')}"
+
+import logging
+logging.disable(logging.ERROR)
+
+from app import app, db, init_db, User, _rebuild_workout_rollups
+
+SERIES_DAYS = 7
+MINUTES = 30
+
+def setup(client):
+    """Create a user with a daily series and a completed one-off; returns the user_id"""
+    with app.app_context():
+        user = User(name='rollups', email=f'rollups{int(time.time() * 1000)}@example.com', password_hash='!')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=SERIES_DAYS - 1)
+    workout = {'user_id': user_id, 'title': 'Morning run', 'time': '07:00', 'duration': MINUTES, 'workout_type': 'cardio'}
+    response = client.post('/api/workouts', json=dict(workout, date=start.isoformat(), recurrence={'days': list(range(7))}))
+    assert response.status_code == 200, response.get_json()
+    series_id = response.get_json()['workout_id']
+    response = client.put(f'/api/workouts/{series_id}/occurrences/{start.isoformat()}', json={'status': 'completed'})
+    assert response.status_code == 200, response.get_json()
+    response = client.post('/api/workouts', json=dict(
+        workout, title='Evening lift', time='19:00', workout_type='strength', date=today.isoformat(), status='completed'
+    ))
+    assert response.status_code == 200, response.get_json()
+    return user_id
+
+def stats(client, user_id):
+    response = client.get('/api/workouts/stats', query_string={'user_id': user_id, 'weeks': 2})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['stats']
+
+def check(label, result):
+    expected = {'scheduled': SERIES_DAYS - 1, 'completed': 2, 'cancelled': 0, 'completion_rate': round(2 / (SERIES_DAYS + 1), 3)}
+    actual = {key: result[key] for key in expected}
+    scheduled_minutes = sum(week['scheduled_minutes'] for week in result['weeks'])
+    completed_minutes = sum(week['completed_minutes'] for week in result['weeks'])
+    ok = actual == expected and scheduled_minutes == (SERIES_DAYS - 1) * MINUTES and completed_minutes == 2 * MINUTES
+    print(f"{'✅' if ok else '❌'} {label}: {actual}, {scheduled_minutes} scheduled / {completed_minutes} completed minutes")
+    return ok
+
+def main():
+    init_db()
+    client = app.test_client()
+    user_id = setup(client)
+    ok = check('incremental rollups', stats(client, user_id))
+    with app.app_context():
+        _rebuild_workout_rollups(user_id)
+    ok = check('rebuilt rollups', stats(client, user_id)) and ok
+    if not ok:
+        raise SystemExit('Workout stats do not match the scheduled workouts')
+
+if __name__ == '__main__':
+    main()
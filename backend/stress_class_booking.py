@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Stress test for class booking under concurrency
+Run: python stress_class_booking.py [--threads 16] [--users 400] [--classes 5] [--capacity 50]
+
+Hammers POST /api/sports/classes/book from many threads (each user books every
+class, several times over) and then checks that no class went over capacity,
+that spots_booked matches the confirmed bookings and that nobody holds two
+confirmed bookings for the same class. Uses a throwaway SQLite database unless
+DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}"
+
+import logging
+logging.disable(logging.ERROR)
+
+from app import app, db, init_db, User, StudioClass, ClassBooking
+
+def setup(users, classes, capacity):
+    """Create throwaway users and far-future classes; returns (user_ids, class_ids)"""
+    init_db()
+    with app.app_context():
+        stamp = int(time.time())
+        db.session.bulk_insert_mappings(User, [
+            {'name': f'stress{i}', 'email': f'stress{stamp}_{i}@example.com', 'password_hash': '!'}
+            for i in range(users)
+        ])
+        start = datetime.utcnow().date() + timedelta(days=3650)
+        db.session.bulk_insert_mappings(StudioClass, [
+            {'name': f'Stress class {i}', 'sport_type': 'yoga', 'date': start, 'time': datetime.min.time(),
+             'duration': 60, 'max_spots': capacity, 'spots_booked': 0, 'location': 'stress'}
+            for i in range(classes)
+        ])
+        db.session.commit()
+        user_ids = [u.id for u in User.query.filter(User.email.like(f'stress{stamp}_%'))]
+        class_ids = [c.id for c in StudioClass.query.filter_by(location='stress', date=start)]
+        return user_ids, class_ids
+
+def run(user_ids, class_ids, threads, repeats):
+    attempts = [(u, c) for u in user_ids for c in class_ids for _ in range(repeats)]
+    random.shuffle(attempts)
+    outcomes = Counter()
+    lock = threading.Lock()
+    cursor = iter(attempts)
+
+    def worker():
+        client = app.test_client()
+        local = Counter()
+        while True:
+            with lock:
+                item = next(cursor, None)
+            if item is None:
+                break
+            user_id, class_id = item
+            response = client.post('/api/sports/classes/book', json={
+                'user_id': user_id, 'class_id': class_id, 'allow_overlap': True
+            })
+            body = response.get_json() or {}
+            local['booked' if response.status_code == 200 else body.get('error', str(response.status_code))] += 1
+        with lock:
+            outcomes.update(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return outcomes, time.perf_counter() - started, len(attempts)
+
+def verify(class_ids):
+    """Return a list of invariant violations (empty when the run was clean)"""
+    problems = []
+    with app.app_context():
+        confirmed = Counter()
+        per_user = Counter()
+        for booking in ClassBooking.query.filter(ClassBooking.class_id.in_(class_ids), ClassBooking.status == 'confirmed'):
+            confirmed[booking.class_id] += 1
+            per_user[(booking.user_id, booking.class_id)] += 1
+        for studio_class in StudioClass.query.filter(StudioClass.id.in_(class_ids)):
+            if studio_class.spots_booked > studio_class.max_spots:
+                problems.append(f'class {studio_class.id} overbooked: {studio_class.spots_booked}/{studio_class.max_spots}')
+            if studio_class.spots_booked != confirmed[studio_class.id]:
+                problems.append(f'class {studio_class.id} spots_booked={studio_class.spots_booked} '
+                                f'but {confirmed[studio_class.id]} confirmed bookings')
+        problems.extend(f'user {u} has {n} confirmed bookings for class {c}' for (u, c), n in per_user.items() if n > 1)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--capacity', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=2, help='booking attempts per user and class')
+    args = parser.parse_args()
+
+    user_ids, class_ids = setup(args.users, args.classes, args.capacity)
+    print(f"Database: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    print(f"{len(user_ids)} users x {len(class_ids)} classes (capacity {args.capacity}) x {args.repeats} attempts, "
+          f"{args.threads} threads")
+
+    outcomes, elapsed, total = run(user_ids, class_ids, args.threads, args.repeats)
+    print(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s, {outcomes['booked'] / elapsed:.0f} bookings/s)")
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome}: {count}")
+
+    problems = verify(class_ids)
+    expected = min(len(user_ids), args.capacity) * len(class_ids)
+    if outcomes['booked'] != expected:
+        problems.append(f'expected {expected} bookings, got {outcomes["booked"]}')
+    if problems:
+        print("❌ Invariant violations:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("✅ No class exceeded capacity and no duplicate confirmed bookings")
+
+if __name__ == '__main__':
+    main()
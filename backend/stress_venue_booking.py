@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Stress test for a flash release of venue slots
+Run: python stress_venue_booking.py [--threads 16] [--users 300] [--slots 20]
+
+Releases a batch of evening court slots and lets many users race for them from
+several threads: half try to hold a slot and then book it, the rest book
+directly. Reports attempts per second and checks that every slot was booked at
+most once and that no slot is marked available while booked. Uses a throwaway
+SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, time as time_type, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}"
+
+import logging
+logging.disable(logging.ERROR)
+
+from app import app, db, init_db, User, SportsVenue, VenueBooking
+
+def setup(users, slots):
+    """Create throwaway users and evening court slots; returns (user_ids, venue_ids)"""
+    init_db()
+    with app.app_context():
+        stamp = int(time.time())
+        db.session.bulk_insert_mappings(User, [
+            {'name': f'stress{i}', 'email': f'stress{stamp}_{i}@example.com', 'password_hash': '!'}
+            for i in range(users)
+        ])
+        day = datetime.utcnow().date() + timedelta(days=3650)
+        db.session.bulk_insert_mappings(SportsVenue, [
+            {'name': 'Stress Courts', 'sport_type': 'pickleball', 'date': day,
+             'start_time': time_type(18 + i % 4), 'end_time': time_type(19 + i % 4),
+             'location': 'stress', 'court_number': f'Court {i // 4 + 1}', 'is_available': True}
+            for i in range(slots)
+        ])
+        db.session.commit()
+        user_ids = [u.id for u in User.query.filter(User.email.like(f'stress{stamp}_%'))]
+        venue_ids = [v.id for v in SportsVenue.query.filter_by(location='stress', date=day)]
+        return user_ids, venue_ids
+
+def run(user_ids, venue_ids, threads, attempts_per_user):
+    attempts = [(u, random.choice(venue_ids), random.random() < 0.5)
+                for u in user_ids for _ in range(attempts_per_user)]
+    outcomes = Counter()
+    lock = threading.Lock()
+    cursor = iter(attempts)
+
+    def worker():
+        client = app.test_client()
+        local = Counter()
+        while True:
+            with lock:
+                item = next(cursor, None)
+            if item is None:
+                break
+            user_id, venue_id, use_hold = item
+            if use_hold:
+                response = client.post(f'/api/sports/venues/{venue_id}/hold', json={'user_id': user_id})
+                if response.status_code != 200:
+                    local[f'hold: {(response.get_json() or {}).get("error", response.status_code)}'] += 1
+                    continue
+            response = client.post('/api/sports/venues/book', json={'user_id': user_id, 'venue_id': venue_id})
+            body = response.get_json() or {}
+            local['booked' if response.status_code == 200 else f'book: {body.get("error", response.status_code)}'] += 1
+        with lock:
+            outcomes.update(local)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return outcomes, time.perf_counter() - started, len(attempts)
+
+def verify(venue_ids):
+    """Return a list of invariant violations (empty when the run was clean)"""
+    problems = []
+    with app.app_context():
+        confirmed = Counter(b.venue_id for b in VenueBooking.query.filter(
+            VenueBooking.venue_id.in_(venue_ids), VenueBooking.status == 'confirmed'))
+        for venue in SportsVenue.query.filter(SportsVenue.id.in_(venue_ids)):
+            if confirmed[venue.id] > 1:
+                problems.append(f'slot {venue.id} booked {confirmed[venue.id]} times')
+            if confirmed[venue.id] and venue.is_available:
+                problems.append(f'slot {venue.id} is booked but still marked available')
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--slots', type=int, default=20)
+    parser.add_argument('--attempts', type=int, default=3, help='booking attempts per user')
+    args = parser.parse_args()
+
+    user_ids, venue_ids = setup(args.users, args.slots)
+    print(f"Database: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    print(f"{len(user_ids)} users x {args.attempts} attempts on {len(venue_ids)} slots, {args.threads} threads")
+
+    outcomes, elapsed, total = run(user_ids, venue_ids, args.threads, args.attempts)
+    print(f"{total} attempts in {elapsed:.2f}s ({total / elapsed:.0f} attempts/s)")
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome}: {count}")
+
+    problems = verify(venue_ids)
+    if outcomes['booked'] > len(venue_ids):
+        problems.append(f'{outcomes["booked"]} bookings for {len(venue_ids)} slots')
+    if problems:
+        print("❌ Invariant violations:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("✅ No slot was booked twice")
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,11 @@ from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
 import logging
+import math
+import atexit
+import queue
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)
@@ -540,6 +545,146 @@ class MLRecommendationSystem:
 # Initialize ML system
 ml_system = MLRecommendationSystem()
 
+# Buffered writer for user_interactions events
+class InteractionWriter:
+    """Queue user_interactions rows in memory and insert them in batches from a background thread.
+
+    Keeps interaction logging out of the request transaction so view/like/skip events
+    don't compete with request writes for SQLite's single writer lock.
+    """
+
+    INSERT_SQL = '''
+        INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+
+    def __init__(self, database, flush_interval=1.0, flush_size=200, max_queue=10000,
+                 policy='drop', block_timeout=0.05):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.database = database
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed_batches': 0}
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='interaction-writer', daemon=True)
+                self._thread.start()
+
+    def record(self, user_id, target_user_id, interaction_type, interaction_value=1.0):
+        """Enqueue one interaction; returns False if it was dropped because the queue is full"""
+        if self._thread is None:
+            self.start()
+        row = (user_id, target_user_id, interaction_type, interaction_value,
+               datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            if self.policy == 'block':
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _next_batch(self):
+        """Wait up to flush_interval for a batch of at most flush_size rows"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(self.INSERT_SQL, batch)
+            self._count('written', len(batch))
+        except sqlite3.Error as e:
+            logger.error(f"Error writing {len(batch)} interactions: {str(e)}")
+            if len(batch) == 1:
+                self._count('dropped')
+                return
+            self._count('failed_batches')
+            # Retry row by row so one bad row does not take the rest of the batch with it
+            for row in batch:
+                self._write(conn, [row])
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+            # Final drain on shutdown
+            while True:
+                batch = []
+                while len(batch) < self.flush_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    break
+                self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def close(self, timeout=5.0):
+        """Stop the writer thread after flushing everything still queued"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._counter_lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+# Default weights for client-reported interactions
+INTERACTION_WEIGHTS = {
+    'view': 0.1,
+    'like': 1.0,
+    'skip': -0.5,
+    'message': 1.0,
+    'workout_together': 2.0,
+    'block': -2.0,
+}
+
+interaction_writer = InteractionWriter(
+    DATABASE,
+    flush_interval=float(os.environ.get('INTERACTION_FLUSH_INTERVAL', 1.0)),
+    flush_size=int(os.environ.get('INTERACTION_FLUSH_SIZE', 200)),
+    max_queue=int(os.environ.get('INTERACTION_QUEUE_SIZE', 10000)),
+    policy=os.environ.get('INTERACTION_QUEUE_POLICY', 'drop'),
+)
+atexit.register(interaction_writer.close)
+
 # API Routes
 
 # Authentication routes
@@ -1342,15 +1487,12 @@ def send_connection_request():
                 VALUES (?, ?, ?, 'connection_request')
             ''', (user_id, partner_id, message))
         
-        # Record interaction
-        cursor.execute('''
-            INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value)
-            VALUES (?, ?, 'connection_request', 1.0)
-        ''', (user_id, partner_id))
-        
         conn.commit()
         conn.close()
         
+        # Record interaction outside the request transaction
+        interaction_writer.record(user_id, partner_id, 'connection_request', 1.0)
+        
         return jsonify({'success': True, 'message': 'Connection request sent successfully'})
     
     except Exception as e:
@@ -1390,21 +1532,43 @@ def respond_to_connection():
                 FROM partners WHERE user_id = ? AND partner_id = ?
             ''', (user_id, partner_id, partner_id, user_id))
         
-        # Record interaction
-        cursor.execute('''
-            INSERT INTO user_interactions (user_id, target_user_id, interaction_type, interaction_value)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, partner_id, response, 2.0 if response == 'accepted' else -1.0))
-        
         conn.commit()
         conn.close()
         
+        # Record interaction outside the request transaction
+        interaction_writer.record(user_id, partner_id, response, 2.0 if response == 'accepted' else -1.0)
+        
         return jsonify({'success': True, 'message': f'Connection {response} successfully'})
     
     except Exception as e:
         logger.error(f"Error responding to connection: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/partners/interactions', methods=['POST'])
+def record_interaction():
+    """Record a lightweight recommendation signal (view, like, skip, ...)"""
+    try:
+        data = request.json or {}
+        interaction_type = data.get('interaction_type')
+        try:
+            user_id = int(data.get('user_id'))
+            target_user_id = int(data.get('target_user_id'))
+            value = float(data.get('interaction_value', INTERACTION_WEIGHTS.get(interaction_type, 0.0)))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Invalid interaction'}), 400
+        
+        if user_id <= 0 or target_user_id <= 0 or interaction_type not in INTERACTION_WEIGHTS or not math.isfinite(value):
+            return jsonify({'success': False, 'error': 'Invalid interaction'}), 400
+        
+        if not interaction_writer.record(user_id, target_user_id, interaction_type, value):
+            return jsonify({'success': False, 'error': 'Interaction queue is full'}), 503
+        
+        return jsonify({'success': True}), 202
+    
+    except Exception as e:
+        logger.error(f"Error recording interaction: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/partners/matches/<int:user_id>', methods=['GET'])
 def get_user_matches(user_id):
     """Get user's accepted partner matches"""
@@ -1454,7 +1618,8 @@ def health_check():
     return jsonify({
         'success': True,
         'message': 'Fitness App API is running',
-        'timestamp': datetime.datetime.utcnow().isoformat()
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'interaction_writer': interaction_writer.stats()
     }), 200
 
 # Keep all existing routes from the previous backend...